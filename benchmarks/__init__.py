@@ -0,0 +1,5 @@
+"""
+benchmarks for the stockcount report pipeline
+
+Run a benchmark with ``python -m benchmarks.<name>`` from the repo root.
+"""
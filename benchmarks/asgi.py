@@ -0,0 +1,105 @@
+"""
+An in-process ASGI client, so request latency can be measured without a
+socket or an HTTP library in between
+
+    status, headers, body = await request(app, "/api/v1/...", cookie=...)
+
+Response headers come back as a dict; a header sent more than once, such
+as Set-Cookie, has its values joined by newlines.
+"""
+
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def request(app, url, method="GET", headers=None, cookie=None, body=b""):
+    """Send one request through app, return (status, headers, body)"""
+    parts = urlsplit(url)
+    headers = dict(headers or {})
+    if cookie:
+        headers["cookie"] = cookie
+    if body:
+        headers["content-length"] = str(len(body))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "root_path": "",
+        "headers": [
+            (name.lower().encode(), value.encode()) for name, value in headers.items()
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 80),
+    }
+    received = False
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            for name, value in message.get("headers", []):
+                name, value = name.decode().lower(), value.decode()
+                if name in response["headers"]:
+                    value = f"{response['headers'][name]}\n{value}"
+                response["headers"][name] = value
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+def session_cookie(app, user):
+    """A signed Flask session cookie that logs user in"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    value = serializer.dumps({"_user_id": user.fs_uniquifier, "_fresh": True})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+async def timed(app, url, count, concurrency, **kwargs):
+    """Latencies in ms and statuses of count requests, concurrency at a time"""
+    gate = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], []
+
+    async def one():
+        async with gate:
+            start = time.perf_counter()
+            status, _, _ = await request(app, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, seconds):
+    return {
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "rps": len(latencies) / seconds if seconds else 0.0,
+    }
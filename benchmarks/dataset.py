@@ -0,0 +1,301 @@
+"""
+A synthetic, production-shaped dataset: stores, their items and the
+counts, purchases, sales and waste of every day, plus the recipes and
+fiscal calendar behind them.
+
+    python -m benchmarks.dataset --stores 5 --items 120 --days 365
+
+writes to BENCH_DATABASE_URI (or --database), sqlite:///bench.db when
+neither is set.  The database is dropped and rebuilt with the models and
+migrations, so point it at a scratch database only.  The same arguments
+and --seed always give the same rows.
+
+Every item has a menu item of the same number and a one-ingredient
+recipe.  Counts follow the day's theory (previous count + purchases -
+sales - waste) with a little variance, R365 sales cover every day but
+the newest and Toast sales the last TOAST_DAYS, so both sources and
+their overlap are exercised.
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from benchmarks.utils import BenchConfig, print_table
+from stockcount import create_app, fiscal, migrations, partitions
+from stockcount.models import (
+    Calendar,
+    InvCount,
+    InvItems,
+    RecipeIngredients,
+    Restaurants,
+    StockcountMonthly,
+    StockcountPurchases,
+    StockcountSales,
+    StockcountSalesToast,
+    StockcountWaste,
+    db,
+)
+
+FISCAL_YEAR_START = date(2019, 12, 30)
+CONCEPT = "Bench Grill"
+CASE_PACK = 12
+TOAST_DAYS = 14
+CHUNK = 5000
+TABLES = [
+    Restaurants,
+    InvItems,
+    RecipeIngredients,
+    Calendar,
+    InvCount,
+    StockcountMonthly,
+    StockcountPurchases,
+    StockcountSales,
+    StockcountSalesToast,
+    StockcountWaste,
+]
+
+
+def item_name(number):
+    return f"BEEF Bench Item {number}"
+
+
+def menu_item(number):
+    return f"Bench Plate {number}"
+
+
+def item_id(store_id, number):
+    return store_id * 10000 + number
+
+
+class Writer:
+    """Buffers rows per model and inserts them CHUNK at a time"""
+
+    def __init__(self):
+        self.rows = {model: [] for model in TABLES}
+        self.counts = dict.fromkeys(TABLES, 0)
+
+    def add(self, model, row):
+        rows = self.rows[model]
+        rows.append(row)
+        if len(rows) >= CHUNK:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for model in [model] if model else TABLES:
+            rows = self.rows[model]
+            if rows:
+                db.session.execute(model.__table__.insert(), rows)
+                self.counts[model] += len(rows)
+                rows.clear()
+
+
+def calendar_rows(first_day, last_day):
+    """Fiscal calendar rows for the years holding first_day to last_day"""
+    years_back = max(-((first_day - FISCAL_YEAR_START).days // 364), 0)
+    start = FISCAL_YEAR_START - timedelta(days=364 * years_back)
+    frame = fiscal.generate(start, (last_day - start).days // 364 + 1)
+    for row in frame.to_dict("records"):
+        row = {
+            key: value.isoformat() if isinstance(value, date) else value
+            for key, value in row.items()
+        }
+        row["day"] = date.fromisoformat(row["date"]).strftime("%A")
+        yield row
+
+
+def generate(stores=3, items=40, days=90, end=None, seed=0):
+    """
+    Insert the dataset for stores x items over days ending at end
+    (yesterday by default).  Returns {table name: rows inserted}.
+    """
+    rng = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    first_day = end - timedelta(days=days - 1)
+    writer = Writer()
+
+    fiscal_days = {}
+    for row in calendar_rows(first_day, end):
+        writer.add(Calendar, row)
+        fiscal_days[row["date"]] = row
+
+    for number in range(1, items + 1):
+        writer.add(
+            RecipeIngredients,
+            {
+                "concept": CONCEPT,
+                "menu_item": menu_item(number),
+                "recipe": menu_item(number),
+                "ingredient": item_name(number),
+                "qty": 1.0,
+                "uofm": "Each",
+            },
+        )
+
+    for store_id in range(1, stores + 1):
+        store = f"Bench Store {store_id}"
+        writer.add(
+            Restaurants,
+            {
+                "id": store_id,
+                "locationid": f"BENCH{store_id:03d}",
+                "name": store,
+                "toast_id": store_id,
+                "active": True,
+                "concept": CONCEPT,
+                "toast_guid": f"bench-guid-{store_id}",
+            },
+        )
+        on_hand = {}
+        for number in range(1, items + 1):
+            writer.add(
+                InvItems,
+                {
+                    "id": item_id(store_id, number),
+                    "item_name": item_name(number),
+                    "case_pack": CASE_PACK,
+                    "store_id": store_id,
+                },
+            )
+            on_hand[number] = rng.randint(20, 80)
+        # the store and its items go in before the rows that reference them
+        writer.flush()
+
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            fiscal_day = fiscal_days[day.isoformat()]
+            stamp = {
+                "date": day,
+                "week": fiscal_day["week"],
+                "period": fiscal_day["period"],
+                "year": fiscal_day["year"],
+                "store_id": store_id,
+                "store": store,
+            }
+            for number in range(1, items + 1):
+                add_day(writer, rng, stamp, fiscal_day["dow"], number, on_hand, end)
+    writer.flush()
+    # on Postgres, move the history out of the default partitions
+    connection = db.session.connection()
+    for model in partitions.PARTITIONED:
+        partitions.ensure_partitions(
+            connection, model.__tablename__, partitions.MONTHS_AHEAD, end
+        )
+    db.session.commit()
+    return {model.__tablename__: writer.counts[model] for model in TABLES}
+
+
+def add_day(writer, rng, stamp, dow, number, on_hand, end):
+    """One item's purchases, sales, waste and closing count for a day"""
+    day, store_id = stamp["date"], stamp["store_id"]
+    name = item_name(number)
+    cases = rng.choice((0, 0, 0, 1, 2))
+    sold = rng.randint(4, 24)
+    wasted = rng.choice((0, 0, 0, 0, 1, 2))
+    previous = on_hand[number]
+    theory = max(previous + cases * CASE_PACK - sold - wasted, 0)
+    total = max(theory + rng.randint(-3, 3), 0)
+    on_hand[number] = total
+
+    if cases:
+        writer.add(
+            StockcountPurchases,
+            {
+                **stamp,
+                "transactionid": f"bench-{store_id}-{number}-{day.isoformat()}",
+                "item": name,
+                "quantity": cases,
+                "uofm": "Case",
+                "unit_count": float(cases * CASE_PACK),
+            },
+        )
+    sale = {
+        **stamp,
+        "dow": dow,
+        "menuitem": menu_item(number),
+        "ingredient": name,
+        "concept": CONCEPT,
+        "base_usage": float(sold),
+        "base_uofm": "Each",
+        "count_usage": float(sold),
+    }
+    if day < end:
+        writer.add(StockcountSales, {**sale, "sales_count": float(sold)})
+    if (end - day).days < TOAST_DAYS:
+        writer.add(StockcountSalesToast, {**sale, "sales_count": sold})
+    if wasted:
+        writer.add(
+            StockcountWaste,
+            {
+                **stamp,
+                "dow": dow,
+                "item": name,
+                "uofm": "Each",
+                "quantity": float(wasted),
+                "base_uofm": "Each",
+                "base_qty": float(wasted),
+            },
+        )
+    writer.add(
+        InvCount,
+        {
+            "trans_date": day,
+            "count_time": "PM",
+            "item_name": name,
+            "case_count": total // CASE_PACK,
+            "each_count": total % CASE_PACK,
+            "count_total": total,
+            "previous_total": previous,
+            "theory": theory,
+            "daily_variance": total - theory,
+            "item_id": item_id(store_id, number),
+            "store_id": store_id,
+        },
+    )
+    writer.add(
+        StockcountMonthly,
+        {
+            "date": day,
+            "item_id": item_id(store_id, number),
+            "item_name": name,
+            "store_id": store_id,
+            "count_total": total,
+        },
+    )
+
+
+def rebuild(app):
+    """Drop and recreate every model, then run the migrations"""
+    with app.app_context():
+        db.drop_all()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+        db.create_all()
+        migrations.upgrade(db.engine)
+        fiscal.invalidate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stores", type=int, default=3)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database",
+        default=os.environ.get("BENCH_DATABASE_URI", "sqlite:///bench.db"),
+    )
+    args = parser.parse_args()
+
+    class Config(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = args.database
+
+    app = create_app(Config)
+    rebuild(app)
+    with app.app_context():
+        counts = generate(args.stores, args.items, args.days, seed=args.seed)
+    print_table(["table", "rows"], list(counts.items()))
+
+
+if __name__ == "__main__":
+    main()
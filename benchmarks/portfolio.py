@@ -0,0 +1,53 @@
+"""
+Query count and latency of the portfolio variance view as the number of
+stores grows.  15 stores has to stay under PORTFOLIO_BUDGET_MS.
+
+    python -m benchmarks.portfolio
+"""
+
+import statistics
+
+from benchmarks.utils import QueryCounter, bench_app, print_table, timer
+from benchmarks.variance import REPORT_DATE, RUNS, seed
+from stockcount.main.routes import PORTFOLIO_BUDGET_MS
+from stockcount.main.variance import portfolio_frame
+from stockcount.models import db
+
+ITEMS_PER_STORE = 40
+STORE_COUNTS = (1, 5, 15, 30)
+
+
+def run(store_count):
+    app = bench_app()
+    with app.app_context():
+        store_ids = list(range(1, store_count + 1))
+        for store_id in store_ids:
+            seed(ITEMS_PER_STORE, store_id)
+        with QueryCounter(db.engine) as cold:
+            rows = portfolio_frame(store_ids, REPORT_DATE)
+        with QueryCounter(db.engine) as warm:
+            portfolio_frame(store_ids, REPORT_DATE)
+        timings = []
+        for _ in range(RUNS):
+            result = {}
+            with timer(result):
+                portfolio_frame(store_ids, REPORT_DATE)
+            timings.append(result["ms"])
+        db.session.remove()
+    return len(rows), cold.count, warm.count, statistics.median(timings)
+
+
+def main():
+    results = []
+    for store_count in STORE_COUNTS:
+        rows, cold, warm, median = run(store_count)
+        within = "yes" if median < PORTFOLIO_BUDGET_MS else "NO"
+        results.append((store_count, rows, cold, warm, f"{median:.1f}", within))
+    print_table(
+        ["stores", "rows", "cold queries", "warm queries", "warm ms", "in budget"],
+        results,
+    )
+
+
+if __name__ == "__main__":
+    main()
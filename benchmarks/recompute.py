@@ -0,0 +1,75 @@
+"""
+Time to rebuild a store's inv_count chain after an edit to its first day,
+for growing lengths of history.
+
+    python -m benchmarks.recompute
+"""
+
+import random
+from datetime import date, timedelta
+
+from benchmarks.utils import QueryCounter, bench_app, print_table, timer
+from stockcount.counts.utils import recompute_counts
+from stockcount.models import InvCount, InvItems, db
+
+STORE_ID = 1
+ITEMS = 40
+DAY_COUNTS = (30, 90, 365)
+FIRST_DAY = date(2023, 1, 1)
+
+
+def seed(days):
+    db.session.add_all(
+        InvItems(
+            id=item_id,
+            item_name=f"BEEF Item {item_id}",
+            case_pack=12,
+            store_id=STORE_ID,
+        )
+        for item_id in range(1, ITEMS + 1)
+    )
+    rows = []
+    for offset in range(days):
+        for item_id in range(1, ITEMS + 1):
+            total = random.randint(20, 80)
+            rows.append(
+                {
+                    "trans_date": FIRST_DAY + timedelta(days=offset),
+                    "count_time": "PM",
+                    "item_name": f"BEEF Item {item_id}",
+                    "case_count": 0,
+                    "each_count": total,
+                    "count_total": total,
+                    "previous_total": 0,
+                    "theory": 0,
+                    "daily_variance": 0,
+                    "item_id": item_id,
+                    "store_id": STORE_ID,
+                }
+            )
+    db.session.execute(InvCount.__table__.insert(), rows)
+    db.session.commit()
+
+
+def run(days):
+    app = bench_app()
+    with app.app_context():
+        seed(days)
+        result = {}
+        with QueryCounter(db.engine) as counter, timer(result):
+            updated = recompute_counts(STORE_ID, FIRST_DAY)
+            db.session.commit()
+        db.session.remove()
+    return days * ITEMS, updated, counter.count, result["ms"]
+
+
+def main():
+    results = []
+    for days in DAY_COUNTS:
+        rows, updated, queries, ms = run(days)
+        results.append((days, rows, updated, queries, f"{ms:.0f}"))
+    print_table(["days", "counts", "updated", "queries", "ms"], results)
+
+
+if __name__ == "__main__":
+    main()
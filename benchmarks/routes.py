@@ -0,0 +1,187 @@
+"""
+Latency and query count of the main pages on the synthetic dataset, the
+numbers to take before and after every performance change.
+
+    python -m benchmarks.routes --stores 3 --items 40 --days 90
+
+The dataset (see benchmarks.dataset) is rebuilt on every run in an
+in-memory sqlite database, or in BENCH_DATABASE_URI / --database when
+set, so two runs with the same arguments time the same rows, and rolled
+up as ``flask sales rollup`` would after a deploy.  Pages are
+requested through the Flask test client as a logged-in user of every
+store.  report_cache is off unless --cache is given, so each request
+does its full work; the first request is reported apart from the rest.
+
+Writes are timed too: every count POST enters a new day after the
+dataset and every update_count_all POST changes the newest day's counts.
+Both redirect to the count page whether or not they wrote anything, so
+after each one the rows are checked, outside the timing.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import uuid
+from datetime import timedelta
+
+from benchmarks import dataset
+from benchmarks.utils import BenchConfig, QueryCounter, print_table, timer
+from stockcount import create_app
+from stockcount.counts.rollup import drain_rollup
+from stockcount.models import InvCount, Restaurants, Users, db
+
+RUNS = 20
+
+
+def count_form(store_id, items, day, each, csrf=None):
+    """
+    CountForm data setting every item of store_id to 1 case + each, with
+    csrf as the form's and every subform's token when CSRF is on
+    """
+    data = {"transdate": day.isoformat(), "am_pm": "PM", "submit": "Submit!"}
+    if csrf:
+        data["csrf_token"] = csrf
+    for index in range(items):
+        number = index + 1
+        if csrf:
+            data[f"counts-{index}-csrf_token"] = csrf
+        data[f"counts-{index}-itemname"] = dataset.item_name(number)
+        data[f"counts-{index}-item_id"] = str(dataset.item_id(store_id, number))
+        data[f"counts-{index}-casecount"] = "1"
+        data[f"counts-{index}-eachcount"] = str(each)
+    return data
+
+
+def day_counts(app, store_id, day):
+    """each_count of every item counted by store_id on day"""
+    with app.app_context():
+        return [
+            each
+            for (each,) in db.session.query(InvCount.each_count).filter_by(
+                store_id=store_id, trans_date=day
+            )
+        ]
+
+
+def pages(app, items, last_day):
+    """
+    name -> (expected status, request arguments for run number n, check
+    that run n wrote its rows or None)
+    """
+    store_id = 1
+    return {
+        "report": (200, lambda n: ("GET", "/report/", None), None),
+        "report_details": (
+            200,
+            lambda n: (
+                "GET",
+                f"/report/{dataset.item_id(store_id, 1)}/details",
+                None,
+            ),
+            None,
+        ),
+        "sales": (200, lambda n: ("GET", "/sales/", None), None),
+        "count POST": (
+            302,
+            lambda n: (
+                "POST",
+                "/count/",
+                count_form(store_id, items, last_day + timedelta(n + 1), 0),
+            ),
+            lambda n: len(day_counts(app, store_id, last_day + timedelta(n + 1)))
+            == items,
+        ),
+        "update_count_all POST": (
+            302,
+            lambda n: (
+                "POST",
+                f"/count/{last_day.isoformat()}/update",
+                count_form(store_id, items, last_day, n % 2),
+            ),
+            lambda n: set(day_counts(app, store_id, last_day)) == {n % 2},
+        ),
+    }
+
+
+def login(app, client):
+    """Add a user with every store and log the test client in as them"""
+    with app.app_context():
+        user = Users(
+            email="bench@example.com",
+            active=True,
+            fs_uniquifier=uuid.uuid4().hex,
+            stores=Restaurants.query.all(),
+        )
+        db.session.add(user)
+        db.session.commit()
+        uniquifier = user.fs_uniquifier
+    with client.session_transaction() as session:
+        session["_user_id"] = uniquifier
+        session["_fresh"] = True
+        session["store"] = 1
+
+
+def measure(app, client, expected, make_request, runs, check=None):
+    """(first request queries, median queries, median ms, p95 ms)"""
+    with app.app_context():
+        engine = db.engine
+    queries, timings = [], []
+    for n in range(runs + 1):
+        method, url, data = make_request(n)
+        result = {}
+        with QueryCounter(engine) as counter, timer(result):
+            response = client.open(url, method=method, data=data)
+        if response.status_code != expected:
+            sys.exit(f"{method} {url} answered {response.status_code}")
+        if check is not None and not check(n):
+            sys.exit(f"{method} {url} answered {expected} but wrote nothing")
+        queries.append(counter.count)
+        timings.append(result["ms"])
+    first, rest = queries[0], queries[1:]
+    timings = sorted(timings[1:])
+    p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+    return first, statistics.median(rest), statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stores", type=int, default=3)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--cache", action="store_true", help="keep report_cache on")
+    parser.add_argument(
+        "--database", default=os.environ.get("BENCH_DATABASE_URI", "sqlite://")
+    )
+    args = parser.parse_args()
+
+    class Config(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = args.database
+        REPORT_CACHE_ENABLED = args.cache
+
+    app = create_app(Config)
+    dataset.rebuild(app)
+    with app.app_context():
+        counts = dataset.generate(args.stores, args.items, args.days, seed=args.seed)
+        last_day = db.session.query(db.func.max(InvCount.trans_date)).scalar()
+        drain_rollup([store.id for store in Restaurants.query], build=True)
+    print_table(["table", "rows"], list(counts.items()))
+    print()
+
+    client = app.test_client()
+    login(app, client)
+    results = []
+    for name, (expected, make_request, check) in pages(
+        app, args.items, last_day
+    ).items():
+        first, queries, median, p95 = measure(
+            app, client, expected, make_request, args.runs, check
+        )
+        results.append((name, first, queries, f"{median:.1f}", f"{p95:.1f}"))
+    print_table(["page", "first queries", "queries", "median ms", "p95 ms"], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Time from create_app() to the first response as unrelated tables pile up
+in the database.  Startup should stay flat; the reflect column shows
+what the old full-schema db.reflect() cost on the same database.
+
+    python -m benchmarks.startup
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine
+
+from benchmarks.utils import BenchConfig, print_table
+from stockcount import create_app
+from stockcount.models import db
+
+EXTRA_TABLES = (0, 100, 500, 2000)
+RUNS = 5
+
+
+def make_database(path, extra_tables):
+    """A sqlite file with the app's tables and extra_tables others"""
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    others = MetaData()
+    for number in range(extra_tables):
+        Table(
+            f"other_{number}",
+            others,
+            Column("id", Integer, primary_key=True),
+            Column("name", String(80)),
+        )
+    others.create_all(engine)
+    engine.dispose()
+
+
+def boot(path):
+    """ms for create_app(), and for create_app() through the first response"""
+
+    class Config(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{path}"
+        # the login page renders csrf_token(), which needs it
+        WTF_CSRF_ENABLED = True
+
+    start = time.perf_counter()
+    app = create_app(Config)
+    created = time.perf_counter()
+    response = app.test_client().get("/login")
+    done = time.perf_counter()
+    assert response.status_code == 200, response.status_code
+    with app.app_context():
+        reflect_start = time.perf_counter()
+        MetaData().reflect(bind=db.engine)  # what db.reflect() used to do
+        reflected = time.perf_counter()
+        db.engine.dispose()
+    return (
+        (created - start) * 1000,
+        (done - start) * 1000,
+        (reflected - reflect_start) * 1000,
+    )
+
+
+def main():
+    create_app(BenchConfig)  # pay the imports once, outside the timings
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for extra_tables in EXTRA_TABLES:
+            path = os.path.join(directory, f"startup_{extra_tables}.db")
+            make_database(path, extra_tables)
+            runs = [boot(path) for _ in range(RUNS)]
+            medians = [statistics.median(run[i] for run in runs) for i in range(3)]
+            results.append((extra_tables, *(f"{ms:.1f}" for ms in medians)))
+    print_table(
+        ["extra tables", "create_app ms", "first response ms", "reflect ms"], results
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+A local stand-in for the two Toast endpoints the importer uses
+
+    python -m benchmarks.toast_standin --port 8765 --orders 600
+
+then point TOAST_API_ACCESS_URL at http://127.0.0.1:8765 and run
+``flask toast pull``.  Orders are generated deterministically from the
+restaurant guid and business date, so repeated pulls return the same
+data and the load can be checked for idempotence.
+"""
+
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MENU_ITEMS = [
+    "Burger",
+    "Cheeseburger",
+    "Fries",
+    "Wings 10pc",
+    "Sirloin 10oz",
+    "Pork Chop",
+    "Crab Cake",
+    "Caesar Salad",
+]
+
+
+def make_orders(guid, business_date, count, menu_items=MENU_ITEMS):
+    rng = random.Random(f"{guid}:{business_date}")
+    orders = []
+    for number in range(count):
+        selections = [
+            {
+                "displayName": rng.choice(menu_items),
+                "quantity": rng.choice([1, 1, 1, 2, 3]),
+                "voided": rng.random() < 0.02,
+            }
+            for _ in range(rng.randint(1, 5))
+        ]
+        orders.append(
+            {
+                "guid": f"{guid}-{business_date}-{number}",
+                "businessDate": int(business_date),
+                "voided": rng.random() < 0.01,
+                "checks": [{"voided": False, "selections": selections}],
+            }
+        )
+    return orders
+
+
+def make_handler(orders_per_day, menu_items=MENU_ITEMS):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if self.path.endswith("/authentication/v1/authentication/login"):
+                token = {"accessToken": "stand-in", "expiresIn": 86400}
+                self._send(200, {"token": token})
+            else:
+                self._send(404, {})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith("/orders/v2/ordersBulk"):
+                return self._send(404, {})
+            params = parse_qs(url.query)
+            page = int(params.get("page", ["1"])[0])
+            size = int(params.get("pageSize", ["100"])[0])
+            guid = self.headers.get("Toast-Restaurant-External-ID", "")
+            orders = make_orders(
+                guid, params["businessDate"][0], orders_per_day, menu_items
+            )
+            self._send(200, orders[(page - 1) * size : page * size])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, orders_per_day=600, menu_items=MENU_ITEMS):
+    """Start the stand-in on a thread, return the server (server_address)"""
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), make_handler(orders_per_day, menu_items)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--orders", type=int, default=600, help="orders per day")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", args.port), make_handler(args.orders)
+    )
+    print(f"Toast stand-in on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
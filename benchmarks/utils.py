@@ -0,0 +1,58 @@
+"""shared helpers for the benchmarks"""
+
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from stockcount import create_app
+from stockcount.config import Config
+from stockcount.models import db
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    WTF_CSRF_ENABLED = False
+
+
+def bench_app(config_class=BenchConfig):
+    """Return an app with every model created in an empty database"""
+    app = create_app(config_class)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+class QueryCounter:
+    """Count the statements sent to the database while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+@contextmanager
+def timer(result):
+    start = time.perf_counter()
+    yield
+    result["ms"] = (time.perf_counter() - start) * 1000
+
+
+def print_table(headers, rows):
+    widths = [
+        max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)
+    ]
+    print("  ".join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(c).rjust(w) for c, w in zip(row, widths)))
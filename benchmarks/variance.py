@@ -0,0 +1,128 @@
+"""
+Query count and latency of the daily variance report as the number of
+tracked items grows.  Both should stay flat, whether the day still has to
+be materialized (cold) or is read from stockcount_variance_daily (warm).
+
+    python -m benchmarks.variance
+"""
+
+import random
+import statistics
+from datetime import date, timedelta
+
+from benchmarks.utils import QueryCounter, bench_app, print_table, timer
+from stockcount.main.variance import variance_rows
+from stockcount.models import (
+    InvCount,
+    InvItems,
+    Restaurants,
+    StockcountMonthly,
+    StockcountPurchases,
+    StockcountSales,
+    StockcountWaste,
+    db,
+)
+
+STORE_ID = 1
+REPORT_DATE = date(2024, 6, 4)
+ITEM_COUNTS = (10, 40, 160, 640)
+RUNS = 20
+
+
+def seed(item_count, store_id=STORE_ID):
+    store = f"Bench Store {store_id}"
+    db.session.add(Restaurants(id=store_id, name=store, active=True))
+    previous = REPORT_DATE - timedelta(days=1)
+    for number in range(1, item_count + 1):
+        item_id = store_id * 10000 + number
+        name = f"BEEF Bench Item {number}"
+        db.session.add(
+            InvItems(id=item_id, item_name=name, case_pack=12, store_id=store_id)
+        )
+        for day in (previous, REPORT_DATE):
+            total = random.randint(20, 80)
+            db.session.add(
+                InvCount(
+                    trans_date=day,
+                    count_time="PM",
+                    item_name=name,
+                    case_count=0,
+                    each_count=total,
+                    count_total=total,
+                    previous_total=0,
+                    theory=0,
+                    daily_variance=0,
+                    item_id=item_id,
+                    store_id=store_id,
+                )
+            )
+            db.session.add(
+                StockcountMonthly(
+                    date=day,
+                    item_id=item_id,
+                    item_name=name,
+                    store_id=store_id,
+                    count_total=total,
+                )
+            )
+        db.session.add(
+            StockcountPurchases(
+                transactionid=f"bench-{item_id}",
+                date=REPORT_DATE,
+                store_id=store_id,
+                item=name,
+                unit_count=random.randint(0, 24),
+            )
+        )
+        db.session.add(
+            StockcountSales(
+                date=REPORT_DATE,
+                store_id=store_id,
+                store=store,
+                menuitem=f"Menu {number}",
+                ingredient=name,
+                count_usage=random.randint(0, 30),
+            )
+        )
+        db.session.add(
+            StockcountWaste(
+                date=REPORT_DATE,
+                store_id=store_id,
+                store=store,
+                item=name,
+                quantity=random.randint(0, 2),
+            )
+        )
+    db.session.commit()
+
+
+def run(item_count):
+    app = bench_app()
+    with app.app_context():
+        seed(item_count)
+        timings = []
+        with QueryCounter(db.engine) as cold:
+            rows = variance_rows(STORE_ID, REPORT_DATE)
+        with QueryCounter(db.engine) as warm:
+            variance_rows(STORE_ID, REPORT_DATE)
+        for _ in range(RUNS):
+            result = {}
+            with timer(result):
+                variance_rows(STORE_ID, REPORT_DATE)
+            timings.append(result["ms"])
+        db.session.remove()
+    return len(rows), cold.count, warm.count, statistics.median(timings)
+
+
+def main():
+    results = []
+    for item_count in ITEM_COUNTS:
+        rows, cold, warm, median = run(item_count)
+        results.append((item_count, rows, cold, warm, f"{median:.1f}"))
+    print_table(
+        ["items", "rows", "cold queries", "warm queries", "warm median ms"], results
+    )
+
+
+if __name__ == "__main__":
+    main()
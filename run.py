@@ -1,12 +1,13 @@
 import uvicorn
-from asgiref.wsgi import WsgiToAsgi
 import logging
 import sys
 
 from stockcount import create_app
+from stockcount.asgi import AsyncReads
 
 app = create_app()
-asgi_app = WsgiToAsgi(app)
+# /api/async/v1 is served on the event loop, everything else by Flask
+asgi_app = AsyncReads(app)
 # asgi_app.logger = logging.getLogger("uvicorn.error")
 # asgi_app.logger.setLevel(logging.INFO)
 
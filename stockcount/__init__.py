@@ -7,26 +7,42 @@ from flask import Flask
 from flask_wtf.csrf import CSRFProtect
 from importlib import import_module
 
+from stockcount.access import store_access
+from stockcount.cache import report_cache
 from stockcount.config import Config
 from stockcount.models import db, mail, security, user_datastore
+from stockcount.perf import perf_monitor
+from stockcount.pool import engine_options, register
+from stockcount.schema import reflect_tables
 
 
 def register_extensions(app):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     db.init_app(app)
     mail.init_app(app)
     security.init_app(app, user_datastore)
+    report_cache.init_app(app)
+    store_access.init_app(app)
+    perf_monitor.init_app(app)
     csrf = CSRFProtect(app)
 
 
 def register_blueprints(app):
-    for module_name in ("authentication", "counts", "main"):
+    for module_name in ("api", "authentication", "counts", "main"):
         module = import_module("stockcount.{}.routes".format(module_name))
         app.register_blueprint(module.blueprint)
 
 
+def register_commands(app):
+    module = import_module("stockcount.commands")
+    module.register_commands(app)
+
+
 def configure_database(app):
     with app.app_context():
-        db.reflect()
+        # models only; REFLECT_TABLES adds undeclared tables from a snapshot
+        reflect_tables(app)
+        register("default", db.engine)
 
     @app.teardown_request
     def shutdown_session(exception=None):
@@ -35,7 +51,7 @@ def configure_database(app):
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
     logging.basicConfig(
         level=logging.INFO,  # INFO for production, can be DEBUG for development
@@ -46,6 +62,7 @@ def create_app(config_class=Config):
 
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     configure_database(app)
 
     return app
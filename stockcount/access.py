@@ -0,0 +1,190 @@
+"""
+access.py resolves which stores a user may see, and caches the store list
+
+Both answers change rarely, so they are computed once and kept in the
+process:
+
+    stores      every restaurant, sorted by name, as read-only Store tuples
+    grants      stockcount_store_access, e.g. office logins -> their stores
+    users       user id -> list of accessible store ids
+
+A user's entry is dropped when they log in or their row is written, and
+everything is dropped after any commit that writes roles, restaurants or
+access groups through the app.  Edits made directly in the database are
+picked up after ACCESS_CACHE_SECONDS.
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from flask_security.signals import user_authenticated
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from stockcount.models import (
+    Restaurants,
+    Roles,
+    StockcountStoreAccess,
+    Users,
+    db,
+    stores_users,
+)
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_MODELS = (Restaurants, Roles, StockcountStoreAccess)
+
+# role that may see the debug and telemetry endpoints
+ADMIN_ROLE = "admin"
+
+STORE_COLUMNS = [
+    "id",
+    "locationid",
+    "name",
+    "toast_id",
+    "active",
+    "concept",
+    "toast_guid",
+]
+
+
+class Store(namedtuple("Store", STORE_COLUMNS)):
+    """Detached stand-in for a Restaurants row"""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+class StoreAccess:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reference = None
+        self._users = {}
+
+    def init_app(self, app):
+        self.ttl = app.config.get("ACCESS_CACHE_SECONDS", self.ttl)
+        user_authenticated.connect(self._logged_in, app)
+
+    def _logged_in(self, app, user, **kwargs):
+        self.invalidate(user.id)
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry["loaded"] < self.ttl
+
+    def _load_reference(self):
+        stores = [
+            Store(*row)
+            for row in db.session.query(
+                *(getattr(Restaurants, column) for column in STORE_COLUMNS)
+            ).order_by(Restaurants.name)
+        ]
+        grants = {}
+        rows = db.session.query(
+            StockcountStoreAccess.grant_store_id, StockcountStoreAccess.store_id
+        ).order_by(StockcountStoreAccess.grant_store_id, StockcountStoreAccess.store_id)
+        for grant_store_id, store_id in rows:
+            grants.setdefault(grant_store_id, []).append(store_id)
+        logger.info(f"Loaded {len(stores)} stores and {len(grants)} access groups")
+        return {
+            "stores": stores,
+            "by_id": {store.id: store for store in stores},
+            "grants": grants,
+            "loaded": time.monotonic(),
+        }
+
+    def reference(self):
+        if not self._fresh(self._reference):
+            with self._lock:
+                if not self._fresh(self._reference):
+                    self._reference = self._load_reference()
+        return self._reference
+
+    def stores(self, store_ids=None):
+        """Stores sorted by name, optionally only those in store_ids"""
+        stores = self.reference()["stores"]
+        if store_ids is None:
+            return stores
+        wanted = set(store_ids)
+        return [store for store in stores if store.id in wanted]
+
+    def store(self, store_id):
+        return self.reference()["by_id"].get(store_id)
+
+    @property
+    def loaded(self):
+        """Whether the store list and grants can be read without a query"""
+        return self._fresh(self._reference)
+
+    def cached(self, user_id):
+        """The user's cached store ids, or None"""
+        entry = self._users.get(user_id)
+        return entry["access"] if self._fresh(entry) else None
+
+    def expand(self, user_id, assigned):
+        """
+        Store ids for the stores assigned to a user, in assignment order.
+        A user assigned a store with an access group sees exactly the
+        stores in the group, whatever else they are assigned.
+        """
+        grants = self.reference()["grants"]
+        access = []
+        for store_id in assigned:
+            if store_id in grants:
+                access = list(grants[store_id])
+                break
+            if store_id not in access:
+                access.append(store_id)
+        self._users[user_id] = {"access": access, "loaded": time.monotonic()}
+        return access
+
+    def for_user(self, user):
+        """Store ids the user can access, see expand"""
+        access = self.cached(user.id)
+        if access is not None:
+            return access
+        assigned = db.session.query(stores_users.c.restaurants_id).filter(
+            stores_users.c.users_id == user.id
+        )
+        return self.expand(user.id, [store_id for (store_id,) in assigned])
+
+    def invalidate(self, user_id=None):
+        """Forget one user's access, or everything"""
+        if user_id is not None:
+            self._users.pop(user_id, None)
+            return
+        with self._lock:
+            self._reference = None
+            self._users.clear()
+
+
+store_access = StoreAccess()
+
+
+@event.listens_for(Session, "after_flush")
+def _note_access_writes(session, flush_context):
+    changed = session.info.setdefault("access_changed", set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Users):
+            changed.add(obj.id)
+        elif isinstance(obj, REFERENCE_MODELS):
+            changed.add(None)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_access(session):
+    changed = session.info.pop("access_changed", set())
+    if None in changed:
+        store_access.invalidate()
+        return
+    for user_id in changed:
+        store_access.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_access(session):
+    session.info.pop("access_changed", None)
@@ -0,0 +1,206 @@
+"""
+advisor.py explains the app's real queries and flags full table scans
+
+The read paths behind the report, details, counts and sales pages are run
+once for a sample store, day and item while every SELECT they send is
+captured.  Each distinct statement (see perf.shape) is then EXPLAINed
+with the parameters it was sent with, and the plan is searched for
+sequential scans: "Seq Scan on" on Postgres, a bare "SCAN <table>" in
+SQLite's query plan.  Partitions are kept when pg_inherits ties them to
+one of the app's tables, and a partitioned table is sized by its
+partitions.  Tables under min_rows rows are skipped, the planner rightly
+scans those.  ``flask schema advise`` prints the findings, so a
+new query that misses the indexes shows up before it reaches production.
+Everything runs in a transaction that is rolled back.
+"""
+
+import logging
+import re
+
+from sqlalchemy import event, func, text
+
+from stockcount.counts.rollup import (
+    latest_sale,
+    load_daily,
+    recent_sales,
+    to_date_sales,
+)
+from stockcount.counts.utils import existing_counts, recompute_counts
+from stockcount.main.details import window_start
+from stockcount.main.variance import stores_frame, variance_criteria, variance_query
+from stockcount.models import InvCount, db
+from stockcount.perf import shape
+
+logger = logging.getLogger(__name__)
+
+PG_SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+
+
+def sample():
+    """(store_id, item_id, day) of the newest count"""
+    return (
+        db.session.query(InvCount.store_id, InvCount.item_id, InvCount.trans_date)
+        .order_by(InvCount.trans_date.desc())
+        .first()
+    )
+
+
+def workload(store_id, item_id, day):
+    """The read paths whose statements are explained"""
+    start = window_start(day)
+    db.session.query(InvCount).filter_by(store_id=store_id).order_by(
+        InvCount.trans_date.desc(), InvCount.count_time.desc()
+    ).first()
+    db.session.query(InvCount).filter_by(item_id=item_id).all()
+    existing_counts(store_id, day, "PM", [item_id])
+    recompute_counts(store_id, start, [item_id])
+    stores_frame([store_id], start, day)
+    stores_frame([store_id], start, day, item_ids=[item_id])
+    # read_variance's read, without the refresh that commits
+    db.session.execute(
+        variance_query(*variance_criteria(store_id, [item_id], start, day))
+    ).all()
+    load_daily(store_id, start, day)
+    latest_sale(store_id)
+    to_date_sales(store_id, day)
+    recent_sales(store_id)
+
+
+def capture(function, *args):
+    """[(statement, parameters)] of the SELECTs function sends"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(
+            ("SELECT", "WITH")
+        ):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        function(*args)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return statements
+
+
+def scanned_tables(connection, statement, parameters):
+    """Tables the plan of statement reads with a full scan"""
+    if connection.dialect.name == "postgresql":
+        plan = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        lines = [row[0] for row in plan]
+        pattern = PG_SEQ_SCAN
+    else:
+        plan = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        )
+        lines = [row[-1] for row in plan]
+        pattern = SQLITE_SCAN
+    return lines, {
+        match.group(1)
+        for line in lines
+        if (match := pattern.search(line.strip())) is not None
+    }
+
+
+def parents(connection, tables):
+    """{partition: parent table} for the tables that are partitions"""
+    if connection.dialect.name != "postgresql" or not tables:
+        return {}
+    rows = connection.execute(
+        text(
+            "SELECT child.relname, parent.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE child.relname = ANY(:tables)"
+        ),
+        {"tables": list(tables)},
+    )
+    return dict(rows.all())
+
+
+def table_rows(connection, tables):
+    """
+    Row count, or the planner's estimate on Postgres, per table.  A
+    partitioned table has no estimate of its own, its partitions' add up.
+    """
+    if connection.dialect.name == "postgresql":
+        rows = connection.execute(
+            text(
+                "SELECT relname, CASE WHEN relkind = 'p' THEN ("
+                "SELECT COALESCE(SUM(GREATEST(child.reltuples, 0)), 0) "
+                "FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = pg_class.oid"
+                ") ELSE reltuples END "
+                "FROM pg_class "
+                "WHERE relkind IN ('r', 'p') AND relname = ANY(:tables)"
+            ),
+            {"tables": list(tables)},
+        )
+        return {name: int(max(tuples, 0)) for name, tuples in rows}
+    return {
+        table: connection.execute(
+            db.select(func.count()).select_from(db.metadata.tables[table])
+        ).scalar()
+        for table in tables
+    }
+
+
+def advise(store_id=None, day=None, min_rows=1000):
+    """
+    Explain the workload for store_id on day (by default the newest
+    count's).  Returns {store_id, item_id, day, shapes, findings}, where
+    findings are {sql, tables, plan} for the statements that scan a
+    table of min_rows or more, or None when there are no counts.
+    """
+    found = sample()
+    if found is None:
+        return None
+    item_id = found.item_id
+    if store_id is not None and store_id != found.store_id:
+        item_id = (
+            db.session.query(InvCount.item_id)
+            .filter_by(store_id=store_id)
+            .limit(1)
+            .scalar()
+        )
+        if item_id is None:
+            return None
+    store_id = store_id or found.store_id
+    day = day or found.trans_date
+    try:
+        statements = capture(workload, store_id, item_id, day)
+        connection = db.session.connection()
+        plans = {}
+        for statement, parameters in statements:
+            key = shape(statement)
+            if key not in plans:
+                plans[key] = scanned_tables(connection, statement, parameters)
+        known = set(db.metadata.tables)
+        scanned = set().union(*(tables for _, tables in plans.values()))
+        # the plan names the partitions (<table>_YYYY_MM, <table>_default)
+        parent = parents(connection, scanned - known)
+        scanned = {t for t in scanned if t in known or parent.get(t) in known}
+        sizes = table_rows(connection, scanned)
+    finally:
+        db.session.rollback()
+
+    findings = []
+    for key, (plan, tables) in plans.items():
+        large = sorted(t for t in tables & scanned if sizes.get(t, 0) >= min_rows)
+        if large:
+            findings.append({"sql": key, "tables": large, "plan": plan})
+    logger.info(
+        f"Explained {len(plans)} query shapes for store {store_id} on {day}, "
+        f"{len(findings)} scan a table of {min_rows}+ rows"
+    )
+    return {
+        "store_id": store_id,
+        "item_id": item_id,
+        "day": day,
+        "shapes": len(plans),
+        "findings": findings,
+    }
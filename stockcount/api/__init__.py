@@ -0,0 +1,8 @@
+# -*- encoding: utf-8 -*-
+"""
+Copyright (c) 2024 - dailystockount.com
+"""
+
+from flask import Blueprint
+
+blueprint = Blueprint("api_blueprint", __name__, url_prefix="/api/v1")
@@ -0,0 +1,189 @@
+"""
+api/routes.py serves the variance report and item history as JSON
+
+    GET /api/v1/stores/<store_id>/variance[?date=YYYY-MM-DD]
+    GET /api/v1/items/<item_id>/history[?date=YYYY-MM-DD]
+    GET /api/v1/items/<item_id>/counts?start=YYYY-MM-DD[&end=YYYY-MM-DD]
+    GET /api/v1/stores/<store_id>/sales[?date=YYYY-MM-DD]
+    GET /api/v1/debug/pool                  (admin)
+
+The payloads come from the same cached computations as the report and
+report_details pages.  Responses carry strong ETags tied to the store's
+data version, so a tablet polling with If-None-Match gets a bodyless 304
+until something for its store changes.  The counts history reaches into
+the Parquet archive (see stockcount.archive) for months moved there.
+"""
+
+import logging
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+from flask import abort, jsonify, request
+from flask_security import auth_required, current_user, roles_required
+from werkzeug.exceptions import HTTPException
+
+from stockcount import db
+from stockcount.access import ADMIN_ROLE, store_access
+from stockcount.archive import COUNT_COLUMNS, history
+from stockcount.api import blueprint
+from stockcount.api.utils import business_date, conditional_json, sales_payload
+from stockcount.cache import report_cache
+from stockcount.counts.rollup import drain_rollup, recent_sales, to_date_sales
+from stockcount.main.details import item_details
+from stockcount.main.variance import variance_rows
+from stockcount.models import InvCount, InvItems
+from stockcount.pool import pool_stats
+from stockcount.sales import resolved_sales
+
+logger = logging.getLogger(__name__)
+eastern = ZoneInfo("America/New_York")
+
+
+@blueprint.errorhandler(HTTPException)
+def json_error(error):
+    return jsonify(error=error.name, message=error.description), error.code
+
+
+def check_access(store_id):
+    if store_id not in store_access.for_user(current_user):
+        logger.error(f"User {current_user.email} denied API access to store {store_id}")
+        abort(403, "You do not have access to that store")
+
+
+def date_arg(name="date"):
+    """?<name>=YYYY-MM-DD, or None when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, f"{name} must be YYYY-MM-DD, not {value!r}")
+
+
+def last_count_date(store_id):
+    last_count = (
+        db.session.query(InvCount.trans_date)
+        .filter(InvCount.store_id == store_id)
+        .order_by(InvCount.trans_date.desc())
+        .limit(1)
+        .scalar()
+    )
+    if last_count is None:
+        abort(404, f"Store {store_id} has no counts")
+    return last_count
+
+
+@blueprint.route("/stores/<int:store_id>/variance")
+@auth_required()
+def store_variance(store_id):
+    """The variance report for a day, the last count day by default"""
+    check_access(store_id)
+    day = date_arg()
+
+    def build():
+        report_date = day or last_count_date(store_id)
+        rows = report_cache.get_or_compute(
+            store_id,
+            ("variance", report_date),
+            lambda: variance_rows(store_id, report_date),
+        )
+        return {
+            "store_id": store_id,
+            "store": store_access.store(store_id).name,
+            "date": report_date,
+            "rows": rows,
+        }
+
+    return conditional_json(store_id, (day or "latest",), build)
+
+
+@blueprint.route("/items/<int:item_id>/history")
+@auth_required()
+def item_history(item_id):
+    """The report_details numbers for an item, through the business date"""
+    item = db.session.get(InvItems, item_id)
+    if item is None:
+        abort(404, f"No item {item_id}")
+    check_access(item.store_id)
+    day = date_arg() or business_date(datetime.now(eastern))
+
+    def build():
+        context = report_cache.get_or_compute(
+            item.store_id,
+            ("details", item.id, day),
+            lambda: item_details(item.store_id, item.id, day),
+        )
+        return {
+            "item_id": item.id,
+            "item_name": item.item_name,
+            "store_id": item.store_id,
+            "date": day,
+            **context,
+        }
+
+    return conditional_json(item.store_id, (item.id, day), build)
+
+
+@blueprint.route("/items/<int:item_id>/counts")
+@auth_required()
+def item_counts(item_id):
+    """Every stored count of an item from start through end, archive included"""
+    item = db.session.get(InvItems, item_id)
+    if item is None:
+        abort(404, f"No item {item_id}")
+    check_access(item.store_id)
+    start = date_arg("start")
+    if start is None:
+        abort(400, "start is required")
+    end = date_arg("end") or business_date(datetime.now(eastern))
+
+    def build():
+        frame = history(
+            InvCount,
+            [item.store_id],
+            start,
+            end,
+            COUNT_COLUMNS,
+            where={"item_id": [item.id]},
+        )
+        return {
+            "item_id": item.id,
+            "item_name": item.item_name,
+            "store_id": item.store_id,
+            "start": start,
+            "end": end,
+            "counts": frame.drop(columns=["store_id", "item_id"]).to_dict("records"),
+        }
+
+    return conditional_json(item.store_id, (item.id, start, end), build)
+
+
+@blueprint.route("/stores/<int:store_id>/sales")
+@auth_required()
+def store_sales(store_id):
+    """The sales page's numbers: to-date sums, recent days and the day's sales"""
+    check_access(store_id)
+    day = date_arg() or business_date(datetime.now(eastern))
+
+    def build():
+        drain_rollup([store_id])
+        return sales_payload(
+            store_id,
+            day,
+            to_date_sales(store_id, day),
+            recent_sales(store_id),
+            resolved_sales([store_id], day, day, level="menuitem"),
+        )
+
+    return conditional_json(store_id, (day,), build)
+
+
+@blueprint.route("/debug/pool")
+@auth_required()
+@roles_required(ADMIN_ROLE)
+def debug_pool():
+    """Connection pool numbers of the worker that answers"""
+    response = jsonify(pool_stats())
+    response.headers["Cache-Control"] = "no-store"
+    return response
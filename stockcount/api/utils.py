@@ -0,0 +1,101 @@
+"""
+api/utils.py turns report results into conditional, compressed JSON
+
+A response's ETag is a hash of the endpoint, its arguments and the
+store's data version, so it can be checked before anything is computed:
+a matching If-None-Match costs one version lookup and returns 304.
+Bodies are cached by report_cache next to their gzip encoding, which
+carries its own strong ETag ("<tag>-gzip") as RFC 9110 asks.
+"""
+
+import gzip
+import hashlib
+import json
+import math
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app, request
+
+from stockcount.cache import data_version, report_cache
+
+
+def business_date(now):
+    """The reporting day, yesterday until 6pm"""
+    return now.date() if now.hour >= 18 else (now - timedelta(days=1)).date()
+
+
+def plain(value):
+    """Dates to ISO strings, numpy scalars to python, NaN to None"""
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def sales_payload(store_id, day, to_date, recent, current_day):
+    """The sales board: to-date sums, recent days and the day's sales"""
+    dates, items = recent
+    return {
+        "store_id": store_id,
+        "date": day,
+        "to_date": to_date,
+        "recent": {
+            "dates": dates,
+            "items": [
+                {"date": sold, "menuitem": menuitem, "sales_count": sales_count}
+                for sold, menuitem, sales_count in items
+            ],
+        },
+        "current_day": current_day.rename(columns={"sales": "sales_count"})[
+            ["menuitem", "sales_count", "source"]
+        ].to_dict("records"),
+    }
+
+
+def encode(payload):
+    """(json bytes, gzip bytes) for a payload"""
+    body = json.dumps(plain(payload), separators=(",", ":")).encode()
+    return body, gzip.compress(body, compresslevel=6)
+
+
+def make_etag(endpoint, store_id, key, version):
+    raw = ":".join([endpoint, str(store_id), *map(str, key), str(version)])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional_json(store_id, key, build):
+    """
+    Response for build()'s payload, or 304 when the client already has it.
+    key identifies the payload within the store's data version.
+    """
+    version = data_version(store_id)
+    etag = make_etag(request.endpoint, store_id, key, version)
+    tags = [etag, f"{etag}-gzip"]
+
+    matched = [tag for tag in tags if request.if_none_match.contains(tag)]
+    if matched:
+        response = current_app.response_class(status=304)
+        response.set_etag(matched[0])
+    else:
+        body, zipped = report_cache.get_or_compute(
+            store_id, ("api", request.endpoint, *key), lambda: encode(build()), version
+        )
+        response = current_app.response_class(body, mimetype="application/json")
+        response.set_etag(etag)
+        big = len(body) >= current_app.config["API_GZIP_MIN_BYTES"]
+        if big and "gzip" in request.accept_encodings:
+            response.set_data(zipped)
+            response.headers["Content-Encoding"] = "gzip"
+            response.set_etag(tags[1])
+
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,352 @@
+"""
+archive.py moves old count and sales history out of the database into
+compressed Parquet files and reads it back for long-range queries
+
+``flask archive run`` moves every whole month older than
+ARCHIVE_AFTER_MONTHS of inv_count, stockcount_sales,
+stockcount_sales_toast and stockcount_sales_compact to ARCHIVE_DIR:
+
+    <ARCHIVE_DIR>/<table>/store_id=<id>/month=<YYYY-MM>/<uuid>.parquet
+
+one zstd compressed file per store and month and run, sorted by date so
+the row group statistics prune on it.  Each table and month is one
+transaction: the files are written under a hidden ``.<uuid>.parquet``
+name, recorded in stockcount_archive and the rows deleted, and only after
+the commit are the files renamed into place.  Readers fall back to the
+hidden name, so a crash between the two loses nothing.  Rows without a
+store are left alone, nothing reads them.
+
+history() and sales_history() are the transparent reads: the live rows
+plus, for the stores and months stockcount_archive lists in the range,
+the archived ones, read memory-mapped with only the asked for columns and
+the date range pushed down to the row groups.  A range with nothing
+archived costs one manifest lookup.  The pages read their recent window
+straight from the tables and never come here.
+
+Archiving also drops the variance and rollup dirty rows of the month, and
+stockcount_variance_daily and stockcount_sales_rollup are never rebuilt
+from the archive: ``variance refresh`` and ``sales rollup`` start no
+earlier than archived_until().  recompute_counts anchors each item on its
+last archived count, so a full rebuild keeps the oldest live counts right.
+"""
+
+import logging
+import os
+import uuid
+from datetime import date, timedelta
+
+import pandas as pd
+from flask import current_app
+from sqlalchemy import func, select
+
+from stockcount.models import (
+    InvCount,
+    StockcountArchive,
+    StockcountSales,
+    StockcountSalesCompact,
+    StockcountSalesRollupDirty,
+    StockcountSalesToast,
+    StockcountVarianceDirty,
+    db,
+)
+from stockcount.partitions import MIN_COMPACT_MONTHS, add_months, month_start
+from stockcount.sales import MODELS, resolved_sales
+
+logger = logging.getLogger(__name__)
+
+# model -> its date column, for the tables moved to the archive
+ARCHIVED = {
+    InvCount: "trans_date",
+    StockcountSales: "date",
+    StockcountSalesToast: "date",
+    StockcountSalesCompact: "date",
+}
+COMPRESSION = "zstd"
+SALES_KEY = ["store_id", "ingredient", "date"]
+# the inv_count columns of a count history
+COUNT_COLUMNS = [
+    "item_id",
+    "item_name",
+    "count_time",
+    "count_total",
+    "previous_total",
+    "theory",
+    "daily_variance",
+]
+
+
+def archived_before(config=None, today=None):
+    """
+    First day that is never archived under ARCHIVE_AFTER_MONTHS, or None
+    when archiving is off.
+    """
+    config = config if config is not None else current_app.config
+    months = config.get("ARCHIVE_AFTER_MONTHS")
+    if not months:
+        return None
+    if not config.get("ARCHIVE_DIR"):
+        raise ValueError("ARCHIVE_AFTER_MONTHS needs ARCHIVE_DIR")
+    # the sales rollup's YTD still reads the last fiscal year's rows
+    if months < MIN_COMPACT_MONTHS:
+        raise ValueError(f"ARCHIVE_AFTER_MONTHS must be at least {MIN_COMPACT_MONTHS}")
+    return add_months(month_start(today or date.today()), -months)
+
+
+def due_months(connection, model, before):
+    """First days of the months of model's store rows that end before before"""
+    table = model.__table__
+    column = table.c[ARCHIVED[model]]
+    oldest = connection.execute(
+        select(func.min(column)).where(column < before, table.c.store_id.isnot(None))
+    ).scalar()
+    months = []
+    month = month_start(oldest) if oldest else before
+    while month < before:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def part_path(table, store_id, month):
+    """Path of a new archive file, relative to ARCHIVE_DIR"""
+    name = f"{uuid.uuid4().hex}.parquet"
+    return os.path.join(table, f"store_id={store_id}", f"month={month:%Y-%m}", name)
+
+
+def hidden(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}")
+
+
+def archive_month(engine, root, model, month):
+    """Move a month of model's rows to the archive, return the rows moved"""
+    table = model.__table__
+    column = table.c[ARCHIVED[model]]
+    end = add_months(month, 1)
+    in_month = (column >= month, column < end, table.c.store_id.isnot(None))
+    names = [c.name for c in table.columns]
+    staged, moved = [], 0
+    try:
+        with engine.begin() as connection:
+            store_ids = (
+                connection.execute(select(table.c.store_id).where(*in_month).distinct())
+                .scalars()
+                .all()
+            )
+            for store_id in sorted(store_ids):
+                rows = connection.execute(
+                    select(table)
+                    .where(*in_month, table.c.store_id == store_id)
+                    .order_by(column)
+                ).all()
+                frame = pd.DataFrame([tuple(row) for row in rows], columns=names)
+                path = part_path(table.name, store_id, month)
+                final = os.path.join(root, path)
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                frame.to_parquet(
+                    hidden(final),
+                    engine="pyarrow",
+                    compression=COMPRESSION,
+                    index=False,
+                )
+                staged.append(final)
+                connection.execute(
+                    StockcountArchive.__table__.insert().values(
+                        table_name=table.name,
+                        store_id=store_id,
+                        month=month,
+                        path=path,
+                        rows=len(frame),
+                    )
+                )
+                moved += len(frame)
+            connection.execute(table.delete().where(*in_month))
+            # the deletes queued these days; recomputing them now would
+            # drop the archived counts and sales from the stored results
+            for dirty in (StockcountVarianceDirty, StockcountSalesRollupDirty):
+                connection.execute(
+                    dirty.__table__.delete().where(
+                        dirty.store_id.in_(store_ids),
+                        dirty.date >= month,
+                        dirty.date < end,
+                    )
+                )
+    except Exception:
+        for final in staged:
+            if os.path.exists(hidden(final)):
+                os.remove(hidden(final))
+        raise
+    for final in staged:
+        os.replace(hidden(final), final)
+    logger.info(f"Archived {moved} {table.name} rows of {month:%Y-%m}")
+    return moved
+
+
+def apply_archive(engine, config, today=None, dry_run=False):
+    """
+    Move the months before the horizon to the archive, one transaction
+    per table and month.  Returns {table: [months]}, empty when off.
+    """
+    before = archived_before(config, today)
+    if before is None:
+        return {}
+    done = {}
+    for model in ARCHIVED:
+        with engine.connect() as connection:
+            due = due_months(connection, model, before)
+        for month in due:
+            if not dry_run:
+                archive_month(engine, config["ARCHIVE_DIR"], model, month)
+        done[model.__tablename__] = due
+    return done
+
+
+def archived_until(store_id, session=None):
+    """First day after the store's newest archived month, None if none is"""
+    newest = (
+        (session or db.session)
+        .query(func.max(StockcountArchive.month))
+        .filter(StockcountArchive.store_id == store_id)
+        .scalar()
+    )
+    return add_months(newest, 1) if newest else None
+
+
+def archive_files(model, store_ids, start, end):
+    """Paths of the archive files of model for store_ids between start and end"""
+    parts = (
+        db.session.query(StockcountArchive.path)
+        .filter(
+            StockcountArchive.table_name == model.__tablename__,
+            StockcountArchive.store_id.in_(store_ids),
+            StockcountArchive.month >= month_start(start),
+            StockcountArchive.month <= end,
+        )
+        .order_by(StockcountArchive.month, StockcountArchive.id)
+        .all()
+    )
+    if not parts:
+        return []
+    root = current_app.config.get("ARCHIVE_DIR")
+    if not root:
+        raise ValueError(f"{model.__tablename__} is archived but ARCHIVE_DIR is unset")
+    paths = []
+    for (path,) in parts:
+        final = os.path.join(root, path)
+        if not os.path.exists(final) and os.path.exists(hidden(final)):
+            logger.warning(f"Reading {path} under its staged name, never renamed")
+            final = hidden(final)
+        paths.append(final)
+    return paths
+
+
+def read_archive(model, store_ids, start, end, columns, where=None):
+    """
+    Archived rows of model for store_ids between start and end, of
+    columns, where {column: values} holds
+    """
+    date_column = ARCHIVED[model]
+    filters = [(date_column, ">=", start), (date_column, "<=", end)]
+    filters += [(name, "in", list(values)) for name, values in (where or {}).items()]
+    frames = [
+        pd.read_parquet(
+            path,
+            engine="pyarrow",
+            columns=columns,
+            filters=filters,
+            memory_map=True,
+        )
+        for path in archive_files(model, store_ids, start, end)
+    ]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def history(model, store_ids, start, end, columns=None, where=None):
+    """
+    model's rows for store_ids between start and end where {column:
+    values} holds, live and archived, oldest first.  store_id and the
+    date column always come first, then columns (every column by default).
+    """
+    table = model.__table__
+    date_column = ARCHIVED[model]
+    names = ["store_id", date_column]
+    names += [
+        name for name in columns or [c.name for c in table.columns] if name not in names
+    ]
+    rows = db.session.execute(
+        select(*(table.c[name] for name in names)).where(
+            table.c.store_id.in_(store_ids),
+            table.c[date_column] >= start,
+            table.c[date_column] <= end,
+            *(table.c[name].in_(values) for name, values in (where or {}).items()),
+        )
+    ).all()
+    live = pd.DataFrame([tuple(row) for row in rows], columns=names)
+    archived = read_archive(model, store_ids, start, end, names, where)
+    if archived.empty:
+        return live.sort_values(date_column, kind="stable", ignore_index=True)
+    frame = pd.concat([frame for frame in (archived, live) if not frame.empty])
+    return frame.sort_values(date_column, kind="stable", ignore_index=True)
+
+
+def archived_counts(store_id, before=None, item_ids=None):
+    """count_total of each item's last archived count before before"""
+    end = before - timedelta(days=1) if before is not None else date.max
+    where = {"item_id": item_ids} if item_ids is not None else None
+    frame = read_archive(
+        InvCount,
+        [store_id],
+        date.min,
+        end,
+        ["item_id", "trans_date", "count_time", "count_total"],
+        where,
+    )
+    if frame.empty:
+        return {}
+    frame = frame.sort_values(["trans_date", "count_time"], kind="stable")
+    return frame.groupby("item_id")["count_total"].last().to_dict()
+
+
+def archived_usage(store_ids, start, end):
+    """Archived ingredient usage per source, as r365_sales and toast_sales"""
+    parts = []
+    for source, model in MODELS.items():
+        frame = read_archive(model, store_ids, start, end, SALES_KEY + ["count_usage"])
+        parts.append(frame.rename(columns={"count_usage": f"{source}_sales"}))
+    compact = read_archive(
+        StockcountSalesCompact,
+        store_ids,
+        start,
+        end,
+        SALES_KEY + ["source", "count_usage"],
+    )
+    for source in MODELS:
+        frame = compact[compact["source"] == source][SALES_KEY + ["count_usage"]]
+        parts.append(frame.rename(columns={"count_usage": f"{source}_sales"}))
+    return [part for part in parts if not part.empty]
+
+
+def sales_history(store_ids, start, end):
+    """
+    Ingredient sales of stores between start and end, resolved like
+    sales.resolved_sales, with the archived months included
+    """
+    live = resolved_sales(store_ids, start, end)
+    archived = archived_usage(store_ids, start, end)
+    if not archived:
+        return live
+    sources = ["r365_sales", "toast_sales"]
+    frame = (
+        pd.concat([live[SALES_KEY + sources], *archived], ignore_index=True)
+        .astype({source: float for source in sources})
+        .groupby(SALES_KEY, dropna=False, as_index=False)[sources]
+        .sum(min_count=1)
+    )
+    frame["sales"] = frame["r365_sales"].fillna(frame["toast_sales"])
+    frame["source"] = None
+    frame.loc[frame["toast_sales"].notna(), "source"] = "toast"
+    frame.loc[frame["r365_sales"].notna(), "source"] = "r365"
+    return frame.sort_values("date", kind="stable", ignore_index=True)
@@ -0,0 +1,479 @@
+"""
+asgi.py serves the read-heavy JSON endpoints natively on asyncio
+
+    GET /api/async/v1/stores/<store_id>/variance[?date=YYYY-MM-DD]
+    GET /api/async/v1/items/<item_id>/history[?date=YYYY-MM-DD]
+    GET /api/async/v1/stores/<store_id>/sales[?date=YYYY-MM-DD]
+
+AsyncReads is the ASGI app run.py hands to uvicorn.  These paths are
+answered on the event loop through an asyncpg engine, and a request's
+independent queries (access, data version, items, variance, rollup,
+R365 and Toast sales) run together under asyncio.gather.  Every other
+path goes to the Flask app through WsgiToAsgi as before.
+
+Payloads, ETags and report_cache entries are the ones the /api/v1
+routes produce, so either path can answer the other's If-None-Match.
+The async path only reads: when a store has queued variance or rollup
+days, or a day was never materialized, the request runs the WSGI
+computation in a worker thread, which refreshes the tables on the way.
+
+Requests are authenticated from the Flask session cookie on the loop;
+any other credentials (an auth token, the remember cookie) go through
+Flask-Security's auth_required in a worker thread, like /api/v1.  Shared
+report_cache backends are read and written off the loop too.  Off
+Postgres, or without asyncpg installed, the async paths are left to
+Flask, which answers 404.
+"""
+
+import asyncio
+import logging
+import re
+from datetime import date, datetime
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qs
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from asgiref.wsgi import WsgiToAsgi
+from flask_security import auth_required, current_user
+from itsdangerous import BadSignature
+from sqlalchemy import exists, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import (
+    BadRequest,
+    Forbidden,
+    HTTPException,
+    NotFound,
+    Unauthorized,
+)
+from werkzeug.http import parse_accept_header, parse_etags
+
+from stockcount.access import store_access
+from stockcount.api.utils import business_date, encode, make_etag, sales_payload
+from stockcount.cache import MISSING, report_cache
+from stockcount.counts.rollup import (
+    drain_rollup,
+    latest_rolled_query,
+    latest_sale_queries,
+    recent_dates_query,
+    recent_items_query,
+    to_date_query,
+    to_date_totals,
+)
+from stockcount.fiscal import fiscal_calendar
+from stockcount.main.details import (
+    WINDOW_DAYS,
+    details_context,
+    item_details,
+    item_window,
+    window_start,
+)
+from stockcount.main.variance import (
+    FRAME_COLUMNS,
+    ITEM_COLUMNS,
+    STORE_COLUMNS,
+    items_query,
+    variance_query,
+    variance_records,
+    variance_rows,
+    with_names,
+)
+from stockcount.models import (
+    InvCount,
+    InvItems,
+    StockcountDataVersion,
+    StockcountSalesRollupDirty,
+    StockcountVarianceDaily,
+    StockcountVarianceDirty,
+    Users,
+    stores_users,
+)
+from stockcount.pool import TimedAsyncQueuePool, pool_options, register
+from stockcount.sales import sales_frame, sales_query
+
+logger = logging.getLogger(__name__)
+eastern = ZoneInfo("America/New_York")
+
+PREFIX = "/api/async/v1"
+ROUTES = [
+    (re.compile(r"/stores/(\d+)/variance"), "store_variance"),
+    (re.compile(r"/items/(\d+)/history"), "item_history"),
+    (re.compile(r"/stores/(\d+)/sales"), "store_sales"),
+]
+
+
+def async_url(config):
+    """The asyncpg URL for the app's database, or None off Postgres"""
+    url = make_url(
+        config.get("ASYNC_DATABASE_URI") or config["SQLALCHEMY_DATABASE_URI"]
+    )
+    if url.get_backend_name() != "postgresql":
+        return None
+    return url.set(drivername="postgresql+asyncpg")
+
+
+def _frame(rows, columns):
+    return pd.DataFrame([tuple(row) for row in rows], columns=columns)
+
+
+def _queued(model, store_id):
+    return select(exists().where(model.store_id == store_id))
+
+
+class Request:
+    """The parts of an ASGI http scope the handlers read"""
+
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.query_string = scope["query_string"]
+        self.headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        self.args = {
+            name: values[0]
+            for name, values in parse_qs(scope["query_string"].decode()).items()
+        }
+        self.if_none_match = parse_etags(self.headers.get("if-none-match"))
+        self.gzip = "gzip" in parse_accept_header(self.headers.get("accept-encoding"))
+
+    def cookie(self, name):
+        cookies = SimpleCookie()
+        try:
+            cookies.load(self.headers.get("cookie", ""))
+        except CookieError:
+            return None
+        morsel = cookies.get(name)
+        return morsel.value if morsel else None
+
+    def date(self):
+        """?date=YYYY-MM-DD, or None when absent"""
+        value = self.args.get("date")
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise BadRequest(f"date must be YYYY-MM-DD, not {value!r}")
+
+
+class AsyncReads:
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.engine = None
+        self.enabled = app.config.get("ASYNC_READS_ENABLED", True)
+        self._starting = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if (
+            self.enabled
+            and scope["type"] == "http"
+            and scope["method"] in ("GET", "HEAD")
+            and scope["path"].startswith(PREFIX)
+        ):
+            await self.startup()
+            if self.engine is not None:
+                return await self.dispatch(scope, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self):
+        if self.engine is not None or not self.enabled:
+            return
+        async with self._starting:
+            if self.engine is None and self.enabled:
+                await self._start()
+
+    async def _start(self):
+        url = async_url(self.app.config)
+        if url is None:
+            logger.info("Async reads need Postgres, serving every path from Flask")
+            self.enabled = False
+            return
+        try:
+            self.engine = create_async_engine(
+                url, **pool_options(self.app.config, TimedAsyncQueuePool)
+            )
+        except ImportError:
+            logger.warning("asyncpg is not installed, serving every path from Flask")
+            self.enabled = False
+            return
+        register("async", self.engine.sync_engine)
+        await self.run_sync(fiscal_calendar)
+        logger.info(f"Async reads on {url.render_as_string(hide_password=True)}")
+
+    async def shutdown(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def run_sync(self, function, *args):
+        """Call a WSGI-side function in a worker thread, inside the app"""
+
+        def call():
+            with self.app.app_context():
+                return function(*args)
+
+        return await asyncio.to_thread(call)
+
+    async def cache(self, function, *args):
+        """Call report_cache, in a worker thread when its backend does I/O"""
+        if report_cache.shared:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def fetch(self, query):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(query)).all()
+
+    async def scalar(self, query):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(query)).scalar()
+
+    async def dispatch(self, scope, send):
+        request = Request(scope)
+        path = request.path[len(PREFIX) :]
+        headers = [("cache-control", "private, no-cache"), ("vary", "Accept-Encoding")]
+        try:
+            for pattern, name in ROUTES:
+                match = pattern.fullmatch(path)
+                if match:
+                    handler = getattr(self, name)
+                    status, body, extra = await handler(request, int(match[1]))
+                    break
+            else:
+                raise NotFound()
+        except HTTPException as error:
+            status, extra = error.code, [("content-type", "application/json")]
+            body, _ = encode({"error": error.name, "message": error.description})
+        headers += extra + [("content-length", str(len(body)))]
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(k.encode(), v.encode()) for k, v in headers],
+            }
+        )
+        body = b"" if scope["method"] == "HEAD" else body
+        await send({"type": "http.response.body", "body": body})
+
+    def authenticated(self, request):
+        """Id of the user Flask-Security authenticates request as, or None"""
+        with self.app.test_request_context(
+            request.path,
+            headers=request.headers,
+            query_string=request.query_string.decode(),
+        ):
+            # Flask-Principal's before_request sets the identity the
+            # token loader expects
+            self.app.preprocess_request()
+            # auth_required answers with the unauthenticated response
+            if auth_required()(lambda: None)() is not None:
+                return None
+            return current_user.id
+
+    async def access(self, request):
+        """Store ids the request's user can access"""
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        cookie = request.cookie(self.app.config["SESSION_COOKIE_NAME"])
+        max_age = int(self.app.permanent_session_lifetime.total_seconds())
+        try:
+            session = serializer.loads(cookie, max_age=max_age) if cookie else {}
+        except BadSignature:
+            session = {}
+        user_id = session.get("_user_id") and await self.scalar(
+            select(Users.id).where(
+                Users.fs_uniquifier == session["_user_id"], Users.active.is_(True)
+            )
+        )
+        if not user_id:
+            user_id = await asyncio.to_thread(self.authenticated, request)
+        if not user_id:
+            raise Unauthorized("Log in to use the API")
+        if not store_access.loaded:
+            await self.run_sync(store_access.reference)
+        access = store_access.cached(user_id)
+        if access is None:
+            assigned = await self.fetch(
+                select(stores_users.c.restaurants_id).where(
+                    stores_users.c.users_id == user_id
+                )
+            )
+            access = store_access.expand(user_id, [row[0] for row in assigned])
+        return access
+
+    def check_access(self, access, store_id):
+        if store_id not in access:
+            raise Forbidden("You do not have access to that store")
+
+    async def conditional(self, request, endpoint, store_id, key, version, build):
+        """The async twin of api.utils.conditional_json"""
+        endpoint = f"api_blueprint.{endpoint}"
+        etag = make_etag(endpoint, store_id, key, version)
+        tags = [etag, f"{etag}-gzip"]
+        matched = [tag for tag in tags if request.if_none_match.contains(tag)]
+        if matched:
+            return 304, b"", [("etag", f'"{matched[0]}"')]
+
+        cache_key = ("api", endpoint, *key)
+        encoded = await self.cache(report_cache.get, store_id, cache_key, version)
+        if encoded is MISSING:
+            encoded = encode(await build())
+            await self.cache(report_cache.set, store_id, cache_key, version, encoded)
+        body, zipped = encoded
+        headers = [("content-type", "application/json")]
+        if request.gzip and len(body) >= self.app.config["API_GZIP_MIN_BYTES"]:
+            return 200, zipped, headers + [
+                ("content-encoding", "gzip"),
+                ("etag", f'"{tags[1]}"'),
+            ]
+        return 200, body, headers + [("etag", f'"{etag}"')]
+
+    def version_query(self, store_id):
+        return select(StockcountDataVersion.version).where(
+            StockcountDataVersion.store_id == store_id
+        )
+
+    async def store_variance(self, request, store_id):
+        day = request.date()
+        access, version, last_count = await asyncio.gather(
+            self.access(request),
+            self.scalar(self.version_query(store_id)),
+            self.scalar(
+                select(func.max(InvCount.trans_date)).where(
+                    InvCount.store_id == store_id
+                )
+            ),
+        )
+        self.check_access(access, store_id)
+        report_date = day or last_count
+        if report_date is None:
+            raise NotFound(f"Store {store_id} has no counts")
+
+        async def build():
+            queued, items, rows = await asyncio.gather(
+                self.scalar(_queued(StockcountVarianceDirty, store_id)),
+                self.fetch(items_query([store_id])),
+                self.fetch(
+                    variance_query(
+                        StockcountVarianceDaily.store_id == store_id,
+                        StockcountVarianceDaily.date == report_date,
+                    )
+                ),
+            )
+            items, frame = _frame(items, ITEM_COLUMNS), _frame(rows, STORE_COLUMNS)
+            if queued or len(frame) < len(items):
+                rows = await self.run_sync(variance_rows, store_id, report_date)
+            else:
+                rows = variance_records(with_names(frame, items))
+            return {
+                "store_id": store_id,
+                "store": store_access.store(store_id).name,
+                "date": report_date,
+                "rows": rows,
+            }
+
+        return await self.conditional(
+            request, "store_variance", store_id, (day or "latest",), version or 0, build
+        )
+
+    async def item_history(self, request, item_id):
+        day = request.date() or business_date(datetime.now(eastern))
+        access, items = await asyncio.gather(
+            self.access(request),
+            self.fetch(
+                select(InvItems.store_id, InvItems.id, InvItems.item_name).where(
+                    InvItems.id == item_id
+                )
+            ),
+        )
+        if not items:
+            raise NotFound(f"No item {item_id}")
+        store_id, _, item_name = items[0]
+        self.check_access(access, store_id)
+        version = await self.scalar(self.version_query(store_id))
+
+        async def build():
+            queued, rows = await asyncio.gather(
+                self.scalar(_queued(StockcountVarianceDirty, store_id)),
+                self.fetch(
+                    variance_query(
+                        StockcountVarianceDaily.store_id == store_id,
+                        StockcountVarianceDaily.item_id == item_id,
+                        StockcountVarianceDaily.date >= window_start(day),
+                        StockcountVarianceDaily.date <= day,
+                    )
+                ),
+            )
+            frame = _frame(rows, STORE_COLUMNS)
+            if queued or len(frame) < WINDOW_DAYS:
+                context = await self.run_sync(item_details, store_id, item_id, day)
+            else:
+                frame = with_names(frame, _frame(items, ITEM_COLUMNS))
+                context = details_context(item_window(frame[FRAME_COLUMNS]), day)
+            return {
+                "item_id": item_id,
+                "item_name": item_name,
+                "store_id": store_id,
+                "date": day,
+                **context,
+            }
+
+        return await self.conditional(
+            request, "item_history", store_id, (item_id, day), version or 0, build
+        )
+
+    async def store_sales(self, request, store_id):
+        day = request.date() or business_date(datetime.now(eastern))
+        access, version = await asyncio.gather(
+            self.access(request), self.scalar(self.version_query(store_id))
+        )
+        self.check_access(access, store_id)
+
+        async def build():
+            queued, rolled, *sold = await asyncio.gather(
+                self.scalar(_queued(StockcountSalesRollupDirty, store_id)),
+                self.scalar(latest_rolled_query(store_id)),
+                *(self.scalar(query) for query in latest_sale_queries(store_id)),
+            )
+            newest = max((sale for sale in sold if sale is not None), default=None)
+            # a store never rolled up waits for flask sales rollup
+            if queued or (newest and rolled is not None and newest > rolled):
+                await self.run_sync(drain_rollup, [store_id])
+
+            with self.app.app_context():
+                year_start, _ = fiscal_calendar().year(day)
+            totals, dates, current_day = await asyncio.gather(
+                self.fetch(to_date_query(store_id, year_start, day)),
+                self.fetch(recent_dates_query(store_id)),
+                self.fetch(sales_query([store_id], day, day, level="menuitem")),
+            )
+            dates = [row[0] for row in dates]
+            items = await self.fetch(recent_items_query(store_id, dates))
+            with self.app.app_context():
+                to_date = to_date_totals(totals, day) if totals else []
+            return sales_payload(
+                store_id,
+                day,
+                to_date,
+                (dates, items),
+                sales_frame(current_day, level="menuitem"),
+            )
+
+        return await self.conditional(
+            request, "store_sales", store_id, (day,), version or 0, build
+        )
@@ -20,17 +20,13 @@ from wtforms.fields import DateField
 from wtforms.validators import DataRequired, Email
 from wtforms_sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
 
-from stockcount.models import Restaurants
+from stockcount.access import store_access
 
 # login and registration
 
 
 def store_query():
-    return (
-        Restaurants.query.filter(Restaurants.active == "true")
-        .order_by(Restaurants.name)
-        .all()
-    )
+    return [store for store in store_access.stores() if store.active]
 
 
 class LoginForm(FlaskForm):
@@ -60,5 +56,6 @@ class StoreForm(FlaskForm):
         "Select Stores",
         query_factory=store_query,
         get_label="name",
+        get_pk=lambda store: store.id,
     )
     submit3 = SubmitField("Submit")
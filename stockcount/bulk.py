@@ -0,0 +1,110 @@
+"""
+bulk.py holds the set-based write helpers shared by the importers and
+the materialized tables
+"""
+
+import csv
+import io
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from stockcount.models import db
+
+
+def _insert(table, session):
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def upsert(table, rows, index_elements, update_columns=None, session=None):
+    """
+    INSERT ... ON CONFLICT for a list of row dicts in one executemany.
+
+    Conflicting rows are updated with every non-key column unless
+    update_columns says otherwise; an empty list means DO NOTHING.
+    """
+    if not rows:
+        return 0
+    session = session or db.session
+    if update_columns is None:
+        update_columns = [
+            column.name
+            for column in table.columns
+            if column.name not in index_elements and column.name in rows[0]
+        ]
+    stmt = _insert(table, session)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={name: stmt.excluded[name] for name in update_columns},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    session.execute(stmt, rows)
+    return len(rows)
+
+
+def increment(table, keys, index_elements, column, session=None):
+    """Add one to a counter column for each key row, creating it at 1"""
+    if not keys:
+        return 0
+    session = session or db.session
+    stmt = _insert(table, session)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: table.c[column] + 1},
+    )
+    session.execute(stmt, [{**key, column: 1} for key in keys])
+    return len(keys)
+
+
+def copy_upsert(table, rows, index_elements, session=None):
+    """
+    upsert() through COPY on Postgres: the rows are streamed into a temp
+    staging table and merged with one INSERT ... SELECT ... ON CONFLICT.
+    Other databases fall back to upsert().  Empty strings load as NULL.
+    """
+    if not rows:
+        return 0
+    session = session or db.session
+    if session.get_bind().dialect.name != "postgresql":
+        return upsert(table, rows, index_elements, session=session)
+
+    columns = list(rows[0])
+    names = ", ".join(f'"{name}"' for name in columns)
+    updates = ", ".join(
+        f'"{name}" = EXCLUDED."{name}"'
+        for name in columns
+        if name not in index_elements
+    )
+    conflict = ", ".join(f'"{name}"' for name in index_elements)
+    staging = f"stage_{table.name}"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[name] for name in columns])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+            f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.execute(f"TRUNCATE {staging}")
+        cursor.copy_expert(
+            f"COPY {staging} ({names}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+    session.execute(
+        text(
+            f"INSERT INTO {table.name} ({names}) SELECT {names} FROM {staging} "
+            f"ON CONFLICT ({conflict}) "
+            + (f"DO UPDATE SET {updates}" if updates else "DO NOTHING")
+        )
+    )
+    return len(rows)
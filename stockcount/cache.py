@@ -0,0 +1,232 @@
+"""
+cache.py is the versioned per-store cache for report results
+
+Entries are keyed by store, the caller's key (for example the last count
+date) and the store's data version.  The version lives in
+stockcount_data_version and is bumped in the same transaction as any
+write to counts, items, purchases, sales or waste for that store, by the
+app or by the database triggers for outside loads.  A bump makes every
+older entry unreachable, so nothing has to be deleted.
+
+Backends:
+    lru         bounded in-process LRU (default)
+    filesystem  pickles in REPORT_CACHE_DIR, shared by every worker on a host
+    module:Cls  any class with get/set/incr(key, amount), e.g. a redis client
+
+Hit and miss counts are kept in memory per process.  With a shared
+backend they are added to its counters every STATS_FLUSH lookups, so a
+cache hit costs no write.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import pickle
+import random
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from importlib import import_module
+
+from stockcount import changes
+from stockcount.bulk import increment
+from stockcount.models import StockcountDataVersion, db
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+STATS_FLUSH = 100
+
+
+class LRUBackend:
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return MISSING
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileSystemBackend:
+    """Local stand-in for a shared cache server, safe across processes"""
+
+    def __init__(self, directory, maxsize=4096):
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha1(key.encode()).hexdigest() + ".pkl"
+        )
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+    def set(self, key, value):
+        # write then rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        if random.random() < 0.01:
+            self.prune()
+
+    def incr(self, key, amount=1):
+        with open(self._path(key) + ".lock", "a+") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            value = self.get(key)
+            value = amount if value is MISSING else value + amount
+            self.set(key, value)
+            return value
+
+    def prune(self):
+        """Drop the least recently written files past maxsize"""
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".pkl")
+        ]
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[: len(entries) - self.maxsize]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+def make_backend(config):
+    name = config.get("REPORT_CACHE_BACKEND") or "lru"
+    if name == "lru":
+        return LRUBackend(config.get("REPORT_CACHE_SIZE") or 512)
+    if name == "filesystem":
+        return FileSystemBackend(
+            config.get("REPORT_CACHE_DIR")
+            or os.path.join(tempfile.gettempdir(), "stockcount-cache")
+        )
+    module_name, _, class_name = name.partition(":")
+    return getattr(import_module(module_name), class_name)(config)
+
+
+def data_version(store_id):
+    version = (
+        db.session.query(StockcountDataVersion.version)
+        .filter(StockcountDataVersion.store_id == store_id)
+        .scalar()
+    )
+    return version or 0
+
+
+class ReportCache:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUBackend()
+        self.enabled = True
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+        self.enabled = app.config.get("REPORT_CACHE_ENABLED", True)
+        with self._counts_lock:
+            self._counts = Counter()
+
+    @property
+    def shared(self):
+        """Whether other processes see the backend, and so its counters"""
+        return not isinstance(self.backend, LRUBackend)
+
+    def count(self, name):
+        """Count a hit or miss, adding the batch to a shared backend"""
+        with self._counts_lock:
+            self._counts[name] += 1
+            if not self.shared or self._counts.total() < STATS_FLUSH:
+                return
+            pending, self._counts = self._counts, Counter()
+        for name, count in pending.items():
+            self.backend.incr(f"stats:{name}", count)
+
+    def get(self, store_id, key, version):
+        """The entry for (store_id, key) at version, or MISSING"""
+        if not self.enabled:
+            return MISSING
+        cache_key = ":".join(["report", str(store_id), *map(str, key), str(version)])
+        value = self.backend.get(cache_key)
+        self.count("misses" if value is MISSING else "hits")
+        return value
+
+    def set(self, store_id, key, version, value):
+        if self.enabled:
+            cache_key = ":".join(
+                ["report", str(store_id), *map(str, key), str(version)]
+            )
+            self.backend.set(cache_key, value)
+
+    def get_or_compute(self, store_id, key, compute, version=None):
+        """
+        Return the cached result for (store_id, key) at the store's current
+        data version, calling compute() on a miss.  Callers that already
+        read the version pass it in.
+        """
+        if not self.enabled:
+            return compute()
+        if version is None:
+            version = data_version(store_id)
+        value = self.get(store_id, key, version)
+        if value is MISSING:
+            value = compute()
+            self.set(store_id, key, version, value)
+        return value
+
+    def stats(self):
+        with self._counts_lock:
+            counts = Counter(self._counts)
+        if self.shared:
+            for name in ("hits", "misses"):
+                value = self.backend.get(f"stats:{name}")
+                counts[name] += 0 if value is MISSING else value
+        hits, misses = counts["hits"], counts["misses"]
+        total = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0,
+        }
+
+
+report_cache = ReportCache()
+
+
+@changes.before_commit
+def bump_versions(session, touched):
+    """Bump the data version of every store the commit touched"""
+    keys = [{"store_id": store_id} for store_id in {s for s, _ in touched}]
+    increment(
+        StockcountDataVersion.__table__,
+        keys,
+        ["store_id"],
+        "version",
+        session=session,
+    )
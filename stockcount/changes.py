@@ -0,0 +1,99 @@
+"""
+changes.py tracks which (store_id, date) pairs a session commit touches
+
+Models registered with track() are collected on every flush; a model
+tracked without a date column touches (store_id, None), the whole store.  Bulk
+statements that bypass the unit of work report their rows with touch().
+Handlers registered with before_commit() run inside the committing
+transaction and may write; after_commit() handlers run once the data is
+visible to other sessions and must not emit SQL.
+"""
+
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+TRACKED = {}
+_before_commit = []
+_after_commit = []
+
+
+def track(model, store_attr="store_id", date_attr="date"):
+    TRACKED[model] = (store_attr, date_attr)
+
+
+def before_commit(handler):
+    _before_commit.append(handler)
+    return handler
+
+
+def after_commit(handler):
+    _after_commit.append(handler)
+    return handler
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def touch(session, store_id, dates):
+    touched = session.info.setdefault("touched", set())
+    touched.update((store_id, _day(date)) for date in dates)
+
+
+def _object_keys(obj, store_attr, date_attr):
+    state = inspect(obj)
+    stores = {getattr(obj, store_attr)} | set(state.attrs[store_attr].history.deleted)
+    if date_attr is None:
+        dates = {None}
+    else:
+        dates = {getattr(obj, date_attr)} | set(state.attrs[date_attr].history.deleted)
+        dates.discard(None)
+    return {
+        (store_id, _day(date))
+        for store_id in stores
+        for date in dates
+        if store_id is not None
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    touched = session.info.setdefault("touched", set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        attrs = TRACKED.get(type(obj))
+        if attrs is not None:
+            touched.update(_object_keys(obj, *attrs))
+
+
+@event.listens_for(Session, "before_commit")
+def _dispatch_before(session):
+    if session.info.get("dispatching"):
+        return
+    session.flush()
+    touched = session.info.get("touched")
+    if not touched:
+        return
+    session.info["dispatching"] = True
+    try:
+        for handler in _before_commit:
+            handler(session, frozenset(touched))
+        session.flush()
+    finally:
+        session.info["dispatching"] = False
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_after(session):
+    touched = session.info.pop("touched", None)
+    if not touched:
+        return
+    for handler in _after_commit:
+        handler(frozenset(touched))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("touched", None)
@@ -0,0 +1,374 @@
+"""
+commands.py registers the flask cli commands
+
+    flask schema upgrade
+    flask schema snapshot
+    flask schema advise [--store ID] [--date YYYY-MM-DD] [--min-rows N] [--check]
+    flask cache stats
+    flask pool show
+    flask counts rebuild [--store ID] [--since YYYY-MM-DD]
+    flask recipes show MENU_ITEM [--concept NAME]
+    flask calendar show [YYYY-MM-DD]
+    flask sales rollup [--store ID] [--since YYYY-MM-DD]
+    flask sales partitions
+    flask sales compact [--dry-run]
+    flask archive run [--dry-run]
+    flask archive export counts|sales FILE --store ID --start D --end D
+    flask toast import FILE... [--store ID] [--force]
+    flask toast pull [--store ID] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    flask r365 import purchases|waste FILE... [--since D] [--until D] [--force]
+        (--force reloads waste days before the watermark; purchases
+        always load in full)
+    flask variance refresh [--store ID] [--start YYYY-MM-DD --end YYYY-MM-DD]
+"""
+
+from datetime import datetime
+
+import click
+import pandas as pd
+from flask import current_app
+from flask.cli import AppGroup
+
+from stockcount import advisor, archive, migrations, partitions, schema
+from stockcount.access import store_access
+from stockcount.cache import report_cache
+from stockcount.counts.rollup import drain_rollup, refresh_rollup
+from stockcount.counts.utils import recompute_counts
+from stockcount.fiscal import fiscal_calendar
+from stockcount.importers import r365, toast
+from stockcount.main.recipes import recipe_cache
+from stockcount.main.variance import drain_dirty, refresh_variance
+from stockcount.models import InvCount, StockcountSales, StockcountVarianceDirty, db
+
+schema_cli = AppGroup("schema", help="Manage the tables this app owns.")
+variance_cli = AppGroup("variance", help="Maintain the daily variance table.")
+cache_cli = AppGroup("cache", help="Inspect the report cache.")
+pool_cli = AppGroup("pool", help="Inspect the connection pool.")
+counts_cli = AppGroup("counts", help="Maintain inv_count history.")
+recipes_cli = AppGroup("recipes", help="Inspect the recipe graph.")
+calendar_cli = AppGroup("calendar", help="Inspect the fiscal calendar.")
+sales_cli = AppGroup("sales", help="Maintain the sales rollup and partitions.")
+archive_cli = AppGroup("archive", help="Archive old count and sales history.")
+toast_cli = AppGroup("toast", help="Load Toast item sales.")
+r365_cli = AppGroup("r365", help="Load R365 purchases and waste.")
+
+date_option = click.DateTime(formats=["%Y-%m-%d"])
+
+
+@schema_cli.command("upgrade")
+def schema_upgrade():
+    """Apply pending migrations."""
+    ran = migrations.upgrade(db.engine)
+    click.echo(f"Applied {len(ran)} migrations {', '.join(ran)}".strip())
+
+
+@schema_cli.command("status")
+def schema_status():
+    """List applied and pending migrations."""
+    done = migrations.applied(db.engine)
+    for version, description, _ in sorted(migrations.MIGRATIONS):
+        state = (
+            done[version].strftime("%Y-%m-%d %H:%M") if version in done else "pending"
+        )
+        click.echo(f"{version}  {state:16}  {description}")
+
+
+@schema_cli.command("snapshot")
+def schema_snapshot():
+    """Reflect REFLECT_TABLES again and rewrite SCHEMA_CACHE_FILE."""
+    names = schema.reflect_tables(current_app, refresh=True)
+    click.echo(f"Reflected {len(names)} tables {', '.join(names)}".strip())
+
+
+@schema_cli.command("advise")
+@click.option("--store", type=int, help="Store id, the newest count's by default.")
+@click.option("--date", "day", type=date_option, help="Day to run the queries for.")
+@click.option(
+    "--min-rows", default=1000, show_default=True, help="Ignore smaller tables."
+)
+@click.option("--check", is_flag=True, help="Exit 1 when a scan is found.")
+def schema_advise(store, day, min_rows, check):
+    """
+    EXPLAIN the report, details, counts and sales queries and list the
+    ones that scan a whole table.
+    """
+    report = advisor.advise(store, day.date() if day else None, min_rows)
+    if report is None:
+        raise click.ClickException("No counts to sample the queries with")
+    findings = report["findings"]
+    click.echo(
+        f"Explained {report['shapes']} query shapes for store "
+        f"{report['store_id']}, item {report['item_id']} on {report['day']}"
+    )
+    for finding in findings:
+        click.echo(f"\nSequential scan of {', '.join(finding['tables'])}:")
+        click.echo(f"  {finding['sql']}")
+        for line in finding["plan"]:
+            click.echo(f"    {line}")
+    click.echo(f"\n{len(findings)} query shapes scan a table of {min_rows}+ rows")
+    if check and findings:
+        raise SystemExit(1)
+
+
+def live_start(store_id, start):
+    """start, moved past the store's archived months, which cannot be rebuilt"""
+    until = archive.archived_until(store_id)
+    if until is None or start >= until:
+        return start
+    click.echo(f"store {store_id}: archived before {until}, starting there")
+    return until
+
+
+@variance_cli.command("refresh")
+@click.option("--store", "stores", type=int, multiple=True, help="Store id(s).")
+@click.option("--start", type=date_option, help="First day to recompute.")
+@click.option("--end", type=date_option, help="Last day to recompute.")
+def variance_refresh(stores, start, end):
+    """
+    Recompute dirty days, or every day between --start and --end.
+
+    Run it after loading R365 or Toast data from outside the app.  Days
+    before the archive horizon are skipped, their sources are archived.
+    """
+    if not stores:
+        stores = [
+            store_id
+            for (store_id,) in db.session.query(StockcountVarianceDirty.store_id)
+            .distinct()
+            .all()
+        ]
+    if not start:
+        days = drain_dirty(stores)
+        click.echo(f"Refreshed {len(days)} dirty store days")
+        return
+    for store_id in stores:
+        first = live_start(store_id, start.date())
+        days = pd.date_range(first, end or datetime.now()).date
+        rows = refresh_variance(store_id, days)
+        db.session.commit()
+        click.echo(f"store {store_id}: {rows} rows")
+
+
+@cache_cli.command("stats")
+def cache_stats():
+    """Show hit/miss counters (shared backends only see every worker)."""
+    for name, value in report_cache.stats().items():
+        click.echo(f"{name:10} {value}")
+
+
+@pool_cli.command("show")
+def pool_show():
+    """Show the engine options the pool settings resolve to."""
+    for name, value in sorted(current_app.config["SQLALCHEMY_ENGINE_OPTIONS"].items()):
+        value = value.__name__ if isinstance(value, type) else value
+        click.echo(f"{name:14} {value}")
+    click.echo(f"{'pool':14} {type(db.engine.pool).__name__}")
+
+
+@counts_cli.command("rebuild")
+@click.option("--store", "stores", type=int, multiple=True, help="Store id(s).")
+@click.option("--since", type=date_option, help="First day to rebuild.")
+def counts_rebuild(stores, since):
+    """Recompute previous_total, theory and daily_variance of stored counts."""
+    if not stores:
+        stores = [
+            store_id
+            for (store_id,) in db.session.query(InvCount.store_id).distinct().all()
+        ]
+    for store_id in stores:
+        started = datetime.now()
+        rows = recompute_counts(store_id, since.date() if since else None)
+        db.session.commit()
+        seconds = (datetime.now() - started).total_seconds()
+        click.echo(f"store {store_id}: {rows} rows updated in {seconds:.1f}s")
+
+
+@recipes_cli.command("show")
+@click.argument("menu_item")
+@click.option("--concept", help="Concept whose recipes to use.")
+def recipes_show(menu_item, concept):
+    """Print the resolved ingredients of one menu item."""
+    graph = recipe_cache.graph(concept)
+    ingredients = graph.ingredients(menu_item)
+    if not ingredients:
+        raise click.ClickException(f"{menu_item} has no recipe")
+    for ingredient, usage in sorted(ingredients.items()):
+        uofm = usage.uofm or ""
+        click.echo(f"{usage.qty:10.4f} {uofm:8} {ingredient}  ({usage.recipe})")
+
+
+@calendar_cli.command("show")
+@click.argument("day", type=date_option, required=False)
+def calendar_show(day):
+    """Print the fiscal week, period, quarter and year of a day."""
+    cal = fiscal_calendar()
+    day = cal.day(day or datetime.now())
+    click.echo(f"{day.date}  week {day.week_of_year} of {day.year}")
+    for level in ("week", "period", "quarter", "year"):
+        start, end = cal.bounds(day.date, level)
+        click.echo(f"{level:8} {getattr(day, level):4}  {start} to {end}")
+    start, end = cal.periods_back(day.date, 1)
+    click.echo(f"previous period   {start} to {end}")
+
+
+@sales_cli.command("rollup")
+@click.option("--store", "stores", type=int, multiple=True, help="Store id(s).")
+@click.option("--since", type=date_option, help="Rebuild from this day on.")
+def sales_rollup(stores, since):
+    """
+    Bring the WTD/PTD/YTD sales rollup up to date.
+
+    Without --since only queued and newly landed days are rolled up, and
+    stores never rolled up get their first build.  The pages leave that
+    first build to this command.
+    """
+    if not stores:
+        stores = [
+            store_id
+            for (store_id,) in db.session.query(StockcountSales.store_id)
+            .filter(StockcountSales.store_id.isnot(None))
+            .distinct()
+            .all()
+        ]
+    if since is None:
+        for store_id, rows in drain_rollup(stores, build=True).items():
+            click.echo(f"store {store_id}: {rows} rows")
+        return
+    for store_id in stores:
+        rows = refresh_rollup(store_id, live_start(store_id, since.date()))
+        db.session.commit()
+        click.echo(f"store {store_id}: {rows} rows")
+
+
+@sales_cli.command("partitions")
+def sales_partitions():
+    """Create the coming months' partitions of the sales and waste tables."""
+    ahead = current_app.config.get(
+        "SALES_PARTITION_MONTHS_AHEAD", partitions.MONTHS_AHEAD
+    )
+    for model in partitions.PARTITIONED:
+        with db.engine.begin() as connection:
+            created = partitions.ensure_partitions(
+                connection, model.__tablename__, ahead
+            )
+        click.echo(f"{model.__tablename__}: created {', '.join(created) or 'none'}")
+
+
+@sales_cli.command("compact")
+@click.option("--dry-run", is_flag=True, help="Only list the months that are due.")
+def sales_compact(dry_run):
+    """
+    Apply the retention policy: compact sales months older than
+    SALES_COMPACT_AFTER_MONTHS and drop waste months older than
+    WASTE_RETENTION_MONTHS.
+    """
+    done = partitions.apply_retention(db.engine, current_app.config, dry_run=dry_run)
+    if not done:
+        click.echo("No retention policy is configured")
+    for table, months in done.items():
+        listed = ", ".join(f"{month:%Y-%m}" for month in months) or "none"
+        click.echo(f"{table}: {'due' if dry_run else 'done'} {listed}")
+
+
+@archive_cli.command("run")
+@click.option("--dry-run", is_flag=True, help="Only list the months that are due.")
+def archive_run(dry_run):
+    """
+    Move count and sales months older than ARCHIVE_AFTER_MONTHS to the
+    Parquet files under ARCHIVE_DIR.
+    """
+    done = archive.apply_archive(db.engine, current_app.config, dry_run=dry_run)
+    if not done:
+        click.echo("No archive is configured")
+    for table, months in done.items():
+        listed = ", ".join(f"{month:%Y-%m}" for month in months) or "none"
+        click.echo(f"{table}: {'due' if dry_run else 'done'} {listed}")
+
+
+@archive_cli.command("export")
+@click.argument("kind", type=click.Choice(["counts", "sales"]))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--store", "stores", type=int, multiple=True, required=True, help="Store id(s)."
+)
+@click.option("--start", type=date_option, required=True, help="First day.")
+@click.option("--end", type=date_option, required=True, help="Last day.")
+def archive_export(kind, path, stores, start, end):
+    """Write count or ingredient sales history to CSV, archived months included."""
+    start, end = start.date(), end.date()
+    if kind == "counts":
+        frame = archive.history(
+            InvCount, list(stores), start, end, archive.COUNT_COLUMNS
+        )
+    else:
+        frame = archive.sales_history(list(stores), start, end)
+    frame.to_csv(path, index=False)
+    click.echo(f"Wrote {len(frame)} rows to {path}")
+
+
+@toast_cli.command("import")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--store", type=int, help="Store id, if the files do not say.")
+@click.option("--force", is_flag=True, help="Reload days before the watermark.")
+def toast_import(paths, store, force):
+    """Load ItemSelectionDetails CSV or orders JSON/JSONL exports."""
+    stats = toast.import_files(list(paths), store, force)
+    click.echo(stats.summary())
+
+
+@toast_cli.command("pull")
+@click.option("--store", "stores", type=int, multiple=True, help="Store id(s).")
+@click.option("--start", type=date_option, help="First business date.")
+@click.option("--end", type=date_option, help="Last business date.")
+def toast_pull(stores, start, end):
+    """Pull orders from the Toast API, from each store's watermark by default."""
+    if not stores:
+        stores = [
+            store.id
+            for store in store_access.stores()
+            if store.active and store.toast_guid
+        ]
+    stats = toast.import_api(
+        current_app.config,
+        list(stores),
+        start.date() if start else None,
+        end.date() if end else None,
+        force=start is not None,
+    )
+    click.echo(stats.summary())
+
+
+@r365_cli.command("import")
+@click.argument("kind", type=click.Choice(sorted(r365.KINDS)))
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--store", type=int, help="Store id, if the files do not say.")
+@click.option("--since", type=date_option, help="First day to load.")
+@click.option("--until", type=date_option, help="Last day to load.")
+@click.option("--force", is_flag=True, help="Reload waste days before the watermark.")
+def r365_import(kind, paths, store, since, until, force):
+    """Bulk-load R365 purchase or waste CSV exports."""
+    if force and not r365.KINDS[kind]["skip_loaded"]:
+        raise click.UsageError(f"--force only applies to waste, not {kind}")
+    stats = r365.import_files(
+        kind,
+        list(paths),
+        store,
+        since.date() if since else None,
+        until.date() if until else None,
+        force,
+    )
+    click.echo(stats.summary())
+
+
+def register_commands(app):
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(variance_cli)
+    app.cli.add_command(cache_cli)
+    app.cli.add_command(pool_cli)
+    app.cli.add_command(counts_cli)
+    app.cli.add_command(recipes_cli)
+    app.cli.add_command(calendar_cli)
+    app.cli.add_command(sales_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(toast_cli)
+    app.cli.add_command(r365_cli)
@@ -1,6 +1,8 @@
 import json
+import os
 
-with open("/etc/config.json") as config_file:
+# STOCKCOUNT_CONFIG points the tests and benchmarks at their own file
+with open(os.environ.get("STOCKCOUNT_CONFIG", "/etc/config.json")) as config_file:
     config = json.load(config_file)
 
 
@@ -12,10 +14,18 @@ class Config:
     SRVC_PSWRD = config.get("SRVC_PSWRD")
     SQLALCHEMY_DATABASE_URI = config.get("SQLALCHEMY_DATABASE_URI")
     SQLALCHEMY_TRACK_MODIFICATIONS = config.get("SQLALCHEMY_TRACK_MODIFICATIONS")
-    SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": True}
-    SQLALCHEMY_POOL_SIZE = 10
-    SQLALCHEMY_MAX_OVERFLOW = 20
-    SQLALCHEMY_POOL_RECYCLE = 1800
+    # the SQLALCHEMY_POOL_* keys are folded into the engine options by pool.py
+    SQLALCHEMY_ENGINE_OPTIONS = config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    SQLALCHEMY_POOL_SIZE = config.get("SQLALCHEMY_POOL_SIZE", 10)
+    SQLALCHEMY_MAX_OVERFLOW = config.get("SQLALCHEMY_MAX_OVERFLOW", 20)
+    SQLALCHEMY_POOL_TIMEOUT = config.get("SQLALCHEMY_POOL_TIMEOUT", 30)
+    SQLALCHEMY_POOL_RECYCLE = config.get("SQLALCHEMY_POOL_RECYCLE", 1800)
+    SQLALCHEMY_POOL_LIVENESS = config.get("SQLALCHEMY_POOL_LIVENESS", "pre_ping")
+    REFLECT_TABLES = config.get("REFLECT_TABLES", [])
+    SCHEMA_CACHE_FILE = config.get("SCHEMA_CACHE_FILE")
+    PERF_ENABLED = config.get("PERF_ENABLED", False)
+    PERF_SLOWEST = config.get("PERF_SLOWEST", 5)
+    PERF_REPEAT_THRESHOLD = config.get("PERF_REPEAT_THRESHOLD", 5)
     SECURITY_REGISTERABLE = config.get("SECURITY_REGISTERABLE")
     SECURITY_CHANGEABLE = config.get("SECURITY_CHANGEABLE")
     SECURITY_RECOVERABLE = config.get("SECURITY_RECOVERABLE")
@@ -41,3 +51,18 @@ class Config:
     CLIENT_SECRET = config.get("CLIENT_SECRET")
     TOAST_API_ACCESS_URL = config.get("TOAST_API_ACCESS_URL")
     MANAGEMENT_GROUP_GUID = config.get("MANAGEMENT_GROUP_GUID")
+    REPORT_CACHE_ENABLED = config.get("REPORT_CACHE_ENABLED", True)
+    REPORT_CACHE_BACKEND = config.get("REPORT_CACHE_BACKEND", "lru")
+    REPORT_CACHE_SIZE = config.get("REPORT_CACHE_SIZE", 512)
+    REPORT_CACHE_DIR = config.get("REPORT_CACHE_DIR")
+    ACCESS_CACHE_SECONDS = config.get("ACCESS_CACHE_SECONDS", 300)
+    FISCAL_YEAR_START = config.get("FISCAL_YEAR_START")
+    FISCAL_YEARS = config.get("FISCAL_YEARS", 10)
+    API_GZIP_MIN_BYTES = config.get("API_GZIP_MIN_BYTES", 1024)
+    ASYNC_READS_ENABLED = config.get("ASYNC_READS_ENABLED", True)
+    ASYNC_DATABASE_URI = config.get("ASYNC_DATABASE_URI")
+    SALES_PARTITION_MONTHS_AHEAD = config.get("SALES_PARTITION_MONTHS_AHEAD", 3)
+    SALES_COMPACT_AFTER_MONTHS = config.get("SALES_COMPACT_AFTER_MONTHS")
+    WASTE_RETENTION_MONTHS = config.get("WASTE_RETENTION_MONTHS")
+    ARCHIVE_DIR = config.get("ARCHIVE_DIR")
+    ARCHIVE_AFTER_MONTHS = config.get("ARCHIVE_AFTER_MONTHS")
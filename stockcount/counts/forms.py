@@ -29,6 +29,7 @@ class StoreForm(FlaskForm):
         "Select Store",
         query_factory=store_query,
         get_label="name",
+        get_pk=lambda store: store.id,
     )
     storeform_submit = SubmitField("Submit")
 
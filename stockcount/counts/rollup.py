@@ -0,0 +1,270 @@
+"""
+counts/rollup.py keeps stockcount_sales_rollup, the sales page's totals
+
+One row per store, sales day and menu item sold that day, with the
+day's sales_count (R365, or Toast where R365 has nothing yet, see
+stockcount.sales) and the week-, period- and year-to-date sums through
+that day.  A menu item's to-date sums as of any day are those of its
+newest row on or before it, zeroed when that row is from an earlier
+week, period or year.  A day's numbers only change when its sales are
+restated, so the page reads finished rows instead of aggregating
+stockcount_sales on every load.
+
+The refresh is incremental: it starts at the earliest day queued in
+stockcount_sales_rollup_dirty, or the day after the newest rolled-up
+day when newer sales have landed, and reuses the stored daily totals
+before that as the base of the running sums.  The first build of a
+store, a fiscal year of sales, is left to ``flask sales rollup``; the
+pages only ever extend a built rollup.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from sqlalchemy import delete, func
+
+from stockcount import db
+from stockcount.bulk import upsert
+from stockcount.fiscal import fiscal_calendar
+from stockcount.models import (
+    StockcountSales,
+    StockcountSalesRollup,
+    StockcountSalesRollupDirty,
+    StockcountSalesToast,
+)
+from stockcount.sales import resolved_sales
+
+logger = logging.getLogger(__name__)
+
+# running sum column -> fiscal level it resets on
+TO_DATE = {"wtd": "week", "ptd": "period", "ytd": "year"}
+
+# sales days the first build covers before the current fiscal year
+HISTORY_DAYS = 7
+
+ROLLUP_KEY = ["store_id", "date", "menuitem"]
+
+DAILY_COLUMNS = ["date", "menuitem", "sales_count"]
+
+
+def _frame(rows, columns):
+    return pd.DataFrame([tuple(row) for row in rows], columns=columns)
+
+
+def load_daily(store_id, start_date, end_date):
+    """Resolved sales_count per menu item and day, R365 first then Toast"""
+    sales = resolved_sales([store_id], start_date, end_date, level="menuitem")
+    return sales.rename(columns={"sales": "sales_count"})[DAILY_COLUMNS]
+
+
+def load_rolled(store_id, start_date, end_date):
+    """Daily totals already in the rollup, the base for the running sums"""
+    query = db.session.query(
+        StockcountSalesRollup.date,
+        StockcountSalesRollup.menuitem,
+        StockcountSalesRollup.sales_count,
+    ).filter(
+        StockcountSalesRollup.store_id == store_id,
+        StockcountSalesRollup.date >= start_date,
+        StockcountSalesRollup.date <= end_date,
+        StockcountSalesRollup.sales_count != 0,
+    )
+    return _frame(query.all(), DAILY_COLUMNS)
+
+
+def rollup_frame(daily):
+    """
+    Running sums for daily (date, menuitem, sales_count), one row per menu
+    item and day it sold on
+    """
+    cal = fiscal_calendar()
+    frame = (
+        daily.groupby(["date", "menuitem"], as_index=False)["sales_count"]
+        .sum()
+        .sort_values(["menuitem", "date"])
+    )
+    frame = frame[frame["sales_count"] != 0]
+    days = frame["date"].unique()
+    for column, level in TO_DATE.items():
+        starts = {day: cal.bounds(day, level)[0] for day in days}
+        frame[column] = frame.groupby(
+            ["menuitem", frame["date"].map(starts)]
+        )["sales_count"].cumsum()
+    return frame
+
+
+def refresh_rollup(store_id, since):
+    """Rebuild the store's rollup rows from since on, return the row count"""
+    year_start, _ = fiscal_calendar().year(since)
+    new = load_daily(store_id, since, latest_sale(store_id) or since)
+    base = load_rolled(store_id, year_start, since - timedelta(days=1))
+    db.session.execute(
+        delete(StockcountSalesRollup).where(
+            StockcountSalesRollup.store_id == store_id,
+            StockcountSalesRollup.date >= since,
+        )
+    )
+    if new.empty:
+        return 0
+
+    daily = pd.concat([base, new], ignore_index=True) if not base.empty else new
+    frame = rollup_frame(daily)
+    frame = frame[frame["date"] >= since].assign(
+        store_id=store_id, updated_at=datetime.now(timezone.utc)
+    )
+    rows = frame.to_dict("records")
+    # two loads of the sales page can refresh the same days at once; the
+    # loser of the race rewrites the same numbers instead of failing
+    upsert(StockcountSalesRollup.__table__, rows, ROLLUP_KEY)
+    logger.info(f"Rolled up {len(rows)} sales rows for store {store_id} from {since}")
+    return len(rows)
+
+
+def latest_sale_queries(store_id):
+    """Newest R365 and newest Toast sales day for the store"""
+    return [
+        db.select(func.max(model.date)).where(model.store_id == store_id)
+        for model in (StockcountSales, StockcountSalesToast)
+    ]
+
+
+def latest_sale(store_id):
+    """Newest day with R365 or Toast sales for the store"""
+    days = [db.session.execute(q).scalar() for q in latest_sale_queries(store_id)]
+    return max((day for day in days if day is not None), default=None)
+
+
+def pending_since(store_id, dirty, build=False):
+    """
+    First day to refresh for the store, or None when it is up to date or,
+    unless build, was never rolled up
+    """
+    newest = latest_sale(store_id)
+    if newest is None:
+        return min(dirty, default=None)
+    latest_rolled = db.session.execute(latest_rolled_query(store_id)).scalar()
+    if latest_rolled is None:
+        if not build:
+            logger.warning(f"Store {store_id} is not rolled up, run flask sales rollup")
+            return None
+        first, _ = fiscal_calendar().year(newest - timedelta(days=HISTORY_DAYS))
+        return first
+    if newest > latest_rolled:
+        dirty = dirty | {latest_rolled + timedelta(days=1)}
+    return min(dirty, default=None)
+
+
+def drain_rollup(store_ids, build=False):
+    """
+    Bring the stores' rollups up to date, return {store_id: rows}.  build
+    also rolls up the stores that never were.
+    """
+    queued = db.session.execute(
+        delete(StockcountSalesRollupDirty)
+        .where(StockcountSalesRollupDirty.store_id.in_(store_ids))
+        .returning(StockcountSalesRollupDirty.store_id, StockcountSalesRollupDirty.date)
+    ).all()
+    refreshed = {}
+    for store_id in store_ids:
+        dirty = {date for queued_store, date in queued if queued_store == store_id}
+        since = pending_since(store_id, dirty, build)
+        if since is not None:
+            refreshed[store_id] = refresh_rollup(store_id, since)
+    db.session.commit()
+    return refreshed
+
+
+def latest_rolled_query(store_id):
+    return db.select(func.max(StockcountSalesRollup.date)).where(
+        StockcountSalesRollup.store_id == store_id
+    )
+
+
+def to_date_query(store_id, year_start, day):
+    """Each menu item's newest rollup row of the fiscal year through day"""
+    ranked = (
+        db.select(
+            StockcountSalesRollup.menuitem,
+            StockcountSalesRollup.date,
+            *(getattr(StockcountSalesRollup, column) for column in TO_DATE),
+            func.row_number()
+            .over(
+                partition_by=StockcountSalesRollup.menuitem,
+                order_by=StockcountSalesRollup.date.desc(),
+            )
+            .label("rank"),
+        )
+        .where(
+            StockcountSalesRollup.store_id == store_id,
+            StockcountSalesRollup.date >= year_start,
+            StockcountSalesRollup.date <= day,
+        )
+        .subquery()
+    )
+    return (
+        db.select(ranked.c.menuitem, ranked.c.date, *(ranked.c[c] for c in TO_DATE))
+        .where(ranked.c.rank == 1)
+        .order_by(ranked.c.menuitem)
+    )
+
+
+def recent_dates_query(store_id, days=7):
+    return (
+        db.select(StockcountSalesRollup.date)
+        .where(StockcountSalesRollup.store_id == store_id)
+        .distinct()
+        .order_by(StockcountSalesRollup.date.desc())
+        .limit(days)
+    )
+
+
+def recent_items_query(store_id, dates):
+    return (
+        db.select(
+            StockcountSalesRollup.date,
+            StockcountSalesRollup.menuitem,
+            StockcountSalesRollup.sales_count,
+        )
+        .where(
+            StockcountSalesRollup.store_id == store_id,
+            StockcountSalesRollup.date.in_(dates),
+            StockcountSalesRollup.sales_count != 0,
+        )
+        .order_by(StockcountSalesRollup.menuitem)
+    )
+
+
+def to_date_totals(rows, day):
+    """
+    wtd_sales, ptd_sales and ytd_sales per menu item as of day, from the
+    to_date_query rows.  A sum whose week, period or year ended before day
+    is zero.
+    """
+    fiscal = fiscal_calendar().day(day)
+    starts = {
+        column: getattr(fiscal, f"{level}_start") for column, level in TO_DATE.items()
+    }
+    totals = []
+    for row in rows:
+        sums = {
+            f"{column}_sales": getattr(row, column) if row.date >= start else 0
+            for column, start in starts.items()
+        }
+        if any(sums.values()):
+            totals.append({"menuitem": row.menuitem, **sums})
+    return totals
+
+
+def to_date_sales(store_id, day):
+    """The to-date sums as of day, see to_date_totals"""
+    year_start, _ = fiscal_calendar().year(day)
+    rows = db.session.execute(to_date_query(store_id, year_start, day)).all()
+    return to_date_totals(rows, day)
+
+
+def recent_sales(store_id, days=7):
+    """The newest sales days and their non-zero menu item totals"""
+    dates = db.session.execute(recent_dates_query(store_id, days)).scalars().all()
+    items = db.session.execute(recent_items_query(store_id, dates)).all()
+    return dates, items
@@ -7,11 +7,11 @@ from datetime import datetime, timedelta
 
 from flask import flash, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required
-from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from zoneinfo import ZoneInfo
 
 from stockcount import db
+from stockcount.access import store_access
 from stockcount.counts import blueprint
 from stockcount.counts.forms import (
     CountForm,
@@ -21,17 +21,20 @@ from stockcount.counts.forms import (
     UpdateCountForm,
     UpdateItemForm,
 )
+from stockcount.counts.rollup import drain_rollup, recent_sales, to_date_sales
+from stockcount.counts.utils import (
+    existing_counts,
+    recompute_counts,
+    submit_counts,
+    update_counts,
+)
 from stockcount.models import (
-    Calendar,
     InvCount,
     InvItems,
-    InvPurchases,
     InvSales,
     MenuItems,
-    Restaurants,
-    StockcountSales,
-    StockcountSalesToast,
 )
+from stockcount.sales import resolved_sales
 
 logger = logging.getLogger(__name__)
 eastern = ZoneInfo("America/New_York")
@@ -41,7 +44,7 @@ eastern = ZoneInfo("America/New_York")
 @login_required
 def count():
     """Enter count for an item"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     page = request.args.get("page", 1, type=int)
     inv_items = InvCount.query.filter(InvCount.store_id == session["store"]).all()
 
@@ -97,94 +100,33 @@ def count():
 
     # on form submission
     if multi_form.submit.data:
-        # Check if count exists for same day and time
-        # for each count entry, check if it already exists
-        for count_entry in multi_form.counts.data:
-            double_count = InvCount.query.filter_by(
-                item_id=count_entry["item_id"],
-                trans_date=multi_form.transdate.data,
-                count_time=multi_form.am_pm.data,
-            ).first()
-            if double_count is not None:
-                flash(
-                    f"{count_entry['itemname']} already has a count on {multi_form.transdate.data}, please enter a different date or time",
-                    "warning",
-                )
-                logging.error(
-                    f"User {current_user.email} attempted to count item {count_entry['itemname']} that already has a count for {multi_form.transdate.data}"
-                )
-                return redirect(url_for("counts_blueprint.count"))
-
-        # get previous count
-        for count_entry in multi_form.counts.data:
-            items_object = InvItems.query.filter_by(id=count_entry["item_id"]).first()
-            filter_item = InvCount.query.filter(
-                InvCount.store_id == session["store"],
-                InvCount.item_id == count_entry["item_id"],
+        # Check if count exists for same day and time, for all items at once
+        entries = multi_form.counts.data
+        existing = existing_counts(
+            session["store"],
+            multi_form.transdate.data,
+            multi_form.am_pm.data,
+            [int(count_entry["item_id"]) for count_entry in entries],
+        )
+        if existing:
+            item_name = next(iter(existing.values()))
+            flash(
+                f"{item_name} already has a count on {multi_form.transdate.data}, please enter a different date or time",
+                "warning",
+            )
+            logging.error(
+                f"User {current_user.email} attempted to count item {item_name} that already has a count for {multi_form.transdate.data}"
             )
-            previous_count = filter_item.order_by(InvCount.trans_date.desc()).first()
-            if previous_count is None:
-                total_previous = 0
-            else:
-                total_previous = previous_count.count_total
-
-            # Calculate total purchases
-            purchase_item = InvPurchases.query.filter_by(
-                store_id=session["store"],
-                item_id=count_entry["item_id"],
-                trans_date=multi_form.transdate.data,
-            ).first()
-            if purchase_item is None:
-                total_purchase = 0
-            else:
-                total_purchase = purchase_item.purchase_total
-
-            # Calculate total sales
-            sales_item = InvSales.query.filter_by(
-                store_id=session["store"],
-                item_id=count_entry["item_id"],
-                trans_date=multi_form.transdate.data,
-            ).first()
-            if sales_item is None:
-                total_sales = 0
-            else:
-                total_sales = sales_item.sales_total
-
-            for count_entry in multi_form.counts.data:
-                items_object = InvItems.query.filter_by(
-                    id=count_entry["item_id"]
-                ).first()
-
-                inventory = InvCount(
-                    trans_date=multi_form.transdate.data,
-                    count_time=multi_form.am_pm.data,
-                    item_name=count_entry["itemname"],
-                    case_count=count_entry["casecount"],
-                    each_count=count_entry["eachcount"],
-                    count_total=(
-                        (items_object.case_pack * count_entry["casecount"])
-                        + count_entry["eachcount"]
-                    ),
-                    previous_total=total_previous,
-                    theory=(total_previous + total_purchase - total_sales),
-                    daily_variance=(
-                        (
-                            (items_object.case_pack * count_entry["casecount"])
-                            + count_entry["eachcount"]
-                        )
-                        - (total_previous + total_purchase - total_sales)
-                    ),
-                    item_id=count_entry["item_id"],
-                    store_id=session["store"],
-                )
-                db.session.add(inventory)
-            db.session.commit()
-            # flash(
-            #     f"Count submitted for {count_entry['itemname ']} on {multi_form.transdate.data}!",
-            #     "success",
-            # )
             return redirect(url_for("counts_blueprint.count"))
 
+        submit_counts(
+            session["store"],
+            multi_form.transdate.data,
+            multi_form.am_pm.data,
+            entries,
+        )
+        return redirect(url_for("counts_blueprint.count"))
+
     return render_template(
         "counts/count.html",
         title="Enter Count",
@@ -196,7 +138,7 @@ def count():
 @login_required
 def update_count(count_id):
     """route for count/id/update"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     item = InvCount.query.get_or_404(count_id)
     if not item.item_id:
         flash(f"{item.item_name} is not an active product!", "warning")
@@ -217,35 +159,7 @@ def update_count(count_id):
 
     if form.validate_on_submit():
         items_object = InvItems.query.filter_by(id=form.item_id.data).first()
-        filter_item = InvCount.query.filter(
-            InvCount.item_id == form.item_id.data,
-            InvCount.trans_date <= form.transdate.data,
-        )
-        ordered_count = (
-            filter_item.order_by(InvCount.trans_date.desc(), InvCount.count_time.desc())
-            .offset(1)
-            .first()
-        )
-        if ordered_count is None:
-            total_previous = 0
-        else:
-            total_previous = ordered_count.count_total
-
-        purchase_item = InvPurchases.query.filter_by(
-            item_id=form.item_id.data, trans_date=form.transdate.data
-        ).first()
-        if purchase_item is None:
-            total_purchase = 0
-        else:
-            total_purchase = purchase_item.purchase_total
-
-        sales_item = InvSales.query.filter_by(
-            item_id=form.item_id.data, trans_date=form.transdate.data
-        ).first()
-        if sales_item is None:
-            total_sales = 0
-        else:
-            total_sales = sales_item.sales_total
+        first_affected = min(item.trans_date, form.transdate.data)
 
         item.trans_date = form.transdate.data
         item.count_time = form.am_pm.data
@@ -255,11 +169,9 @@ def update_count(count_id):
         item.count_total = (
             items_object.case_pack * form.casecount.data + form.eachcount.data
         )
-        item.previous_total = total_previous
-        item.theory = total_previous + total_purchase - total_sales
-        item.daily_variance = (
-            items_object.case_pack * form.casecount.data + form.eachcount.data
-        ) - (total_previous + total_purchase - total_sales)
+        db.session.flush()
+        # cascade the edit through every later count of the item
+        recompute_counts(item.store_id, first_affected, [item.item_id])
         db.session.commit()
         flash("Item counts have been updated!", "success")
         return redirect(url_for("counts_blueprint.count"))
@@ -282,10 +194,10 @@ def update_count(count_id):
 @login_required
 def update_count_all(count_date):
     """Update count items"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     # Check if date exists in count
     # make sure count-date is in the format of dd-mm-yyyy
-    count_date = datetime.strptime(count_date, "%Y-%m-%d")
+    count_date = datetime.strptime(count_date, "%Y-%m-%d").date()
 
     # get the count_time from the most recent count on given date
     count_time = (
@@ -307,7 +219,7 @@ def update_count_all(count_date):
             session["store"] = x.id
         return redirect(url_for("counts_blueprint.count"))
 
-    if count_date is None:
+    if count_time is None:
         flash("No count for that date!", "warning")
         logging.error(
             f"User {current_user.email} attempted to update count for non-existent date {count_date}"
@@ -331,74 +243,27 @@ def update_count_all(count_date):
 
     # ic(item_list)
 
-    # Get the count for the selected date
-    counts = InvCount.query.filter(
-        InvCount.store_id == session["store"],
-        InvCount.trans_date == count_date,
-    ).all()
-
-    # ic(counts)
-
     # Create a form for the count based off the item_list
     multi_form = CountForm(counts=item_list)
 
     # ic(multi_form.counts.data)
 
     if multi_form.validate_on_submit():
-        # Submit count update for each item
-        for count_entry in multi_form.counts.data:
-            # First Update exisiting count
-            count = InvCount.query.filter(
-                InvCount.store_id == session["store"],
-                InvCount.trans_date == multi_form.transdate.data,
-            ).all()
-
-            # Check if count exists for same day and time
-            exisiting_item = InvCount.query.filter_by(
-                item_id=count_entry["item_id"],
-                trans_date=count_date,
-            ).first()
-
-            if exisiting_item is not None:
-                # if not new data, skip
-                if (
-                    exisiting_item.each_count == count_entry["eachcount"]
-                    and exisiting_item.case_count == count_entry["casecount"]
-                ):
-                    continue
-                exisiting_item.each_count = count_entry["eachcount"]
-                exisiting_item.casecount = count_entry["casecount"]
-                exisiting_item.count_total = (
-                    count_entry["eachcount"] + count_entry["casecount"]
-                )
-                exisiting_item.previous_total = 0
-                exisiting_item.theory = 0
-                exisiting_item.daily_variance = 0
-                db.session.commit()
-                continue
-
-            # Secondly add new count
-            # For items in item_list that are not in count
-            if count_entry["item_id"] not in [count.item_id for count in count]:
-                count_item = InvCount(
-                    trans_date=count_date,
-                    count_time=count_time.count_time,
-                    item_name=count_entry["itemname"],
-                    each_count=count_entry["eachcount"],
-                    case_count=count_entry["casecount"],
-                    count_total=(count_entry["eachcount"] + count_entry["casecount"]),
-                    previous_total=0,
-                    theory=0,
-                    daily_variance=0,
-                    item_id=count_entry["item_id"],
-                    store_id=session["store"],
-                )
-                db.session.add(count_item)
-                db.session.commit()
-                # ic(count_item)
+        # Diff the form against the day's counts and apply it in one batch
+        update_counts(
+            session["store"],
+            count_date,
+            count_time.count_time,
+            multi_form.counts.data,
+        )
         flash("Counts have been updated!", "success")
         return redirect(url_for("counts_blueprint.count"))
     elif request.method == "GET":
+        # Get the count for the selected date
+        counts = InvCount.query.filter(
+            InvCount.store_id == session["store"],
+            InvCount.trans_date == count_date,
+        ).all()
         multi_form.transdate.data = count_date
         multi_form.am_pm.data = count_time.count_time
         index = 0
@@ -424,9 +289,11 @@ def update_count_all(count_date):
 @login_required
 def delete_count(count_id):
     """Delete an item count"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     item = InvCount.query.get_or_404(count_id)
     db.session.delete(item)
+    db.session.flush()
+    recompute_counts(item.store_id, item.trans_date, [item.item_id])
     db.session.commit()
     flash("Item counts have been deleted!", "success")
     return redirect(url_for("counts_blueprint.count"))
@@ -447,19 +314,8 @@ def sales():
     else:
         business_date = None  # outside your Toast window, use R365 or other logic
 
-    cal_row = (
-        db.session.query(
-            Calendar.week_start, Calendar.year_start, Calendar.period, Calendar.week
-        )
-        .filter(Calendar.date == str(reporting_today))
-        .first()
-    )
-    week_start = cal_row.week_start
-    year_start = cal_row.year_start
-    weeks_elapsed = (cal_row.period - 1) * 4 + cal_row.week
-
     store_id = session["store"]
-    current_location = Restaurants.query.get(store_id)
+    current_location = store_access.store(store_id)
     store_form = StoreForm()
 
     if store_form.storeform_submit.data and store_form.validate():
@@ -470,59 +326,16 @@ def sales():
 
     page = request.args.get("page", 1, type=int)
 
-    # paginate over just the dates
-    ordered_sales = (
-        db.session.query(StockcountSales.date)
-        .filter_by(store_id=store_id)
-        .group_by(StockcountSales.date)
-        .order_by(StockcountSales.date.desc())
-        .limit(7)
-        .all()
-    )
+    drain_rollup([store_id])
+    ordered_sales, sales_items = recent_sales(store_id)
+    to_date = to_date_sales(store_id, reporting_today)
 
     current_day_sales = (
-        db.session.query(
-            StockcountSalesToast.date.label("date"),
-            StockcountSalesToast.menuitem.label("menuitem"),
-            func.sum(StockcountSalesToast.sales_count).label("sales_count"),
-        )
-        .filter(
-            StockcountSalesToast.store_id == store_id,
-            StockcountSalesToast.date == business_date,
-        )
-        .group_by(StockcountSalesToast.date, StockcountSalesToast.menuitem)
-        .all()
-    )
-
-    # pull all menuitem + counts for the dates in this page
-    sales_items = (
-        db.session.query(
-            StockcountSales.date.label("date"),
-            StockcountSales.menuitem.label("menuitem"),
-            func.sum(StockcountSales.sales_count).label("sales_count"),
-        )
-        .filter(
-            StockcountSales.store_id == store_id,
-            StockcountSales.date.in_([d.date for d in ordered_sales]),
-        )
-        .group_by(StockcountSales.date, StockcountSales.menuitem)
-        .all()
-    )
-
-    # calculate week to date sales
-    wtd_sales = (
-        db.session.query(
-            StockcountSales.menuitem.label("menuitem"),
-            func.sum(StockcountSales.sales_count).label("wtd_sales"),
-        )
-        .filter(
-            StockcountSales.store_id == store_id,
-            StockcountSales.date >= week_start,
-            StockcountSales.date <= reporting_today,
-        )
-        .group_by(StockcountSales.menuitem)
-        .order_by(StockcountSales.menuitem)
-        .all()
+        resolved_sales([store_id], business_date, business_date, level="menuitem")
+        .rename(columns={"sales": "sales_count"})
+        .to_dict("records")
+        if business_date
+        else []
     )
 
     return render_template(
@@ -534,8 +347,7 @@ def sales():
         sales_items=sales_items,
         ordered_sales=ordered_sales,
         current_day_sales=current_day_sales,
-        wtd_sales=wtd_sales,
-        # weekly_avg_sales=weekly_avg_sales,
+        to_date_sales=to_date,
     )
 
 
@@ -543,7 +355,7 @@ def sales():
 @login_required
 def new_item():
     """Create new inventory items"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     inv_items = InvItems.query.filter(InvItems.store_id == session["store"]).all()
     menu_items = MenuItems.query.filter(MenuItems.store_id == session["store"]).all()
     form = NewItemForm()
@@ -582,7 +394,7 @@ def new_item():
 @login_required
 def update_item(item_id):
     """Update current inventory items"""
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     inv_items = InvItems.query.filter(InvItems.store_id == session["store"]).all()
     item = InvItems.query.get_or_404(item_id)
     form = UpdateItemForm()
@@ -618,7 +430,7 @@ def update_item(item_id):
 def delete_item(item_id):
     """Delete current items"""
     # TODO: method to delete all counts for an item
-    current_location = Restaurants.query.filter_by(id=session["store"]).first()
+    current_location = store_access.store(session["store"])
     inv_items = InvItems.query.filter(InvItems.store_id == session["store"]).all()
     item = InvItems.query.get_or_404(item_id)
     counts = InvCount.query.filter_by(item_id=item.id).all()
@@ -1,40 +1,224 @@
 """ Calculation functions """
+import pandas as pd
 from flask import flash
+from sqlalchemy import func, update
 
-from stockcount import db
+from stockcount import changes, db
+from stockcount.archive import archived_counts
+from stockcount.bulk import upsert
 from stockcount.models import InvCount, InvItems, InvPurchases, InvSales
 
+COUNT_KEY = ["store_id", "item_id", "trans_date", "count_time"]
+DERIVED = ["previous_total", "theory", "daily_variance"]
+
 
 def calculate_totals(item_id):
     """Run the variance calculations for each item"""
     unit = InvItems.query.get_or_404(item_id)
-    filter_item = InvCount.query.filter(InvCount.item_id == unit.id)
-    ordered_count = filter_item.order_by(
-        InvCount.trans_date.desc(), InvCount.count_time.desc()
-    ).first()
-
-    if ordered_count is not None:
-        purchase_item = InvPurchases.query.filter_by(
-            item_id=unit.id, trans_date=ordered_count.trans_date
-        ).first()
-        if purchase_item is None:
-            total_purchase = 0
-        else:
-            total_purchase = purchase_item.purchase_total
-
-        sales_item = InvSales.query.filter_by(
-            item_id=unit.id, trans_date=ordered_count.trans_date
-        ).first()
-        if sales_item is None:
-            total_sales = 0
-        else:
-            total_sales = sales_item.sales_total
-
-        ordered_count.theory = (
-            ordered_count.previous_total + total_purchase - total_sales
+    recompute_counts(unit.store_id, item_ids=[unit.id])
+    db.session.commit()
+    flash("Variances have been recalculated!", "success")
+
+
+def previous_totals(store_id, trans_date, item_ids=None):
+    """count_total of each item's most recent count before trans_date"""
+    ranked = db.session.query(
+        InvCount.item_id,
+        InvCount.count_total,
+        func.row_number()
+        .over(
+            partition_by=InvCount.item_id,
+            order_by=(InvCount.trans_date.desc(), InvCount.count_time.desc()),
+        )
+        .label("rank"),
+    ).filter(
+        InvCount.store_id == store_id,
+        InvCount.trans_date < trans_date,
+    )
+    if item_ids is not None:
+        ranked = ranked.filter(InvCount.item_id.in_(item_ids))
+    ranked = ranked.subquery()
+    rows = db.session.query(ranked.c.item_id, ranked.c.count_total).filter(
+        ranked.c.rank == 1
+    )
+    return dict(rows.all())
+
+
+def daily_totals(model, total, store_id, since=None, item_ids=None):
+    """Sum of a legacy purchases/sales column per item and day"""
+    query = db.session.query(
+        model.item_id, model.trans_date, func.sum(total).label("total")
+    ).filter(model.store_id == store_id)
+    if since is not None:
+        query = query.filter(model.trans_date >= since)
+    if item_ids is not None:
+        query = query.filter(model.item_id.in_(item_ids))
+    rows = query.group_by(model.item_id, model.trans_date).all()
+    # typed even when empty, so the merged columns stay numeric
+    return pd.DataFrame(
+        [tuple(row) for row in rows], columns=["item_id", "trans_date", "total"]
+    ).astype({"item_id": int, "total": float})
+
+
+def recompute_counts(store_id, since=None, item_ids=None):
+    """
+    Recompute previous_total, theory and daily_variance for every count on
+    or after since, cascading each edit through the following days.
+
+    Counts, purchases and sales for the range are read with one query each,
+    the chain is rebuilt with a per-item shift in pandas and only the rows
+    whose numbers moved are written back, in one bulk UPDATE.  The caller
+    commits.
+    """
+    query = db.session.query(
+        InvCount.id,
+        InvCount.item_id,
+        InvCount.trans_date,
+        InvCount.count_time,
+        InvCount.count_total,
+        *(getattr(InvCount, column) for column in DERIVED),
+    ).filter(InvCount.store_id == store_id)
+    if since is not None:
+        query = query.filter(InvCount.trans_date >= since)
+    if item_ids is not None:
+        query = query.filter(InvCount.item_id.in_(item_ids))
+    counts = pd.DataFrame(
+        [tuple(row) for row in query.all()],
+        columns=["id", "item_id", "trans_date", "count_time", "count_total"]
+        + DERIVED,
+    )
+    if counts.empty:
+        return 0
+
+    counts = counts.sort_values(["item_id", "trans_date", "count_time"])
+    # the items whose earlier counts were all archived anchor on the archive
+    anchor = archived_counts(store_id, since, item_ids)
+    if since is not None:
+        anchor.update(previous_totals(store_id, since, item_ids))
+    previous = counts.groupby("item_id")["count_total"].shift(1)
+    first = previous.isna()
+    previous[first] = counts.loc[first, "item_id"].map(anchor)
+
+    keys = ["item_id", "trans_date"]
+    purchases = daily_totals(
+        InvPurchases, InvPurchases.purchase_total, store_id, since, item_ids
+    ).rename(columns={"total": "purchases"})
+    sales = daily_totals(
+        InvSales, InvSales.sales_total, store_id, since, item_ids
+    ).rename(columns={"total": "sales"})
+    frame = counts.merge(purchases, on=keys, how="left").merge(
+        sales, on=keys, how="left"
+    )
+    frame.index = counts.index
+
+    new = pd.DataFrame(index=counts.index)
+    new["previous_total"] = previous.fillna(0).astype(int)
+    new["theory"] = (
+        new["previous_total"]
+        + frame["purchases"].fillna(0).astype(int)
+        - frame["sales"].fillna(0).astype(int)
+    )
+    new["daily_variance"] = counts["count_total"] - new["theory"]
+
+    moved = (counts[DERIVED] != new[DERIVED]).any(axis=1)
+    rows = new.loc[moved].assign(id=counts.loc[moved, "id"]).to_dict("records")
+    if rows:
+        db.session.execute(update(InvCount), rows)
+    return len(rows)
+
+
+def existing_counts(store_id, trans_date, count_time, item_ids):
+    rows = db.session.query(InvCount.item_id, InvCount.item_name).filter(
+        InvCount.store_id == store_id,
+        InvCount.item_id.in_(item_ids),
+        InvCount.trans_date == trans_date,
+        InvCount.count_time == count_time,
+    )
+    return dict(rows.all())
+
+
+def build_count_rows(store_id, trans_date, entries):
+    """
+    inv_count rows for count form entries.  Each entry carries its own
+    count_time; the derived columns are filled in by recompute_counts.
+    """
+    item_ids = [int(entry["item_id"]) for entry in entries]
+    if not item_ids:
+        return []
+    case_packs = dict(
+        db.session.query(InvItems.id, InvItems.case_pack).filter(
+            InvItems.id.in_(item_ids)
+        )
+    )
+    rows = []
+    for item_id, entry in zip(item_ids, entries):
+        count_total = (case_packs.get(item_id) or 0) * entry["casecount"] + entry[
+            "eachcount"
+        ]
+        rows.append(
+            {
+                "trans_date": trans_date,
+                "count_time": entry["count_time"],
+                "item_name": entry["itemname"],
+                "case_count": entry["casecount"],
+                "each_count": entry["eachcount"],
+                "count_total": count_total,
+                "previous_total": 0,
+                "theory": 0,
+                "daily_variance": 0,
+                "item_id": item_id,
+                "store_id": store_id,
+            }
         )
-        ordered_count.daily_variance = (
-            unit.case_pack * ordered_count.case_count + ordered_count.each_count
-        ) - (ordered_count.previous_total + total_purchase - total_sales)
-        db.session.commit()
-        flash("Variances have been recalculated!", "success")
+    return rows
+
+
+def save_counts(store_id, trans_date, rows):
+    """
+    Upsert count rows on (store_id, item_id, trans_date, count_time) in one
+    statement, cascade them forward and commit once.  A second tablet
+    submitting the same count replaces it instead of doubling it.
+    """
+    if not rows:
+        return 0
+    upsert(InvCount.__table__, rows, COUNT_KEY)
+    recompute_counts(store_id, trans_date, [row["item_id"] for row in rows])
+    changes.touch(db.session, store_id, [trans_date])
+    db.session.commit()
+    return len(rows)
+
+
+def submit_counts(store_id, trans_date, count_time, entries):
+    """Insert one count per entry"""
+    entries = [{**entry, "count_time": count_time} for entry in entries]
+    rows = build_count_rows(store_id, trans_date, entries)
+    return save_counts(store_id, trans_date, rows)
+
+
+def update_counts(store_id, trans_date, count_time, entries):
+    """
+    Apply an edited day of counts: the day is loaded once, unchanged
+    entries are skipped and every insert and update goes out as one bulk
+    upsert.  New items get count_time, existing rows keep theirs.
+    """
+    current = {
+        row.item_id: row
+        for row in db.session.query(
+            InvCount.item_id,
+            InvCount.count_time,
+            InvCount.case_count,
+            InvCount.each_count,
+        ).filter(InvCount.store_id == store_id, InvCount.trans_date == trans_date)
+    }
+    changed = []
+    for entry in entries:
+        row = current.get(int(entry["item_id"]))
+        if row is None:
+            changed.append({**entry, "count_time": count_time})
+        elif (row.case_count, row.each_count) != (
+            entry["casecount"],
+            entry["eachcount"],
+        ):
+            changed.append({**entry, "count_time": row.count_time})
+    rows = build_count_rows(store_id, trans_date, changed)
+    return save_counts(store_id, trans_date, rows)
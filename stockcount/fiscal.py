@@ -0,0 +1,260 @@
+"""
+fiscal.py is the in-memory fiscal calendar
+
+The calendar table is read into numpy arrays indexed by days since the
+first calendar date, and read again once today runs past its last day, so every question about a date is an
+array lookup with real dates in and out:
+
+    cal = fiscal_calendar()
+    cal.day(date)              FiscalDay with week, period, quarter, year
+    cal.week(date)             (start, end) of the fiscal week, likewise
+    cal.period(date)           period, quarter and year
+    cal.periods_back(date, n)  (start, end) of the period n before date's
+    cal.to_date(date, "week")  (start, date) for WTD, PTD, QTD and YTD
+
+When the calendar table is empty the calendar is generated from
+FISCAL_YEAR_START as 52-week years of thirteen 4-week periods, quarters
+of 3, 3, 3 and 4 periods.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+from stockcount.models import Calendar, db
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ["week", "period", "quarter", "year"]
+
+FiscalDay = namedtuple(
+    "FiscalDay",
+    ["date", "dow", "week_of_year"]
+    + LEVELS
+    + [f"{level}_{edge}" for level in LEVELS for edge in ("start", "end")],
+)
+
+
+def _ordinals(values):
+    """Dates, datetimes or ISO strings -> int32 proleptic ordinals"""
+    days = pd.to_datetime(pd.Series(values)).dt.date
+    return np.fromiter((day.toordinal() for day in days), np.int32, len(days))
+
+
+class FiscalCalendar:
+    def __init__(self, frame):
+        """frame has the calendar table's columns, one row per day"""
+        frame = frame.assign(ordinal=_ordinals(frame["date"]))
+        frame = frame.sort_values("ordinal")
+        ordinals = frame["ordinal"].to_numpy()
+        self.origin = int(ordinals[0])
+        self.size = int(ordinals[-1]) - self.origin + 1
+        if len(ordinals) != self.size:
+            logger.warning(f"Fiscal calendar has {self.size - len(ordinals)} gaps")
+        index = ordinals - self.origin
+
+        self._known = np.zeros(self.size, bool)
+        self._known[index] = True
+        self._dow = self._array(index, frame["dow"])
+        for level in LEVELS:
+            setattr(self, f"_{level}", self._array(index, frame[level]))
+            for edge in ("start", "end"):
+                column = f"{level}_{edge}"
+                values = self._array(index, _ordinals(frame[column]))
+                setattr(self, f"_{column}", values)
+
+        # periods numbered in order, for "n periods back"
+        starts, first_days = np.unique(
+            self._period_start[self._known], return_index=True
+        )
+        self._period_starts = starts
+        self._period_ends = self._period_end[self._known][first_days]
+        self._period_number = np.searchsorted(starts, self._period_start)
+
+    def _array(self, index, values):
+        array = np.zeros(self.size, np.int32)
+        array[index] = np.nan_to_num(np.asarray(values, float)).astype(np.int32)
+        return array
+
+    def _index(self, day):
+        if isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+        elif isinstance(day, datetime):
+            day = day.date()
+        i = day.toordinal() - self.origin
+        if not 0 <= i < self.size or not self._known[i]:
+            raise KeyError(f"{day} is not in the fiscal calendar")
+        return i
+
+    def _date(self, array, i):
+        return date.fromordinal(int(array[i]))
+
+    def __contains__(self, day):
+        try:
+            self._index(day)
+        except KeyError:
+            return False
+        return True
+
+    @property
+    def first(self):
+        return date.fromordinal(self.origin)
+
+    @property
+    def last(self):
+        return date.fromordinal(self.origin + self.size - 1)
+
+    def day(self, day):
+        i = self._index(day)
+        values = {
+            "date": date.fromordinal(self.origin + i),
+            "dow": int(self._dow[i]),
+            "week_of_year": int((self._period[i] - 1) * 4 + self._week[i]),
+        }
+        for level in LEVELS:
+            values[level] = int(getattr(self, f"_{level}")[i])
+            for edge in ("start", "end"):
+                column = f"{level}_{edge}"
+                values[column] = self._date(getattr(self, f"_{column}"), i)
+        return FiscalDay(**values)
+
+    def bounds(self, day, level):
+        """(start, end) of the week, period, quarter or year holding day"""
+        i = self._index(day)
+        return (
+            self._date(getattr(self, f"_{level}_start"), i),
+            self._date(getattr(self, f"_{level}_end"), i),
+        )
+
+    def week(self, day):
+        return self.bounds(day, "week")
+
+    def period(self, day):
+        return self.bounds(day, "period")
+
+    def quarter(self, day):
+        return self.bounds(day, "quarter")
+
+    def year(self, day):
+        return self.bounds(day, "year")
+
+    def to_date(self, day, level):
+        """(start, day) for week, period, quarter or year to date"""
+        start, _ = self.bounds(day, level)
+        return start, self.day(day).date
+
+    def periods_back(self, day, n):
+        """(start, end) of the period n periods before the one holding day"""
+        number = int(self._period_number[self._index(day)]) - n
+        if not 0 <= number < len(self._period_starts):
+            raise KeyError(f"{n} periods before {day} is not in the calendar")
+        return (
+            self._date(self._period_starts, number),
+            self._date(self._period_ends, number),
+        )
+
+    def weeks_back(self, day, n):
+        """(start, end) of the week n weeks before the one holding day"""
+        start, _ = self.week(day)
+        return self.week(start - timedelta(weeks=n))
+
+
+def generate(first_year_start, years):
+    """Calendar rows for 52-week years of 4-week periods"""
+    rows = []
+    year_start = first_year_start
+    for _ in range(years):
+        year_end = year_start + timedelta(days=363)
+        year = year_end.year
+        for offset in range(364):
+            day = year_start + timedelta(days=offset)
+            period = offset // 28 + 1
+            quarter = min((period - 1) // 3 + 1, 4)
+            period_start = year_start + timedelta(days=(period - 1) * 28)
+            quarter_start = year_start + timedelta(days=(quarter - 1) * 84)
+            week_start = day - timedelta(days=offset % 7)
+            rows.append(
+                {
+                    "date": day,
+                    "dow": offset % 7 + 1,
+                    "week": (offset % 28) // 7 + 1,
+                    "week_start": week_start,
+                    "week_end": week_start + timedelta(days=6),
+                    "period": period,
+                    "period_start": period_start,
+                    "period_end": period_start + timedelta(days=27),
+                    "quarter": quarter,
+                    "quarter_start": quarter_start,
+                    "quarter_end": (
+                        quarter_start + timedelta(days=83) if quarter < 4 else year_end
+                    ),
+                    "year": year,
+                    "year_start": year_start,
+                    "year_end": year_end,
+                }
+            )
+        year_start = year_end + timedelta(days=1)
+    return pd.DataFrame(rows)
+
+
+def load_calendar(config=None):
+    """Read the calendar table, or generate one if it is empty"""
+    columns = ["date", "dow"] + [
+        f"{level}{suffix}" for level in LEVELS for suffix in ("", "_start", "_end")
+    ]
+    query = db.session.query(*(getattr(Calendar, column) for column in columns))
+    rows = [tuple(row) for row in query.all()]
+    if rows:
+        return FiscalCalendar(pd.DataFrame(rows, columns=columns))
+
+    config = config or {}
+    first = config.get("FISCAL_YEAR_START")
+    if first is None:
+        raise LookupError("calendar table is empty and FISCAL_YEAR_START is not set")
+    first = date.fromisoformat(str(first))
+    logger.warning(f"calendar table is empty, generating from {first}")
+    return FiscalCalendar(generate(first, config.get("FISCAL_YEARS", 10)))
+
+
+_calendar = None
+# the day the calendar was last loaded, so a table that is not extended
+# yet is read again once a day rather than on every call
+_loaded_on = None
+_lock = threading.Lock()
+
+
+def _stale(today):
+    return _calendar is None or (today > _calendar.last and today != _loaded_on)
+
+
+def fiscal_calendar():
+    """
+    The process-wide fiscal calendar, loaded on first use and reloaded
+    once today is past its last day
+    """
+    global _calendar, _loaded_on
+    today = date.today()
+    if _stale(today):
+        with _lock:
+            if _stale(today):
+                _calendar = load_calendar(current_app.config)
+                _loaded_on = today
+                logger.info(
+                    f"Loaded fiscal calendar {_calendar.first} to {_calendar.last}"
+                )
+                if today > _calendar.last:
+                    logger.warning(f"Fiscal calendar ends {_calendar.last}, extend it")
+    return _calendar
+
+
+def invalidate():
+    """Drop the calendar, e.g. after the calendar table is extended"""
+    global _calendar, _loaded_on
+    with _lock:
+        _calendar = None
+        _loaded_on = None
@@ -0,0 +1,132 @@
+"""
+importers loads the Toast and R365 exports into the stockcount tables
+
+Every importer reads its source as a stream of pandas chunks, so memory
+stays bounded by the chunk size, and writes with bulk.copy_upsert on the
+table's key, so a rerun over the same data changes nothing.  Per-store
+watermarks in stockcount_ingest_watermark let reruns skip what is
+already loaded.
+
+This module holds the pieces the importers share.
+"""
+
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+
+import pandas as pd
+
+from stockcount import changes, db
+from stockcount.bulk import upsert
+from stockcount.fiscal import fiscal_calendar
+from stockcount.models import StockcountIngestWatermark, UnitsOfMeasure
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+
+
+class ImportStats:
+    """Row counts and timing for one import run"""
+
+    def __init__(self, source):
+        self.source = source
+        self.read = 0
+        self.written = 0
+        self.rejected = Counter()
+        self.started = time.perf_counter()
+
+    def reject(self, reason, count=1):
+        if count:
+            self.rejected[reason] += int(count)
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        rejected = sum(self.rejected.values())
+        lines = [
+            f"{self.source}: read {self.read} rows, wrote {self.written}, "
+            f"rejected {rejected} in {self.seconds:.1f}s ({self.rate:,.0f} rows/s)"
+        ]
+        lines += [f"  {count:8} {reason}" for reason, count in self.rejected.items()]
+        return "\n".join(lines)
+
+
+def watermarks(source, store_ids=None):
+    """{store_id: newest date loaded} for the source"""
+    query = db.session.query(
+        StockcountIngestWatermark.store_id, StockcountIngestWatermark.date
+    ).filter(StockcountIngestWatermark.source == source)
+    if store_ids is not None:
+        query = query.filter(StockcountIngestWatermark.store_id.in_(store_ids))
+    return dict(query.all())
+
+
+def advance_watermarks(source, loaded):
+    """Move each store's watermark forward to the newest date in loaded"""
+    current = watermarks(source, list(loaded))
+    rows = [
+        {
+            "source": source,
+            "store_id": store_id,
+            "date": day,
+            "updated_at": datetime.now(timezone.utc),
+        }
+        for store_id, day in loaded.items()
+        if store_id not in current or day > current[store_id]
+    ]
+    upsert(StockcountIngestWatermark.__table__, rows, ["source", "store_id"])
+
+
+def skip_loaded(frame, marks, stats):
+    """Drop rows older than their store's watermark"""
+    if not marks:
+        return frame
+    old = frame["date"] < frame["store_id"].map(marks).fillna(date.min)
+    stats.reject("before watermark", old.sum())
+    return frame[~old]
+
+
+def load_units():
+    """UnitsOfMeasure by name: equivalent_qty, base_qty and base_uofm"""
+    rows = db.session.query(
+        UnitsOfMeasure.name,
+        UnitsOfMeasure.equivalent_qty,
+        UnitsOfMeasure.base_qty,
+        UnitsOfMeasure.base_uofm,
+    ).all()
+    return pd.DataFrame(
+        [tuple(row) for row in rows],
+        columns=["uofm", "equivalent_qty", "base_qty", "base_uofm"],
+    ).drop_duplicates("uofm")
+
+
+def add_fiscal_columns(frame):
+    """dow, week, period and year for frame["date"] from the fiscal calendar"""
+    cal = fiscal_calendar()
+    days = {}
+    for day in frame["date"].unique():
+        days[day] = cal.day(day) if day in cal else None
+    for column in ("dow", "week", "period", "year"):
+        frame[column] = frame["date"].map(
+            lambda day: getattr(days[day], column) if days[day] else None
+        )
+    return frame
+
+
+def touch_days(frame):
+    """Report bulk-written (store_id, date) pairs to stockcount.changes"""
+    for store_id, dates in frame.groupby("store_id")["date"]:
+        changes.touch(db.session, int(store_id), dates.unique())
+
+
+def to_records(frame):
+    """Row dicts with numpy scalars and NaN turned into python values"""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
@@ -0,0 +1,277 @@
+"""
+importers/r365.py bulk-loads R365 purchase and waste exports
+
+    flask r365 import purchases FILE... [--since D] [--until D]
+    flask r365 import waste FILE... [--since D] [--until D] [--force]
+    python -m stockcount.importers.r365 waste FILE...
+
+CSV exports are read in chunks.  Headers are matched loosely ("Transaction
+ID", "TransactionId" and "transactionid" are the same column), each chunk
+is validated and converted with one merge against UnitsOfMeasure:
+
+    purchases   unit_count = quantity * equivalent_qty
+    waste       base_qty = quantity * base_qty, base_uofm from the unit
+
+and upserted on the table key.  Purchases are keyed on transactionid and
+a transaction seen twice keeps its last row.  Waste exports have one row
+per waste entry while the table holds one total per (date, store, item),
+so the entries of every file are summed per key before anything is
+written, and a day's total is replaced as a whole.  Rows that cannot be
+loaded are counted by reason, never half-written.
+
+Only waste skips days before its watermark.  Invoices are often posted
+days late, and the transactionid upsert already makes a reload harmless,
+so purchases are always loaded in full and --force is refused for them.
+"""
+
+import argparse
+import logging
+import re
+
+import pandas as pd
+
+from stockcount import create_app, db
+from stockcount.access import store_access
+from stockcount.bulk import copy_upsert
+from stockcount.importers import (
+    CHUNK_SIZE,
+    ImportStats,
+    add_fiscal_columns,
+    advance_watermarks,
+    load_units,
+    skip_loaded,
+    to_records,
+    touch_days,
+    watermarks,
+)
+from stockcount.models import StockcountPurchases, StockcountWaste
+
+logger = logging.getLogger(__name__)
+
+# loose header -> column
+HEADERS = {
+    "transactionid": "transactionid",
+    "transaction": "transactionid",
+    "date": "date",
+    "transactiondate": "date",
+    "storeid": "store_id",
+    "location": "store",
+    "store": "store",
+    "item": "item",
+    "itemname": "item",
+    "quantity": "quantity",
+    "qty": "quantity",
+    "uofm": "uofm",
+    "uom": "uofm",
+    "unitofmeasure": "uofm",
+}
+
+KINDS = {
+    "purchases": {
+        "model": StockcountPurchases,
+        "key": ["transactionid"],
+        "required": ["transactionid", "date", "item", "quantity", "uofm"],
+        "skip_loaded": False,
+    },
+    "waste": {
+        "model": StockcountWaste,
+        "key": ["date", "store", "item"],
+        "required": ["date", "item", "quantity", "uofm"],
+        "skip_loaded": True,
+    },
+}
+# waste entries are summed per key and unit before the units are reconciled
+WASTE_GROUP = ["date", "store", "item", "store_id", "uofm", "base_uofm"]
+
+
+def _header(name):
+    return HEADERS.get(re.sub(r"[^a-z]", "", str(name).lower()))
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """CSV chunks with their headers mapped to column names"""
+    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str):
+        columns = {}
+        for name in chunk.columns:
+            column = _header(name)
+            if column and column not in columns.values():
+                columns[name] = column
+        yield chunk[list(columns)].rename(columns=columns)
+
+
+def resolve_stores(chunk, store_id=None):
+    """Fill store_id and store from a --store, store ids or location names"""
+    if store_id is not None:
+        ids = pd.Series(store_id, index=chunk.index)
+    elif "store_id" in chunk:
+        ids = pd.to_numeric(chunk["store_id"], errors="coerce")
+    else:
+        lookup = {}
+        for store in store_access.stores():
+            lookup[store.name] = store.id
+            if store.locationid:
+                lookup[store.locationid] = store.id
+        ids = chunk.get("store", pd.Series(index=chunk.index, dtype=str)).map(lookup)
+    names = {store.id: store.name for store in store_access.stores()}
+    chunk["store_id"] = ids
+    chunk["store"] = ids.map(names)
+    return chunk
+
+
+def prepare(kind, chunk, units, stats, store_id=None, since=None, until=None):
+    """Validate and convert one chunk; returns the loadable rows"""
+    spec = KINDS[kind]
+    missing = [column for column in spec["required"] if column not in chunk]
+    if missing:
+        raise ValueError(f"{kind} export has no {', '.join(missing)} column")
+
+    chunk = resolve_stores(chunk.copy(), store_id)
+    chunk["date"] = pd.to_datetime(chunk["date"], errors="coerce").dt.date
+    chunk["quantity"] = pd.to_numeric(chunk["quantity"], errors="coerce")
+    checks = {
+        "unknown store": chunk["store"].isna(),
+        "bad date": chunk["date"].isna(),
+        "bad quantity": chunk["quantity"].isna(),
+        "no item": chunk["item"].isna(),
+    }
+    if kind == "purchases":
+        checks["no transaction id"] = chunk["transactionid"].isna()
+    rejected = pd.Series(False, index=chunk.index)
+    for reason, failed in checks.items():
+        stats.reject(reason, (failed & ~rejected).sum())
+        rejected |= failed
+    chunk = chunk[~rejected].astype({"store_id": int})
+
+    if since is not None:
+        stats.reject("before --since", (chunk["date"] < since).sum())
+        chunk = chunk[chunk["date"] >= since]
+    if until is not None:
+        stats.reject("after --until", (chunk["date"] > until).sum())
+        chunk = chunk[chunk["date"] <= until]
+
+    chunk = chunk.merge(units, on="uofm", how="left")
+    unknown = chunk["equivalent_qty"].isna() & chunk["base_qty"].isna()
+    stats.reject("unknown uofm", unknown.sum())
+    chunk = chunk[~unknown]
+
+    if kind == "purchases":
+        chunk["unit_count"] = chunk["quantity"] * chunk["equivalent_qty"].fillna(1)
+        chunk["quantity"] = chunk["quantity"].round().astype(int)
+    else:
+        chunk["base_qty"] = chunk["quantity"] * chunk["base_qty"].fillna(1)
+        chunk["base_uofm"] = chunk["base_uofm"].fillna(chunk["uofm"])
+
+    if kind == "purchases":
+        before = len(chunk)
+        chunk = chunk.drop_duplicates(spec["key"], keep="last")
+        stats.reject("duplicate transaction id, kept last", before - len(chunk))
+
+    columns = [column.name for column in spec["model"].__table__.columns]
+    chunk = add_fiscal_columns(chunk)
+    return chunk[[column for column in columns if column in chunk]]
+
+
+def sum_waste(totals, frame):
+    """Add a chunk's waste entries to the running sums per WASTE_GROUP"""
+    summed = frame.groupby(WASTE_GROUP)[["quantity", "base_qty"]].sum()
+    return summed if totals is None else totals.add(summed, fill_value=0)
+
+
+def total_waste(totals):
+    """One row per date, store and item from the summed waste entries"""
+    columns = [column.name for column in StockcountWaste.__table__.columns]
+    if totals is None:
+        return pd.DataFrame(columns=columns)
+    totals = totals.reset_index()
+    # entries of one item in different units only add up in the base unit
+    mixed = totals.duplicated(KINDS["waste"]["key"], keep=False)
+    totals.loc[mixed, "quantity"] = totals.loc[mixed, "base_qty"]
+    totals.loc[mixed, "uofm"] = totals.loc[mixed, "base_uofm"]
+    totals = totals.groupby(KINDS["waste"]["key"], as_index=False).agg(
+        store_id=("store_id", "first"),
+        uofm=("uofm", "first"),
+        quantity=("quantity", "sum"),
+        base_uofm=("base_uofm", "first"),
+        base_qty=("base_qty", "sum"),
+    )
+    return add_fiscal_columns(totals)[columns]
+
+
+def write(kind, frame, stats, newest):
+    """Upsert prepared rows and note each store's newest day"""
+    spec = KINDS[kind]
+    stats.written += copy_upsert(
+        spec["model"].__table__, to_records(frame), spec["key"]
+    )
+    touch_days(frame)
+    for store, day in frame.groupby("store_id")["date"].max().items():
+        newest[store] = max(day, newest.get(store, day))
+    db.session.commit()
+    logger.info(f"r365_{kind}: {stats.written} rows, {stats.rate:,.0f} rows/s")
+
+
+def import_files(kind, paths, store_id=None, since=None, until=None, force=False):
+    """
+    Stream R365 exports of one kind into their table.  Purchases are
+    written chunk by chunk.  Waste is summed over every file first and
+    written in CHUNK_SIZE slices.  Without force, waste rows before the
+    store's watermark are skipped unless since asks for them; the
+    watermark day itself is always reloaded.
+    """
+    spec = KINDS[kind]
+    source = f"r365_{kind}"
+    stats = ImportStats(source)
+    units = load_units()
+    skip = spec["skip_loaded"] and not force and since is None
+    marks = watermarks(source) if skip else {}
+    newest = {}
+    waste = None
+    for path in paths:
+        for chunk in read_chunks(path):
+            stats.read += len(chunk)
+            frame = prepare(kind, chunk, units, stats, store_id, since, until)
+            frame = skip_loaded(frame, marks, stats)
+            if frame.empty:
+                continue
+            if kind == "waste":
+                waste = sum_waste(waste, frame)
+            else:
+                write(kind, frame, stats, newest)
+    if kind == "waste":
+        totals = total_waste(waste)
+        for start in range(0, len(totals), CHUNK_SIZE):
+            write(kind, totals.iloc[start : start + CHUNK_SIZE], stats, newest)
+    advance_watermarks(source, newest)
+    db.session.commit()
+    logger.info(stats.summary())
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import R365 exports.")
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--store", type=int, help="store id if the files lack one")
+    parser.add_argument("--since", type=pd.Timestamp, help="first day to load")
+    parser.add_argument("--until", type=pd.Timestamp, help="last day to load")
+    parser.add_argument(
+        "--force", action="store_true", help="reload waste before the watermark"
+    )
+    args = parser.parse_args(argv)
+    if args.force and not KINDS[args.kind]["skip_loaded"]:
+        parser.error(f"--force only applies to waste, not {args.kind}")
+
+    with create_app().app_context():
+        stats = import_files(
+            args.kind,
+            args.paths,
+            args.store,
+            args.since.date() if args.since is not None else None,
+            args.until.date() if args.until is not None else None,
+            args.force,
+        )
+    print(stats.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+importers/toast.py streams Toast item sales into stockcount_sales_toast
+
+Sources, each read in chunks:
+
+    ItemSelectionDetails CSV exports (Location, Order Date, Menu Item,
+        Qty, Void?)
+    orders JSON, one order per line (.jsonl) or an array (.json), in the
+        ordersBulk shape: businessDate, checks[].selections[] with
+        displayName, quantity and voided, plus restaurantGuid or --store
+    the Toast API, or any stand-in serving the same two endpoints, with
+        the credentials in TOAST_API_ACCESS_URL, CLIENT_ID, CLIENT_SECRET
+        and USER_ACCESS_TYPE; the token is kept in TOKEN_CACHE_FILE
+
+Selections are summed per store, business date and menu item, then
+exploded through the recipe graph into one row per ingredient:
+
+    base_usage   qty per menu item * sales_count, in the recipe uofm
+    count_usage  base_usage * the uofm's equivalent_qty (count units)
+
+Each (store, date, menu item) total is the whole day's, so reloading a
+day replaces it.  Rows before the store's watermark are skipped; the
+watermark day itself is reloaded because it may have been partial.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import requests
+
+from stockcount import db
+from stockcount.access import store_access
+from stockcount.bulk import copy_upsert
+from stockcount.importers import (
+    CHUNK_SIZE,
+    ImportStats,
+    add_fiscal_columns,
+    advance_watermarks,
+    load_units,
+    skip_loaded,
+    to_records,
+    touch_days,
+    watermarks,
+)
+from stockcount.main.recipes import recipe_cache
+from stockcount.models import StockcountSalesToast
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "toast"
+KEY = ["date", "store_id", "menuitem", "ingredient"]
+SALES_COLUMNS = ["store_id", "date", "menuitem", "quantity"]
+PAGE_SIZE = 100
+
+
+class StoreLookup:
+    """Resolve Toast restaurant guids, location names and ids to store ids"""
+
+    def __init__(self):
+        stores = store_access.stores()
+        self.by_guid = {s.toast_guid: s.id for s in stores if s.toast_guid}
+        self.by_name = {s.name: s.id for s in stores if s.name}
+        self.by_toast_id = {s.toast_id: s.id for s in stores if s.toast_id}
+
+    def resolve(self, guid=None, name=None, toast_id=None):
+        return (
+            self.by_guid.get(guid)
+            or self.by_name.get(name)
+            or self.by_toast_id.get(toast_id)
+        )
+
+
+def _sales_frame(rows):
+    return pd.DataFrame(rows, columns=SALES_COLUMNS)
+
+
+def read_csv(path, lookup, stats, store_id=None, chunk_size=CHUNK_SIZE):
+    """ItemSelectionDetails CSV -> sales chunks"""
+    columns = ["Location", "Order Date", "Menu Item", "Qty", "Void?"]
+    for chunk in pd.read_csv(
+        path,
+        chunksize=chunk_size,
+        usecols=lambda name: name in columns,
+        dtype={"Location": str, "Menu Item": str},
+    ):
+        stats.read += len(chunk)
+        voided = chunk.get("Void?", pd.Series(False, index=chunk.index))
+        voided = voided.astype(str).str.lower().isin(["true", "yes", "1"])
+        stats.reject("voided", voided.sum())
+        chunk = chunk[~voided]
+        if store_id is not None:
+            stores = pd.Series(store_id, index=chunk.index)
+        else:
+            locations = chunk["Location"]
+            names = {name: lookup.resolve(name=name) for name in locations.unique()}
+            stores = locations.map(names)
+        yield pd.DataFrame(
+            {
+                "store_id": stores,
+                "date": pd.to_datetime(chunk["Order Date"], format="mixed").dt.date,
+                "menuitem": chunk["Menu Item"],
+                "quantity": pd.to_numeric(chunk["Qty"], errors="coerce"),
+            }
+        )
+
+
+def _business_date(value):
+    return datetime.strptime(str(value), "%Y%m%d").date()
+
+
+def order_rows(orders, lookup, stats, store_id=None):
+    """Flatten ordersBulk orders to (store_id, date, menuitem, quantity)"""
+    rows = []
+    for order in orders:
+        if order.get("voided") or order.get("deleted"):
+            stats.reject("voided order")
+            continue
+        store = store_id or lookup.resolve(guid=order.get("restaurantGuid"))
+        business_date = _business_date(order["businessDate"])
+        for check in order.get("checks") or []:
+            if check.get("voided") or check.get("deleted"):
+                continue
+            for selection in check.get("selections") or []:
+                stats.read += 1
+                if selection.get("voided"):
+                    stats.reject("voided")
+                    continue
+                rows.append(
+                    (
+                        store,
+                        business_date,
+                        selection.get("displayName"),
+                        selection.get("quantity"),
+                    )
+                )
+    return rows
+
+
+def read_json(path, lookup, stats, store_id=None, chunk_size=CHUNK_SIZE):
+    """Orders JSON -> sales chunks; .jsonl is streamed line by line"""
+    with open(path) as source:
+        if path.endswith((".jsonl", ".ndjson")):
+            orders = (json.loads(line) for line in source if line.strip())
+        else:
+            orders = iter(json.load(source))
+        while True:
+            batch = [order for _, order in zip(range(chunk_size), orders)]
+            if not batch:
+                return
+            yield _sales_frame(order_rows(batch, lookup, stats, store_id))
+
+
+class ToastClient:
+    """Minimal Toast API client: login and paged ordersBulk"""
+
+    def __init__(self, config):
+        self.base_url = config["TOAST_API_ACCESS_URL"].rstrip("/")
+        self.client_id = config.get("CLIENT_ID")
+        self.client_secret = config.get("CLIENT_SECRET")
+        self.access_type = config.get("USER_ACCESS_TYPE") or "TOAST_MACHINE_CLIENT"
+        self.token_file = config.get("TOKEN_CACHE_FILE")
+        self.http = requests.Session()
+        self._token = None
+
+    def _cached_token(self):
+        cached = self.token_file and os.path.exists(self.token_file)
+        if self._token is None and cached:
+            with open(self.token_file) as cache:
+                self._token = json.load(cache)
+        if self._token and self._token["expires_at"] > time.time() + 60:
+            return self._token["access_token"]
+        return None
+
+    def token(self):
+        cached = self._cached_token()
+        if cached:
+            return cached
+        response = self.http.post(
+            f"{self.base_url}/authentication/v1/authentication/login",
+            json={
+                "clientId": self.client_id,
+                "clientSecret": self.client_secret,
+                "userAccessType": self.access_type,
+            },
+            timeout=30,
+        )
+        response.raise_for_status()
+        token = response.json()["token"]
+        self._token = {
+            "access_token": token["accessToken"],
+            "expires_at": time.time() + token.get("expiresIn", 3600),
+        }
+        if self.token_file:
+            with open(self.token_file, "w") as cache:
+                json.dump(self._token, cache)
+        return self._token["access_token"]
+
+    def orders(self, restaurant_guid, business_date):
+        """Every order of one restaurant and business date, page by page"""
+        page = 1
+        while True:
+            response = self.http.get(
+                f"{self.base_url}/orders/v2/ordersBulk",
+                params={
+                    "businessDate": business_date.strftime("%Y%m%d"),
+                    "page": page,
+                    "pageSize": PAGE_SIZE,
+                },
+                headers={
+                    "Authorization": f"Bearer {self.token()}",
+                    "Toast-Restaurant-External-ID": restaurant_guid,
+                },
+                timeout=60,
+            )
+            response.raise_for_status()
+            orders = response.json()
+            yield orders
+            if len(orders) < PAGE_SIZE:
+                return
+            page += 1
+
+
+def read_api(client, store_ids, start_date, end_date, lookup, stats):
+    """Orders for each store and business date -> sales chunks"""
+    days = pd.date_range(start_date, end_date).date
+    for store_id in store_ids:
+        store = store_access.store(store_id)
+        if store is None or not store.toast_guid:
+            logger.warning(f"Store {store_id} has no Toast guid, skipped")
+            continue
+        for day in days:
+            for orders in client.orders(store.toast_guid, day):
+                yield _sales_frame(order_rows(orders, lookup, stats, store_id))
+
+
+def aggregate(chunks, stats, marks):
+    """Sum every chunk to one quantity per store, date and menu item"""
+    totals = None
+    for chunk in chunks:
+        missing = chunk["store_id"].isna()
+        stats.reject("unknown store", missing.sum())
+        unpriced = chunk["quantity"].isna() | chunk["menuitem"].isna()
+        stats.reject("no menu item or quantity", (unpriced & ~missing).sum())
+        chunk = chunk[~missing & ~unpriced].astype({"store_id": int})
+        chunk = skip_loaded(chunk, marks, stats)
+        summed = chunk.groupby(["store_id", "date", "menuitem"])["quantity"].sum()
+        totals = summed if totals is None else totals.add(summed, fill_value=0)
+    if totals is None:
+        return _sales_frame([])
+    return totals.rename("sales_count").reset_index()
+
+
+def recipe_frame(concept):
+    """menuitem, ingredient, qty and uofm from the concept's recipe graph"""
+    graph = recipe_cache.graph(concept)
+    return pd.DataFrame(
+        [
+            (menu_item, ingredient, usage.qty, usage.uofm)
+            for menu_item, ingredients in graph.closure.items()
+            for ingredient, usage in ingredients.items()
+        ],
+        columns=["menuitem", "ingredient", "qty", "uofm"],
+    )
+
+
+def explode(sales, stats):
+    """Menu item totals -> stockcount_sales_toast rows, one per ingredient"""
+    units = load_units()
+    frames = []
+    for store_id, store_sales in sales.groupby("store_id"):
+        store = store_access.store(store_id)
+        if store is None:
+            stats.reject("unknown store", len(store_sales))
+            continue
+        recipes = recipe_frame(store.concept)
+        rows = store_sales.merge(recipes, on="menuitem", how="left")
+        unmapped = rows["ingredient"].isna()
+        stats.reject("menu item without recipe", unmapped.sum())
+        rows = rows[~unmapped].merge(
+            units[["uofm", "equivalent_qty"]], on="uofm", how="left"
+        )
+        rows["base_usage"] = rows["qty"] * rows["sales_count"]
+        rows["count_usage"] = rows["base_usage"] * rows["equivalent_qty"].fillna(1)
+        frames.append(
+            rows.assign(store=store.name, concept=store.concept).rename(
+                columns={"uofm": "base_uofm"}
+            )
+        )
+    columns = [column.name for column in StockcountSalesToast.__table__.columns]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    frame = pd.concat(frames, ignore_index=True)
+    frame["sales_count"] = frame["sales_count"].round().astype(int)
+    return add_fiscal_columns(frame)[columns]
+
+
+def load_sales(chunks, stats, store_ids=None, force=False):
+    """Aggregate, explode and upsert sales chunks, then move watermarks"""
+    marks = {} if force else watermarks(SOURCE, store_ids)
+    sales = aggregate(chunks, stats, marks)
+    if store_ids is not None:
+        sales = sales[sales["store_id"].isin(store_ids)]
+    frame = explode(sales, stats)
+    for start in range(0, len(frame), CHUNK_SIZE):
+        rows = to_records(frame.iloc[start : start + CHUNK_SIZE])
+        stats.written += copy_upsert(StockcountSalesToast.__table__, rows, KEY)
+    if not frame.empty:
+        touch_days(frame)
+        advance_watermarks(SOURCE, frame.groupby("store_id")["date"].max().to_dict())
+    db.session.commit()
+    logger.info(stats.summary())
+    return stats
+
+
+def import_files(paths, store_id=None, force=False):
+    """Load Toast CSV or JSON exports"""
+    stats = ImportStats(SOURCE)
+    lookup = StoreLookup()
+
+    def chunks():
+        for path in paths:
+            reader = read_csv if path.endswith(".csv") else read_json
+            yield from reader(path, lookup, stats, store_id)
+
+    store_ids = [store_id] if store_id is not None else None
+    return load_sales(chunks(), stats, store_ids, force)
+
+
+def import_api(config, store_ids, start_date=None, end_date=None, force=False):
+    """
+    Pull orders from the API.  Without start_date each store starts at its
+    watermark, or yesterday for a store never loaded.
+    """
+    stats = ImportStats(SOURCE)
+    lookup = StoreLookup()
+    client = ToastClient(config)
+    end_date = end_date or date.today()
+    marks = watermarks(SOURCE, store_ids)
+    default_start = end_date - timedelta(days=1)
+
+    def chunks():
+        for store_id in store_ids:
+            start = start_date or marks.get(store_id, default_start)
+            yield from read_api(client, [store_id], start, end_date, lookup, stats)
+
+    return load_sales(chunks(), stats, store_ids, force)
@@ -0,0 +1,106 @@
+"""
+main/details.py builds the report_details page from one in-memory window
+
+The item's whole 8-week window is read once from the materialized daily
+variance, and the table, both charts and the day-of-week stats
+are all sliced out of that frame.
+"""
+
+from datetime import timedelta
+
+from stockcount.main.variance import read_variance
+
+WINDOW_DAYS = 56
+TABLE_DAYS = 7
+MONTH_DAYS = 28
+# fiscal weeks start on Wednesday, the first label of the day-of-week chart
+WEEK_START = 2
+
+
+def window_start(end_date, days=WINDOW_DAYS):
+    return end_date - timedelta(days=days - 1)
+
+
+def item_window(frame):
+    """An item's variance frame, newest day first, with its dow column"""
+    frame = frame.sort_values("date", ascending=False, ignore_index=True)
+    frame["dow"] = [(day.weekday() - WEEK_START) % 7 for day in frame["date"]]
+    return frame
+
+
+def load_item_window(store_id, item_id, end_date, days=WINDOW_DAYS):
+    """Variance frame for one item, newest day first"""
+    start_date = window_start(end_date, days)
+    return item_window(
+        read_variance(store_id, start_date, end_date, item_ids=[item_id])
+    )
+
+
+def item_details(store_id, item_id, end_date):
+    """Return the template context for main/details.html"""
+    return details_context(load_item_window(store_id, item_id, end_date), end_date)
+
+
+def details_context(frame, end_date):
+    """The details context from an item window, see item_window"""
+    recent = frame.head(TABLE_DAYS)
+    details = [
+        {
+            "trans_date": row["date"],
+            "previous_total": row["begin"],
+            "purchase_count": round(row["purchases"]),
+            "sales_count": row["sales"],
+            "sales_waste": round(row["waste"]),
+            "theory": round(row["theory"]),
+            "count_total": row["count"],
+            "daily_variance": round(row["variance"]),
+        }
+        for row in recent.to_dict("records")
+    ]
+
+    first_entry = details[0]
+    current_on_hand = (
+        first_entry["count_total"]
+        if first_entry["count_total"] != 0
+        else first_entry["theory"]
+    )
+    purchase_total = sum(d["purchase_count"] for d in details)
+    sales_total = sum(d["sales_count"] for d in details)
+    avg_sales_total = sales_total / TABLE_DAYS
+    avg_count_total = sum(d["count_total"] for d in details) / len(details)
+    # watch for division by 0
+    try:
+        avg_on_hand = current_on_hand / avg_sales_total
+    except ZeroDivisionError:
+        avg_on_hand = 0
+
+    # Chart 1, oldest day first
+    chart = recent.iloc[::-1]
+    labels = [day.strftime("%A") for day in chart["date"]]
+    unit_onhand = chart["count"].tolist()
+    unit_sales = chart["sales"].tolist()
+
+    # Chart 2, only days that have sales data
+    sold = frame[frame["r365_sales"].notna() | frame["toast_sales"].notna()]
+    by_dow = sold.groupby("dow")["sales"]
+    day_avg_sales = (
+        sold[sold["date"] > end_date - timedelta(days=MONTH_DAYS)]
+        .groupby("dow")["sales"]
+        .mean()
+        .tolist()
+    )
+
+    return {
+        "details": details,
+        "purchase_total": purchase_total,
+        "sales_total": sales_total,
+        "avg_count_total": avg_count_total,
+        "avg_on_hand": avg_on_hand,
+        "labels": labels,
+        "unit_sales": unit_sales,
+        "unit_onhand": unit_onhand,
+        "day_avg_sales": day_avg_sales,
+        "avg_sales_dow": by_dow.mean().tolist(),
+        "max_sales_dow": by_dow.max().tolist(),
+        "min_sales_dow": by_dow.min().tolist(),
+    }
@@ -0,0 +1,155 @@
+"""
+main/recipes.py is the in-memory recipe graph
+
+recipe_ingredients is loaded once per concept and every menu item is
+resolved down to its inventory ingredients, through any number of
+sub-recipe levels, with quantities multiplied along the way.  Pickers and
+usage calculations are then dictionary lookups.
+
+Rows with a menu_item belong to that menu item; rows without one describe
+a sub-recipe, named by recipe, which other rows use as an ingredient.
+
+The graphs are cached per process.  invalidate() drops them after an
+in-app reload, and a cheap fingerprint of recipe_ingredients is checked
+every RECIPE_CHECK_SECONDS to catch reloads done outside the app.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import func
+
+from stockcount import db
+from stockcount.models import RecipeIngredients
+
+logger = logging.getLogger(__name__)
+
+RECIPE_CHECK_SECONDS = 60
+
+# qty of an ingredient per menu item, and the recipe that uses it directly
+Usage = namedtuple("Usage", ["qty", "uofm", "recipe"])
+
+
+class RecipeGraph:
+    def __init__(self, rows):
+        self.menu_items = defaultdict(list)
+        self.sub_recipes = defaultdict(list)
+        for row in rows:
+            edge = (row.recipe, row.ingredient, row.qty or 0, row.uofm)
+            if row.menu_item is None:
+                self.sub_recipes[row.recipe].append(edge)
+            else:
+                self.menu_items[row.menu_item].append(edge)
+
+        self._expanded = {}
+        self.closure = {
+            menu_item: self._resolve(edges, frozenset([menu_item]))[0]
+            for menu_item, edges in self.menu_items.items()
+        }
+        self.used_by = defaultdict(list)
+        for menu_item, ingredients in self.closure.items():
+            for ingredient, usage in ingredients.items():
+                self.used_by[ingredient].append((menu_item, usage))
+
+    def _resolve(self, edges, path):
+        """
+        ({leaf: Usage}, complete), where complete is False when the cycle
+        guard cut a sub-recipe short and the result depends on path
+        """
+        totals, complete = {}, True
+        for recipe, ingredient, qty, uofm in edges:
+            if ingredient in self.sub_recipes and ingredient not in path:
+                leaves, done = self._expand(ingredient, path)
+                complete = complete and done
+                for leaf, usage in leaves.items():
+                    scaled = Usage(qty * usage.qty, usage.uofm, usage.recipe)
+                    self._add(totals, leaf, scaled)
+            else:
+                if ingredient in self.sub_recipes:
+                    complete = False
+                self._add(totals, ingredient, Usage(qty, uofm, recipe))
+        return totals, complete
+
+    def _expand(self, recipe, path):
+        # only whole closures are shared, a cut one is only right on its path
+        if recipe in self._expanded:
+            return self._expanded[recipe], True
+        totals, complete = self._resolve(self.sub_recipes[recipe], path | {recipe})
+        if complete:
+            self._expanded[recipe] = totals
+        return totals, complete
+
+    @staticmethod
+    def _add(totals, ingredient, usage):
+        if ingredient in totals:
+            usage = usage._replace(qty=totals[ingredient].qty + usage.qty)
+        totals[ingredient] = usage
+
+    def ingredients(self, menu_item):
+        """{ingredient: Usage} for one menu item, fully resolved"""
+        return self.closure.get(menu_item, {})
+
+    def usage(self, menu_item, ingredient):
+        usage = self.ingredients(menu_item).get(ingredient)
+        return usage.qty if usage else 0
+
+    def uses(self, ingredients):
+        """(menu_item, ingredient, Usage) for every menu item using them"""
+        for ingredient in ingredients:
+            for menu_item, usage in self.used_by.get(ingredient, ()):
+                yield menu_item, ingredient, usage
+
+
+class RecipeCache:
+    def __init__(self):
+        self._graphs = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, concept):
+        query = db.session.query(
+            func.count(), func.sum(RecipeIngredients.qty)
+        ).select_from(RecipeIngredients)
+        if concept is not None:
+            query = query.filter(RecipeIngredients.concept == concept)
+        return tuple(query.one())
+
+    def _load(self, concept):
+        query = db.session.query(
+            RecipeIngredients.menu_item,
+            RecipeIngredients.recipe,
+            RecipeIngredients.ingredient,
+            RecipeIngredients.qty,
+            RecipeIngredients.uofm,
+        )
+        if concept is not None:
+            query = query.filter(RecipeIngredients.concept == concept)
+        return RecipeGraph(query.all())
+
+    def graph(self, concept):
+        """The concept's graph, rebuilt if recipe_ingredients changed"""
+        now = time.monotonic()
+        entry = self._graphs.get(concept)
+        if entry is not None and now - entry["checked"] < RECIPE_CHECK_SECONDS:
+            return entry["graph"]
+
+        fingerprint = self._fingerprint(concept)
+        with self._lock:
+            entry = self._graphs.get(concept)
+            if entry is None or entry["fingerprint"] != fingerprint:
+                logger.info(f"Loading recipe graph for {concept}")
+                entry = {"graph": self._load(concept), "fingerprint": fingerprint}
+                self._graphs[concept] = entry
+            entry["checked"] = now
+            return entry["graph"]
+
+    def invalidate(self, concept=None):
+        with self._lock:
+            if concept is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(concept, None)
+
+
+recipe_cache = RecipeCache()
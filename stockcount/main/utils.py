@@ -6,17 +6,16 @@ from stockcount.models import (
     StockcountPurchases,
     StockcountSales,
     StockcountWaste,
-    Users,
-    Restaurants,
     InvItems,
     Item,
-    RecipeIngredients,
     MenuItems,
 )
 from flask import session
 from sqlalchemy import or_, and_
 
 from stockcount import db
+from stockcount.access import store_access
+from stockcount.main.recipes import recipe_cache
 from collections import namedtuple
 
 logger = logging.getLogger(__name__)
@@ -26,23 +25,12 @@ MenuItem = namedtuple("MenuItem", ["menu_item", "recipe", "ingredient", "id"])
 
 
 def set_user_access():
-    store_list = Users.query.filter_by(id=current_user.id).first()
-    # get number of stores user has access to and store id in a list
-    access = []
-    for store in store_list.stores:
-        if store.id in [99, 98]:
-            access = [3, 4, 5, 6, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
-            return access
-        access.append(store.id)
-    return access
+    """Store ids the current user can access, cached per user"""
+    return store_access.for_user(current_user)
 
 
 def store_query():
-    return (
-        Restaurants.query.filter(Restaurants.id.in_(session["access"]))
-        .order_by(Restaurants.name)
-        .all()
-    )
+    return store_access.stores(session["access"])
 
 
 def stockcount_query():
@@ -66,73 +54,31 @@ def stockcount_query():
 
 
 def menu_item_query():
-    result = []
-    missing = []
-
-    # Initial query to get all items
-    initial_results = (
-        db.session.query(
-            RecipeIngredients.menu_item,
-            RecipeIngredients.recipe,
-            RecipeIngredients.ingredient,
-            InvItems.id,
+    """
+    Menu items whose recipes use one of the store's inventory items and
+    that are not set up for the store yet, from the cached recipe graph
+    """
+    store_id = session["store"]
+    items = dict(
+        db.session.query(InvItems.item_name, InvItems.id).filter(
+            InvItems.store_id == store_id
         )
-        .join(InvItems, RecipeIngredients.ingredient == InvItems.item_name)
-        .filter(InvItems.store_id == session["store"])
-        .distinct()
-        .order_by(RecipeIngredients.menu_item)
-        .all()
     )
-
-    # Separate items with menu_item as None and not None
-    missing = [item for item in initial_results if item.menu_item is None]
-    result = [item for item in initial_results if item.menu_item is not None]
-
-    for item in missing:
-        # Fetch the menu_item from RecipeIngredients and extract the value
-        menu_item_result = (
-            db.session.query(RecipeIngredients.menu_item)
-            .filter(RecipeIngredients.ingredient == item.recipe)
-            .all()
+    existing = {
+        menu_item
+        for (menu_item,) in db.session.query(MenuItems.menu_item).filter(
+            MenuItems.store_id == store_id
         )
-        # drop any duplicates or menu_item is None
-        menu_item_result = list(set(menu_item_result))
-        # drop any row with menu_item = None
-        menu_item_result = [
-            menu_item for menu_item in menu_item_result if menu_item[0] is not None
-        ]
-        # if menu_item_result is empty, skip it
-        if not menu_item_result:
-            continue
-
-        # Fetch the id from InvItems and extract the value
-        id_result = (
-            db.session.query(InvItems.id)
-            .filter(
-                InvItems.item_name == item.ingredient,
-                InvItems.store_id == session["store"],
-            )
-            .scalar()
-        )
-
-        # Add a new row to result for each menu_item_result using the same recipe, ingredient, and id
-        for menu_item in menu_item_result:
-            result.append(
-                MenuItem(menu_item[0], item.recipe, item.ingredient, id_result)
-            )
-        # remove the item from missing
-        missing.remove(item)
-
-    # Query inv_menu_items and remove any that are already in result
-    menu_items = (
-        db.session.query(MenuItems.menu_item)
-        .filter(MenuItems.store_id == session["store"])
-        .all()
-    )
-    menu_items = [menu_item[0] for menu_item in menu_items]
-    result = [item for item in result if item.menu_item not in menu_items]
-
-    return result
+    }
+    # every concept's recipes, like the picker always offered
+    graph = recipe_cache.graph(None)
+
+    result = [
+        MenuItem(menu_item, usage.recipe, ingredient, items[ingredient])
+        for menu_item, ingredient, usage in graph.uses(items)
+        if menu_item not in existing
+    ]
+    return sorted(result, key=lambda item: item.menu_item)
 
 
 def item_query():
@@ -0,0 +1,391 @@
+"""
+main/variance.py is the set-based variance engine for the daily reports
+
+Every source (items, counts, purchases, waste and sales) is read with one
+grouped query for the whole set of stores and date range, so the number of
+round trips stays the same no matter how many items or stores are asked
+for.  The begin/theory/variance math is done on pandas columns.
+
+Results are materialized in stockcount_variance_daily.  Writes to any
+source mark the (store, day) and the following day dirty, and the next
+read for the store recomputes just those days before it reads the table,
+in a transaction of its own whose failure only leaves the days queued for
+``flask variance refresh``.  A write to inv_items drops the store's stored
+days instead, which the reads then compute again as they reach them.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from sqlalchemy import delete, func, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from stockcount import changes, db
+from stockcount.archive import archived_until
+from stockcount.bulk import upsert
+from stockcount.models import (
+    InvCount,
+    InvItems,
+    StockcountMonthly,
+    StockcountPurchases,
+    StockcountVarianceDaily,
+    StockcountVarianceDirty,
+    StockcountWaste,
+)
+from stockcount.sales import resolved_sales
+
+logger = logging.getLogger(__name__)
+
+# columns of a variance row, in the order report.html expects them
+COLUMNS = [
+    "date",
+    "item_name",
+    "item_id",
+    "begin",
+    "purchases",
+    "sales",
+    "waste",
+    "theory",
+    "count",
+    "variance",
+]
+FRAME_COLUMNS = COLUMNS + ["r365_sales", "toast_sales"]
+STORE_COLUMNS = ["store_id"] + FRAME_COLUMNS
+ITEM_COLUMNS = ["store_id", "item_id", "item_name"]
+
+
+def _frame(rows, columns):
+    return pd.DataFrame([tuple(row) for row in rows], columns=columns)
+
+
+def items_query(store_ids, item_ids=None):
+    query = db.select(InvItems.store_id, InvItems.id, InvItems.item_name).where(
+        InvItems.store_id.in_(store_ids)
+    )
+    if item_ids is not None:
+        query = query.where(InvItems.id.in_(item_ids))
+    return query
+
+
+def load_items(store_ids, item_ids=None):
+    rows = db.session.execute(items_query(store_ids, item_ids)).all()
+    return _frame(rows, ITEM_COLUMNS)
+
+
+def load_counts(store_ids, start_date, end_date, item_ids):
+    rows = (
+        db.session.query(
+            StockcountMonthly.store_id,
+            StockcountMonthly.item_id,
+            StockcountMonthly.date,
+            StockcountMonthly.count_total,
+        )
+        .filter(
+            StockcountMonthly.store_id.in_(store_ids),
+            StockcountMonthly.item_id.in_(item_ids),
+            StockcountMonthly.date >= start_date,
+            StockcountMonthly.date <= end_date,
+        )
+        .all()
+    )
+    return _frame(rows, ["store_id", "item_id", "date", "count"])
+
+
+def load_purchases(store_ids, start_date, end_date, item_names):
+    rows = (
+        db.session.query(
+            StockcountPurchases.store_id,
+            StockcountPurchases.item,
+            StockcountPurchases.date,
+            func.sum(StockcountPurchases.unit_count),
+        )
+        .filter(
+            StockcountPurchases.store_id.in_(store_ids),
+            StockcountPurchases.item.in_(item_names),
+            StockcountPurchases.date >= start_date,
+            StockcountPurchases.date <= end_date,
+        )
+        .group_by(
+            StockcountPurchases.store_id,
+            StockcountPurchases.item,
+            StockcountPurchases.date,
+        )
+        .all()
+    )
+    return _frame(rows, ["store_id", "item_name", "date", "purchases"])
+
+
+def load_waste(store_ids, start_date, end_date, item_names):
+    rows = (
+        db.session.query(
+            StockcountWaste.store_id,
+            StockcountWaste.item,
+            StockcountWaste.date,
+            func.sum(StockcountWaste.quantity),
+        )
+        .filter(
+            StockcountWaste.store_id.in_(store_ids),
+            StockcountWaste.item.in_(item_names),
+            StockcountWaste.date >= start_date,
+            StockcountWaste.date <= end_date,
+        )
+        .group_by(StockcountWaste.store_id, StockcountWaste.item, StockcountWaste.date)
+        .all()
+    )
+    return _frame(rows, ["store_id", "item_name", "date", "waste"])
+
+
+def load_sales(store_ids, start_date, end_date, item_names):
+    """Resolved sales per store, item and day, see stockcount.sales"""
+    sales = resolved_sales(store_ids, start_date, end_date, names=item_names)
+    return sales.rename(columns={"ingredient": "item_name"})[
+        ["store_id", "item_name", "date", "r365_sales", "toast_sales", "sales"]
+    ]
+
+
+def stores_frame(store_ids, start_date, end_date, item_ids=None):
+    """
+    Return one variance row per store, item and day between start and end.
+
+    Besides COLUMNS the frame keeps the raw r365_sales and toast_sales so
+    callers can tell a day without sales data from a day that sold nothing.
+    """
+    items = load_items(store_ids, item_ids)
+    if items.empty:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+
+    store_ids = items["store_id"].unique().tolist()
+    ids = items["item_id"].tolist()
+    names = items["item_name"].unique().tolist()
+    begin_date = start_date - timedelta(days=1)
+
+    counts = load_counts(store_ids, begin_date, end_date, ids)
+    purchases = load_purchases(store_ids, start_date, end_date, names)
+    waste = load_waste(store_ids, start_date, end_date, names)
+    sales = load_sales(store_ids, start_date, end_date, names)
+
+    days = pd.DataFrame({"date": pd.date_range(start_date, end_date).date})
+    frame = items.merge(days, how="cross")
+
+    begin = counts.rename(columns={"count": "begin"})
+    begin["date"] = begin["date"] + timedelta(days=1)
+
+    by_id = ["store_id", "item_id", "date"]
+    by_name = ["store_id", "item_name", "date"]
+    frame = (
+        frame.merge(counts, on=by_id, how="left")
+        .merge(begin, on=by_id, how="left")
+        .merge(purchases, on=by_name, how="left")
+        .merge(sales, on=by_name, how="left")
+        .merge(waste, on=by_name, how="left")
+    )
+
+    frame["sales"] = frame["sales"].fillna(0).round()
+    for column in ("count", "begin", "purchases", "waste"):
+        frame[column] = frame[column].fillna(0)
+    frame[["count", "begin", "sales"]] = frame[["count", "begin", "sales"]].astype(
+        int
+    )
+
+    frame["theory"] = (
+        frame["begin"] + frame["purchases"] - frame["sales"] - frame["waste"]
+    )
+    frame["variance"] = frame["count"] - frame["theory"]
+    return frame[STORE_COLUMNS]
+
+
+def variance_frame(store_id, start_date, end_date, item_ids=None):
+    return stores_frame([store_id], start_date, end_date, item_ids)[FRAME_COLUMNS]
+
+
+def refresh_days(days):
+    """Recompute and store every item's variance for (store_id, date) pairs"""
+    days = set(days)
+    if not days:
+        return 0
+    store_ids = sorted({store_id for store_id, _ in days})
+    dates = [date for _, date in days]
+    frame = stores_frame(store_ids, min(dates), max(dates))
+    wanted = pd.MultiIndex.from_tuples(list(days))
+    frame = frame[pd.MultiIndex.from_frame(frame[["store_id", "date"]]).isin(wanted)]
+    frame = frame.astype(object).where(frame.notna(), None)
+    frame["updated_at"] = datetime.now(timezone.utc)
+    return upsert(
+        StockcountVarianceDaily.__table__,
+        frame.to_dict("records"),
+        ["store_id", "item_id", "date"],
+    )
+
+
+def refresh_variance(store_id, dates):
+    return refresh_days((store_id, date) for date in dates)
+
+
+def drain_dirty(store_ids):
+    """Recompute the days queued as dirty for the stores, return them"""
+    days = set(
+        db.session.execute(
+            delete(StockcountVarianceDirty)
+            .where(StockcountVarianceDirty.store_id.in_(store_ids))
+            .returning(StockcountVarianceDirty.store_id, StockcountVarianceDirty.date)
+        ).all()
+    )
+    if days:
+        refresh_days(days)
+        logger.info(f"Refreshed variance for {len(days)} dirty store days")
+    db.session.commit()
+    return days
+
+
+def refresh_for_read(function, *args):
+    """
+    Run a read path's refresh and commit it on its own, so a failed write
+    (a lock timeout, a read-only replica) is logged and the page is served
+    from what is stored.  The request's reads so far are committed first.
+    """
+    db.session.commit()
+    try:
+        function(*args)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        logger.exception(f"{function.__name__} failed, reading stored variance")
+
+
+def variance_query(*criteria):
+    """Materialized variance rows, STORE_COLUMNS, matching criteria"""
+    return db.select(
+        *(getattr(StockcountVarianceDaily, column) for column in STORE_COLUMNS)
+    ).where(*criteria)
+
+
+def variance_criteria(store_id, item_ids, start_date, end_date):
+    """Where clause of read_variance's read of stockcount_variance_daily"""
+    return (
+        StockcountVarianceDaily.store_id == store_id,
+        StockcountVarianceDaily.item_id.in_(item_ids),
+        StockcountVarianceDaily.date >= start_date,
+        StockcountVarianceDaily.date <= end_date,
+    )
+
+
+def _read(*criteria):
+    return _frame(db.session.execute(variance_query(*criteria)).all(), STORE_COLUMNS)
+
+
+def with_names(frame, items):
+    names = items.set_index(["store_id", "item_id"])["item_name"]
+    keys = pd.MultiIndex.from_frame(frame[["store_id", "item_id"]])
+    frame["item_name"] = names.reindex(keys).to_numpy()
+    return frame
+
+
+def read_variance(store_id, start_date, end_date, item_ids=None):
+    """
+    Variance frame for a store read from stockcount_variance_daily.
+
+    Dirty days are recomputed first, and any (item, day) that was never
+    materialized is computed and stored on the way through.
+    """
+    refresh_for_read(drain_dirty, [store_id])
+    items = load_items([store_id], item_ids)
+    if items.empty:
+        return pd.DataFrame(columns=FRAME_COLUMNS)
+
+    item_ids = items["item_id"].tolist()
+    criteria = variance_criteria(store_id, item_ids, start_date, end_date)
+    frame = _read(*criteria)
+    days = pd.date_range(start_date, end_date).date
+    expected = pd.MultiIndex.from_product([item_ids, days])
+    present = pd.MultiIndex.from_frame(frame[["item_id", "date"]])
+    missing = expected.difference(present)
+    if len(missing):
+        refresh_for_read(refresh_variance, store_id, missing.get_level_values(1))
+        frame = _read(*criteria)
+
+    return with_names(frame, items)[FRAME_COLUMNS]
+
+
+def last_counts(store_ids, on_or_before):
+    """Most recent counted day of each store, one grouped query"""
+    rows = (
+        db.session.query(InvCount.store_id, func.max(InvCount.trans_date))
+        .filter(
+            InvCount.store_id.in_(store_ids),
+            InvCount.trans_date <= on_or_before,
+        )
+        .group_by(InvCount.store_id)
+        .all()
+    )
+    return dict(rows)
+
+
+def portfolio_frame(store_ids, business_date):
+    """
+    Variance of every item in every store on the store's last count day.
+
+    Reads are grouped by store, so the query count does not grow with the
+    number of stores; days that were never materialized cost the engine's
+    handful of queries once, for all stores together.
+    """
+    refresh_for_read(drain_dirty, store_ids)
+    latest = last_counts(store_ids, business_date)
+    if not latest:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+
+    items = load_items(list(latest))
+    if items.empty:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+
+    criteria = (
+        tuple_(StockcountVarianceDaily.store_id, StockcountVarianceDaily.date).in_(
+            list(latest.items())
+        ),
+        StockcountVarianceDaily.item_id.in_(items["item_id"].tolist()),
+    )
+    frame = _read(*criteria)
+    expected = set(zip(items["store_id"], items["item_id"]))
+    present = set(zip(frame["store_id"], frame["item_id"]))
+    missing = {(store_id, latest[store_id]) for store_id, _ in expected - present}
+    if missing:
+        refresh_for_read(refresh_days, missing)
+        frame = _read(*criteria)
+
+    frame = with_names(frame, items)
+    return frame.sort_values("variance", kind="stable", ignore_index=True)
+
+
+@changes.before_commit
+def mark_dirty(session, touched):
+    """
+    Queue every touched day, and the day after it, for a recompute.  A
+    store touched as a whole (an inv_items write) loses its stored days
+    past the archive, whose sources are gone.
+    """
+    rows = [
+        {"store_id": store_id, "date": date + offset}
+        for store_id, date in touched
+        if date is not None
+        for offset in (timedelta(days=0), timedelta(days=1))
+    ]
+    upsert(
+        StockcountVarianceDirty.__table__, rows, ["store_id", "date"], session=session
+    )
+    for store_id in sorted({store_id for store_id, date in touched if date is None}):
+        stored = StockcountVarianceDaily.store_id == store_id
+        until = archived_until(store_id, session)
+        if until is not None:
+            stored = stored & (StockcountVarianceDaily.date >= until)
+        session.execute(delete(StockcountVarianceDaily).where(stored))
+
+
+def variance_records(frame):
+    """A variance frame's rows, worst variance first"""
+    frame = frame[COLUMNS].sort_values("variance", kind="stable")
+    return frame.to_dict("records")
+
+
+def variance_rows(store_id, report_date):
+    """Rows for report.html, sorted from the worst variance up"""
+    return variance_records(read_variance(store_id, report_date, report_date))
@@ -0,0 +1,367 @@
+"""
+migrations.py is a small ordered migration runner for the tables,
+indexes and triggers this app owns in the shared database
+
+Each migration runs in its own transaction and is recorded in
+schema_migrations, so ``flask schema upgrade`` is safe to run on every
+deploy.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select, text
+
+from stockcount import partitions
+from stockcount.models import (
+    InvCount,
+    StockcountArchive,
+    StockcountDataVersion,
+    StockcountIngestWatermark,
+    StockcountMonthly,
+    StockcountPurchases,
+    StockcountSales,
+    StockcountSalesRollup,
+    StockcountSalesCompact,
+    StockcountSalesRollupDirty,
+    StockcountSalesToast,
+    StockcountStoreAccess,
+    StockcountVarianceDaily,
+    StockcountVarianceDirty,
+    StockcountWaste,
+)
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", String(64), primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", DateTime),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+
+    return register
+
+
+def applied(engine):
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        return {
+            row.version: row.applied_at
+            for row in connection.execute(select(schema_migrations))
+        }
+
+
+def pending(engine):
+    done = applied(engine)
+    return [m for m in sorted(MIGRATIONS) if m[0] not in done]
+
+
+def upgrade(engine):
+    """Apply every pending migration in version order"""
+    ran = []
+    for version, description, fn in pending(engine):
+        logger.info(f"Applying migration {version}: {description}")
+        with engine.begin() as connection:
+            fn(connection)
+            connection.execute(
+                schema_migrations.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc),
+                )
+            )
+        ran.append(version)
+    return ran
+
+
+@migration("0001", "daily variance table and dirty queue")
+def create_variance_tables(connection):
+    StockcountVarianceDaily.__table__.create(connection, checkfirst=True)
+    StockcountVarianceDirty.__table__.create(connection, checkfirst=True)
+
+
+# table -> date column, for the tables that feed the daily variance
+VARIANCE_SOURCES = {
+    "inv_count": "trans_date",
+    "stockcount_purchases": "date",
+    "stockcount_sales": "date",
+    "stockcount_sales_toast": "date",
+    "stockcount_waste": "date",
+}
+
+MARK_DIRTY_FUNCTION = """
+CREATE OR REPLACE FUNCTION stockcount_mark_variance_dirty() RETURNS trigger AS $$
+DECLARE
+    mark text := 'INSERT INTO stockcount_variance_dirty (store_id, date)
+        SELECT DISTINCT r.store_id, d.date FROM %1$s r,
+        LATERAL (VALUES (r.%2$I), (r.%2$I + 1)) AS d(date)
+        WHERE r.store_id IS NOT NULL AND d.date IS NOT NULL
+        ON CONFLICT DO NOTHING';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format(mark, 'new_rows', TG_ARGV[0]);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format(mark, 'old_rows', TG_ARGV[0]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def create_statement_triggers(connection, table, date_column):
+    for op, referencing in (
+        ("INSERT", "NEW TABLE AS new_rows"),
+        ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ("DELETE", "OLD TABLE AS old_rows"),
+    ):
+        name = f"{table}_variance_dirty_{op.lower()}"
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {name} AFTER {op} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT "
+                f"EXECUTE FUNCTION stockcount_mark_variance_dirty('{date_column}')"
+            )
+        )
+
+
+@migration("0002", "mark daily variance dirty on upstream writes")
+def create_variance_triggers(connection):
+    """
+    Loads that run outside the app (R365, Toast) only reach the dirty
+    queue through these statement-level triggers.  Postgres only; on other
+    databases the session listener in stockcount.changes covers app writes.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(MARK_DIRTY_FUNCTION))
+    for table, date_column in VARIANCE_SOURCES.items():
+        create_statement_triggers(connection, table, date_column)
+
+
+MARK_DIRTY_AND_BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION stockcount_mark_variance_dirty() RETURNS trigger AS $$
+DECLARE
+    mark text := 'INSERT INTO stockcount_variance_dirty (store_id, date)
+        SELECT DISTINCT r.store_id, d.date FROM %1$s r,
+        LATERAL (VALUES (r.%2$I), (r.%2$I + 1)) AS d(date)
+        WHERE r.store_id IS NOT NULL AND d.date IS NOT NULL
+        ON CONFLICT DO NOTHING';
+    bump text := 'INSERT INTO stockcount_data_version AS v (store_id, version)
+        SELECT DISTINCT r.store_id, 1 FROM %1$s r WHERE r.store_id IS NOT NULL
+        ON CONFLICT (store_id) DO UPDATE SET version = v.version + 1';
+    source text;
+BEGIN
+    FOREACH source IN ARRAY CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY['new_rows']
+        WHEN 'DELETE' THEN ARRAY['old_rows']
+        ELSE ARRAY['new_rows', 'old_rows'] END
+    LOOP
+        IF TG_ARGV[0] <> '' THEN
+            EXECUTE format(mark, source, TG_ARGV[0]);
+        END IF;
+        EXECUTE format(bump, source);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+@migration("0003", "per-store data version for the report cache")
+def create_data_version(connection):
+    """
+    Every write to a variance source, or to inv_items, bumps the store's
+    version so cached reports keyed on the old version stop matching.
+    """
+    StockcountDataVersion.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(MARK_DIRTY_AND_BUMP_FUNCTION))
+    create_statement_triggers(connection, "inv_items", "")
+
+
+@migration("0004", "one inv_count row per store, item, day and count time")
+def unique_inv_count(connection):
+    """
+    Keeps the newest of any duplicate counts, then adds the unique index
+    the bulk count submission upserts on.
+    """
+    connection.execute(
+        text(
+            "DELETE FROM inv_count WHERE id NOT IN ("
+            "SELECT max(id) FROM inv_count "
+            "GROUP BY store_id, item_id, trans_date, count_time)"
+        )
+    )
+    connection.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_inv_count_store_item_day "
+            "ON inv_count (store_id, item_id, trans_date, count_time)"
+        )
+    )
+
+
+# the stores the office logins 98 and 99 used to be hardcoded to
+OFFICE_STORES = [3, 4, 5, 6, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
+
+
+@migration("0005", "store access groups")
+def create_store_access(connection):
+    """Moves the office logins' store list out of the code"""
+    table = StockcountStoreAccess.__table__
+    table.create(connection, checkfirst=True)
+    # a rerun after a partial upgrade only adds the missing grants
+    existing = set(
+        connection.execute(select(table.c.grant_store_id, table.c.store_id)).all()
+    )
+    rows = [
+        {"grant_store_id": grant, "store_id": store_id}
+        for grant in (98, 99)
+        for store_id in OFFICE_STORES
+        if (grant, store_id) not in existing
+    ]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+MARK_ROLLUP_DIRTY_FUNCTION = """
+CREATE OR REPLACE FUNCTION stockcount_mark_rollup_dirty() RETURNS trigger AS $$
+DECLARE
+    mark text := 'INSERT INTO stockcount_sales_rollup_dirty (store_id, date)
+        SELECT DISTINCT store_id, date FROM %1$s
+        WHERE store_id IS NOT NULL AND date IS NOT NULL
+        ON CONFLICT DO NOTHING';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format(mark, 'new_rows');
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format(mark, 'old_rows');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+@migration("0006", "sales rollup table and its dirty queue")
+def create_sales_rollup(connection):
+    """
+    R365 sales loads queue the days they write so the rollup refresh only
+    recomputes from the earliest changed day.  The trigger is Postgres
+    only; elsewhere the refresh falls back to its date watermark.
+    """
+    StockcountSalesRollup.__table__.create(connection, checkfirst=True)
+    StockcountSalesRollupDirty.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(MARK_ROLLUP_DIRTY_FUNCTION))
+    create_rollup_dirty_triggers(connection, "stockcount_sales")
+
+
+def create_rollup_dirty_triggers(connection, table):
+    for op, referencing in (
+        ("INSERT", "NEW TABLE AS new_rows"),
+        ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ("DELETE", "OLD TABLE AS old_rows"),
+    ):
+        name = f"stockcount_sales_rollup_dirty_{op.lower()}"
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {name} AFTER {op} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT "
+                f"EXECUTE FUNCTION stockcount_mark_rollup_dirty()"
+            )
+        )
+
+
+@migration("0007", "importer watermarks")
+def create_ingest_watermark(connection):
+    StockcountIngestWatermark.__table__.create(connection, checkfirst=True)
+
+
+@migration("0008", "queue rollup days on Toast sales writes")
+def toast_rollup_dirty(connection):
+    """The rollup falls back to Toast, so Toast writes queue days too"""
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(MARK_ROLLUP_DIRTY_FUNCTION))
+    create_rollup_dirty_triggers(connection, "stockcount_sales_toast")
+
+
+# the tables behind the variance, details, counts and sales pages
+HOT_TABLES = [
+    InvCount,
+    StockcountSales,
+    StockcountSalesToast,
+    StockcountPurchases,
+    StockcountWaste,
+    StockcountMonthly,
+]
+
+
+@migration("0009", "composite indexes on the hot filters")
+def create_hot_indexes(connection):
+    """
+    Creates the Index declarations of the hot tables' models, so
+    create_all and this migration build the same indexes.  On Postgres
+    they carry the summed columns in INCLUDE for index-only scans.  The
+    build blocks writes to each table while it runs, so deploy this
+    outside the R365 and Toast load windows.
+    """
+    for model in HOT_TABLES:
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+        if connection.dialect.name == "postgresql":
+            connection.execute(text(f"ANALYZE {model.__tablename__}"))
+
+
+@migration("0010", "monthly partitions for the sales and waste tables")
+def partition_sales_tables(connection):
+    """
+    Rebuilds stockcount_sales, stockcount_sales_toast and stockcount_waste
+    range partitioned by month, with a default partition and the months
+    ahead, then puts their triggers back.  Every row is copied while the
+    tables are locked, so run it in a quiet window.  Postgres only.
+    """
+    StockcountSalesCompact.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name != "postgresql":
+        return
+    for model in partitions.PARTITIONED:
+        table = model.__tablename__
+        partitions.partition_table(connection, model)
+        partitions.ensure_partitions(connection, table, partitions.MONTHS_AHEAD)
+        create_statement_triggers(connection, table, "date")
+        if model in partitions.COMPACTED.values():
+            create_rollup_dirty_triggers(connection, table)
+
+
+@migration("0011", "manifest of the columnar history archive")
+def create_archive_manifest(connection):
+    StockcountArchive.__table__.create(connection, checkfirst=True)
+
+
+@migration("0012", "mark daily variance dirty on stockcount_monthly writes")
+def create_monthly_variance_triggers(connection):
+    """
+    stockcount_monthly feeds the variance like the tables of 0002 but was
+    left without triggers.  Postgres only.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    create_statement_triggers(connection, "stockcount_monthly", "date")
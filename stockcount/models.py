@@ -11,7 +11,9 @@ from flask_security.core import (
 )
 from flask_security.datastore import SQLAlchemySessionUserDatastore
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import PrimaryKeyConstraint
+from sqlalchemy import Index, PrimaryKeyConstraint
+
+from stockcount.changes import track
 
 mail = Mail()
 db = SQLAlchemy()
@@ -194,6 +196,19 @@ class InvCount(db.Model):
     item_id = db.Column(db.Integer, db.ForeignKey("inv_items.id"), nullable=False)
     store_id = db.Column(db.Integer, db.ForeignKey("restaurants.id"), nullable=False)
 
+    __table_args__ = (
+        Index(
+            "uq_inv_count_store_item_day",
+            "store_id",
+            "item_id",
+            "trans_date",
+            "count_time",
+            unique=True,
+        ),
+        Index("ix_inv_count_store_date_time", "store_id", "trans_date", "count_time"),
+        Index("ix_inv_count_item_date", "item_id", "trans_date"),
+    )
+
     def __repr__(self):
         return f"InvCount('{self.trans_date}', '{self.count_time}', '{self.item_name}', '{self.case_count}', '{self.each_count}', '{self.count_total}', '{self.previous_total}', '{self.theory}', '{self.daily_variance}', '{self.item_id}', '{self.store_id}')"
 
@@ -249,6 +264,16 @@ class StockcountPurchases(db.Model):
     uofm = db.Column(db.String)
     unit_count = db.Column(db.Float)
 
+    __table_args__ = (
+        Index(
+            "ix_purchases_store_item_date",
+            "store_id",
+            "item",
+            "date",
+            postgresql_include=["unit_count"],
+        ),
+    )
+
 
 class StockcountSales(db.Model):
     __tablename__ = "stockcount_sales"
@@ -269,6 +294,14 @@ class StockcountSales(db.Model):
 
     __table_args__ = (
         PrimaryKeyConstraint("date", "store", "menuitem", name="unique_sales"),
+        Index(
+            "ix_sales_store_ingredient_date",
+            "store_id",
+            "ingredient",
+            "date",
+            postgresql_include=["count_usage", "menuitem", "sales_count"],
+        ),
+        {"postgresql_partition_by": "RANGE (date)"},
     )
 
 
@@ -289,6 +322,14 @@ class StockcountWaste(db.Model):
 
     __table_args__ = (
         PrimaryKeyConstraint("date", "store", "item", name="unique_waste"),
+        Index(
+            "ix_waste_store_item_date",
+            "store_id",
+            "item",
+            "date",
+            postgresql_include=["quantity"],
+        ),
+        {"postgresql_partition_by": "RANGE (date)"},
     )
 
 
@@ -303,6 +344,13 @@ class StockcountMonthly(db.Model):
 
     __table_args__ = (
         PrimaryKeyConstraint("date", "store_id", "item_id", name="unique_monthly"),
+        Index(
+            "ix_monthly_store_item_date",
+            "store_id",
+            "item_id",
+            "date",
+            postgresql_include=["count_total"],
+        ),
     )
 
 
@@ -324,6 +372,17 @@ class StockcountSalesToast(db.Model):
     base_uofm = db.Column(db.String)
     count_usage = db.Column(db.Float)
 
+    __table_args__ = (
+        Index(
+            "ix_sales_toast_store_ingredient_date",
+            "store_id",
+            "ingredient",
+            "date",
+            postgresql_include=["count_usage", "menuitem", "sales_count"],
+        ),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
 
 class RecipeIngredients(db.Model):
     __tablename__ = "recipe_ingredients"
@@ -346,3 +405,118 @@ class MenuItems(db.Model):
     purchases_name = db.Column(db.String)
     purchases_id = db.Column(db.Integer)
     store_id = db.Column(db.Integer)
+
+
+class StockcountVarianceDaily(db.Model):
+    __tablename__ = "stockcount_variance_daily"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    item_name = db.Column(db.String)
+    begin = db.Column(db.Integer)
+    purchases = db.Column(db.Float)
+    sales = db.Column(db.Integer)
+    waste = db.Column(db.Float)
+    theory = db.Column(db.Float)
+    count = db.Column(db.Integer)
+    variance = db.Column(db.Float)
+    r365_sales = db.Column(db.Float)
+    toast_sales = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+
+    __table_args__ = (Index("ix_variance_daily_store_date", "store_id", "date"),)
+
+
+class StockcountVarianceDirty(db.Model):
+    __tablename__ = "stockcount_variance_dirty"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+
+
+class StockcountDataVersion(db.Model):
+    __tablename__ = "stockcount_data_version"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class StockcountSalesRollup(db.Model):
+    __tablename__ = "stockcount_sales_rollup"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    menuitem = db.Column(db.String, primary_key=True)
+    sales_count = db.Column(db.Float)
+    wtd = db.Column(db.Float)
+    ptd = db.Column(db.Float)
+    ytd = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+
+
+class StockcountSalesRollupDirty(db.Model):
+    __tablename__ = "stockcount_sales_rollup_dirty"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+
+
+class StockcountSalesCompact(db.Model):
+    """Daily ingredient usage of months compacted out of the sales tables"""
+
+    __tablename__ = "stockcount_sales_compact"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    ingredient = db.Column(db.String, primary_key=True)
+    source = db.Column(db.String, primary_key=True)
+    count_usage = db.Column(db.Float)
+
+
+class StockcountArchive(db.Model):
+    """A Parquet file holding one store's month of rows moved out of table_name"""
+
+    __tablename__ = "stockcount_archive"
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    store_id = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+
+    __table_args__ = (
+        Index("ix_archive_table_store_month", "table_name", "store_id", "month"),
+    )
+
+
+class StockcountIngestWatermark(db.Model):
+    """Newest business date an importer has loaded for a store"""
+
+    __tablename__ = "stockcount_ingest_watermark"
+
+    source = db.Column(db.String(32), primary_key=True)
+    store_id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+
+
+class StockcountStoreAccess(db.Model):
+    """A user assigned grant_store_id can see every store_id listed for it"""
+
+    __tablename__ = "stockcount_store_access"
+
+    grant_store_id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, primary_key=True)
+
+
+# Commits touching these tables mark the store's variance as stale for the day
+track(InvItems, date_attr=None)
+track(InvCount, date_attr="trans_date")
+track(StockcountMonthly)
+track(StockcountPurchases)
+track(StockcountSales)
+track(StockcountSalesToast)
+track(StockcountWaste)
@@ -0,0 +1,339 @@
+"""
+partitions.py keeps the sales fact tables in monthly partitions and
+applies their retention policy
+
+On Postgres stockcount_sales, stockcount_sales_toast and stockcount_waste
+are range partitioned on date (migration 0010):
+
+    <table>_YYYY_MM   one partition per calendar month
+    <table>_default   rows of a month that has no partition yet
+
+Pages read a recent window on date, so the planner only opens the last
+month or two.  ensure_partitions() adds the months from the oldest row
+parked in the default partition through SALES_PARTITION_MONTHS_AHEAD
+months ahead, moving the parked rows in.  ``flask sales partitions``
+runs it from the daily cron; when it is late nothing fails, rows wait
+in the default partition.
+
+Retention, ``flask sales compact``: R365 and Toast months older than
+SALES_COMPACT_AFTER_MONTHS are compacted into stockcount_sales_compact,
+one row per store, day, ingredient and source, and their partitions are
+dropped.  stockcount.sales reads the compacted rows for ranges that reach
+that far back, so old variance is unchanged.  Menu item history lives on
+in stockcount_sales_rollup.  Waste is already daily per item, its months
+are dropped after WASTE_RETENTION_MONTHS.  Both are off when unset.  Off
+Postgres the tables are not partitioned and the policy deletes rows.
+"""
+
+import logging
+import re
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import func, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from stockcount.models import (
+    StockcountSales,
+    StockcountSalesCompact,
+    StockcountSalesRollupDirty,
+    StockcountSalesToast,
+    StockcountWaste,
+)
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED = [StockcountSales, StockcountSalesToast, StockcountWaste]
+# source -> table compacted into stockcount_sales_compact, as in sales.MODELS
+COMPACTED = {"r365": StockcountSales, "toast": StockcountSalesToast}
+# a fiscal year spans up to 13 calendar months, the rollup's YTD needs them
+MIN_COMPACT_MONTHS = 14
+MONTHS_AHEAD = 3
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+
+def compacted_before(config=None, today=None):
+    """
+    First day that is never compacted under SALES_COMPACT_AFTER_MONTHS,
+    or None when compaction is off.  Earlier sales may only exist in
+    stockcount_sales_compact.
+    """
+    config = config if config is not None else current_app.config
+    months = config.get("SALES_COMPACT_AFTER_MONTHS")
+    if not months:
+        return None
+    if months < MIN_COMPACT_MONTHS:
+        raise ValueError(
+            f"SALES_COMPACT_AFTER_MONTHS must be at least {MIN_COMPACT_MONTHS}"
+        )
+    return add_months(month_start(today or date.today()), -months)
+
+
+def is_partitioned(connection, table):
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"
+        ),
+        {"table": table},
+    ).scalar()
+
+
+def partitions(connection, table):
+    """{month: partition name} of table's monthly partitions"""
+    rows = connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"
+        ),
+        {"table": table},
+    )
+    monthly = re.compile(rf"{re.escape(table)}_(\d{{4}})_(\d{{2}})")
+    months = {}
+    for (name,) in rows:
+        match = monthly.fullmatch(name)
+        if match:
+            months[date(int(match[1]), int(match[2]), 1)] = name
+    return months
+
+
+def create_default(connection, table):
+    connection.execute(
+        text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+    )
+
+
+def create_partition(connection, table, month):
+    """Add month's partition, taking over its rows from the default one"""
+    name = partition_name(table, month)
+    bounds = {"start": month, "end": add_months(month, 1)}
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    # a DELETE on the partition fires none of the parent's triggers
+    connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {table}_default "
+            "WHERE date >= :start AND date < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    connection.execute(
+        text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+        )
+    )
+    logger.info(f"Created partition {name}")
+    return name
+
+
+def ensure_partitions(connection, table, ahead, today=None):
+    """Create table's missing monthly partitions, return their names"""
+    if not is_partitioned(connection, table):
+        return []
+    create_default(connection, table)
+    current = month_start(today or date.today())
+    oldest = connection.execute(text(f"SELECT min(date) FROM {table}_default")).scalar()
+    month = min(month_start(oldest), current) if oldest else current
+    existing = partitions(connection, table)
+    created = []
+    while month <= add_months(current, ahead):
+        if month not in existing:
+            created.append(create_partition(connection, table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def partition_table(connection, model):
+    """
+    Rebuild model's plain table as a partitioned one of the same name and
+    columns, with a partition for each month it holds, and copy the rows
+    over.  Other constraints and triggers of the old table go with it.
+    Returns the months created.
+    """
+    table = model.__tablename__
+    if is_partitioned(connection, table):
+        return []
+    found = connection.execute(text("SELECT to_regclass(:table)"), {"table": table})
+    if found.scalar() is None:
+        model.__table__.create(connection)
+        create_default(connection, table)
+        return []
+
+    old = f"{table}_unpartitioned"
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    key = connection.execute(
+        text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"
+        ),
+        {"table": old},
+    ).first()
+    # free the key and index names for the new table
+    if key is not None:
+        connection.execute(
+            text(f"ALTER TABLE {old} RENAME CONSTRAINT {key[0]} TO {key[0]}_old")
+        )
+    for index in model.__table__.indexes:
+        connection.execute(
+            text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_old")
+        )
+
+    connection.execute(
+        text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (date)"
+        )
+    )
+    if key is not None:
+        name, definition = key
+    else:
+        columns = ", ".join(column.name for column in model.__table__.primary_key)
+        name, definition = f"{table}_pkey", f"PRIMARY KEY ({columns})"
+    connection.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"))
+    for index in model.__table__.indexes:
+        index.create(connection)
+    create_default(connection, table)
+
+    months = (
+        connection.execute(
+            text(
+                f"SELECT DISTINCT CAST(date_trunc('month', date) AS date) "
+                f"FROM {old} WHERE date IS NOT NULL ORDER BY 1"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    for month in months:
+        create_partition(connection, table, month)
+    connection.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+    connection.execute(text(f"DROP TABLE {old}"))
+    logger.info(f"Partitioned {table} into {len(months)} months")
+    return months
+
+
+def drop_month(connection, model, month):
+    """Remove model's rows of month, dropping its partition when it has one"""
+    table = model.__tablename__
+    if is_partitioned(connection, table):
+        name = partitions(connection, table).get(month)
+        if name:
+            connection.execute(text(f"DROP TABLE {name}"))
+    # rows parked in the default partition, or the whole month off Postgres
+    column = model.__table__.c.date
+    connection.execute(
+        model.__table__.delete().where(
+            column >= month, column < add_months(month, 1)
+        )
+    )
+
+
+def months_before(connection, model, before):
+    """First days of the months of model that end before before"""
+    column = model.__table__.c.date
+    oldest = connection.execute(
+        select(func.min(column)).where(column < before)
+    ).scalar()
+    months = []
+    month = month_start(oldest) if oldest else before
+    while month < before:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def compact_month(connection, month):
+    """Fold a month of R365 and Toast sales into stockcount_sales_compact"""
+    compact = StockcountSalesCompact.__table__
+    end = add_months(month, 1)
+    rows = 0
+    for source, model in COMPACTED.items():
+        table = model.__table__
+        daily = (
+            select(
+                table.c.store_id,
+                table.c.date,
+                table.c.ingredient,
+                literal(source),
+                func.sum(table.c.count_usage),
+            )
+            .where(
+                table.c.date >= month,
+                table.c.date < end,
+                table.c.store_id.isnot(None),
+                table.c.ingredient.isnot(None),
+            )
+            .group_by(table.c.store_id, table.c.date, table.c.ingredient)
+        )
+        dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(compact).from_select(
+            ["store_id", "date", "ingredient", "source", "count_usage"], daily
+        )
+        # rows loaded late into a compacted month add to its totals
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["store_id", "date", "ingredient", "source"],
+            set_={"count_usage": compact.c.count_usage + stmt.excluded.count_usage},
+        )
+        result = connection.execute(stmt)
+        rows += result.rowcount
+        drop_month(connection, model, month)
+    # the rollup already holds these days; rebuilding them now would lose
+    # the menu items the compacted rows no longer have
+    dirty = StockcountSalesRollupDirty.__table__
+    connection.execute(
+        dirty.delete().where(dirty.c.date >= month, dirty.c.date < end)
+    )
+    logger.info(f"Compacted sales of {month:%Y-%m} into {rows} daily rows")
+    return rows
+
+
+def apply_retention(engine, config, today=None, dry_run=False):
+    """
+    Compact and drop the months the policy no longer keeps, one
+    transaction per month.  Returns {table: [months]}.
+    """
+    today = today or date.today()
+    done = {}
+    months = config.get("SALES_COMPACT_AFTER_MONTHS")
+    if months:
+        before = compacted_before(config, today)
+        with engine.connect() as connection:
+            due = sorted(
+                {
+                    month
+                    for model in COMPACTED.values()
+                    for month in months_before(connection, model, before)
+                }
+            )
+        for month in due:
+            if not dry_run:
+                with engine.begin() as connection:
+                    compact_month(connection, month)
+        done["stockcount_sales"] = due
+    months = config.get("WASTE_RETENTION_MONTHS")
+    if months:
+        before = add_months(month_start(today), -months)
+        with engine.connect() as connection:
+            due = months_before(connection, StockcountWaste, before)
+        for month in due:
+            if not dry_run:
+                with engine.begin() as connection:
+                    drop_month(connection, StockcountWaste, month)
+        done["stockcount_waste"] = due
+    return done
@@ -0,0 +1,197 @@
+"""
+perf.py measures the SQL each request sends, when PERF_ENABLED is set
+
+Engine events count every statement run while a Flask request is active,
+with its time and its shape: the SQL with IN lists collapsed, so the
+same query with other ids is the same shape.  At the end of every
+request, one whose view raised included (status 500), one structured log
+line (logger stockcount.perf, JSON) records:
+
+    endpoint, method, status, ms, db_ms, statements,
+    slowest   the PERF_SLOWEST slowest statements
+    repeated  shapes run PERF_REPEAT_THRESHOLD or more times, the
+              per-item query loops (N+1) worth turning into one query
+
+Per endpoint totals are kept in the process for the admin /debug/perf
+page.  With PERF_ENABLED off nothing is hooked up and nothing is paid.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# a bound parameter in any paramstyle: %(name)s, ? or :name
+PARAM = r"(?:%\([^)]+\)s|\?|:\w+)"
+# a parenthesised list of them, e.g. an expanded IN list
+PARAM_LIST = re.compile(rf"\(\s*{PARAM}(?:\s*,\s*{PARAM})*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+_current = ContextVar("perf_request", default=None)
+
+
+def shape(statement):
+    """The statement with whitespace folded and IN lists collapsed"""
+    statement = WHITESPACE.sub(" ", statement).strip()
+    return PARAM_LIST.sub("(?)", statement)
+
+
+class RequestPerf:
+    """The statements of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = None
+        self.statements = 0
+        self.db_ms = 0.0
+        self.shapes = {}
+        self.timings = []
+
+    def record(self, statement, ms):
+        self.statements += 1
+        self.db_ms += ms
+        key = shape(statement)
+        count, total = self.shapes.get(key, (0, 0.0))
+        self.shapes[key] = (count + 1, total + ms)
+        self.timings.append((ms, key))
+
+    def summary(self, slowest, threshold):
+        return {
+            "ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "db_ms": round(self.db_ms, 1),
+            "statements": self.statements,
+            "slowest": [
+                {"ms": round(ms, 1), "sql": sql}
+                for ms, sql in sorted(self.timings, reverse=True)[:slowest]
+            ],
+            "repeated": [
+                {"count": count, "ms": round(total, 1), "sql": sql}
+                for sql, (count, total) in sorted(
+                    self.shapes.items(), key=lambda item: -item[1][0]
+                )
+                if count >= threshold
+            ],
+        }
+
+
+class EndpointStats:
+    """Running totals of one endpoint"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.statements = 0
+        self.max_statements = 0
+        self.repeated = 0
+        self.worst = None
+
+    def add(self, summary):
+        self.requests += 1
+        self.total_ms += summary["ms"]
+        self.db_ms += summary["db_ms"]
+        self.statements += summary["statements"]
+        self.max_statements = max(self.max_statements, summary["statements"])
+        self.repeated += bool(summary["repeated"])
+        if self.worst is None or summary["db_ms"] > self.worst["db_ms"]:
+            self.worst = summary
+
+    def row(self):
+        return {
+            "endpoint": self.endpoint,
+            "requests": self.requests,
+            "mean_ms": self.total_ms / self.requests,
+            "mean_db_ms": self.db_ms / self.requests,
+            "mean_statements": self.statements / self.requests,
+            "max_statements": self.max_statements,
+            "n_plus_one": self.repeated,
+            "worst": self.worst,
+        }
+
+
+class PerfMonitor:
+    def __init__(self):
+        self.enabled = False
+        self.slowest = 5
+        self.threshold = 5
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._hooked = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get("PERF_ENABLED", False)
+        if not self.enabled:
+            return
+        self.slowest = app.config.get("PERF_SLOWEST", self.slowest)
+        self.threshold = app.config.get("PERF_REPEAT_THRESHOLD", self.threshold)
+        app.before_request(self._start)
+        app.after_request(self._status)
+        # teardown runs for views that raise too, after_request does not
+        app.teardown_request(self._finish)
+        if not self._hooked:
+            event.listen(Engine, "before_cursor_execute", _before_execute)
+            event.listen(Engine, "after_cursor_execute", _after_execute)
+            self._hooked = True
+
+    def _start(self):
+        _current.set(RequestPerf())
+
+    def _status(self, response):
+        perf = _current.get()
+        if perf is not None:
+            perf.status = response.status_code
+        return response
+
+    def _finish(self, exception=None):
+        perf = _current.get()
+        _current.set(None)
+        if perf is None or request.endpoint in (None, "static"):
+            return
+        summary = {
+            "event": "request_perf",
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "status": 500 if exception is not None else perf.status,
+            **perf.summary(self.slowest, self.threshold),
+        }
+        with self._lock:
+            stats = self._endpoints.setdefault(
+                request.endpoint, EndpointStats(request.endpoint)
+            )
+            stats.add(summary)
+        log = logger.warning if summary["repeated"] or exception else logger.info
+        log(json.dumps(summary))
+
+    def worst(self, limit=20):
+        """Endpoints by mean DB time, worst first"""
+        with self._lock:
+            rows = [stats.row() for stats in self._endpoints.values()]
+        return sorted(rows, key=lambda row: -row["mean_db_ms"])[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("perf_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    perf = _current.get()
+    started = conn.info.get("perf_started")
+    if perf is not None and started:
+        perf.record(statement, (time.perf_counter() - started.pop()) * 1000)
+
+
+perf_monitor = PerfMonitor()
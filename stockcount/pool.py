@@ -0,0 +1,176 @@
+"""
+pool.py wires the pool settings into the engines and measures the pools
+
+Flask-SQLAlchemy 3 only reads SQLALCHEMY_ENGINE_OPTIONS, so the
+SQLALCHEMY_POOL_* keys are folded into it here, for the Flask engine and
+the asyncpg one alike.  Explicit SQLALCHEMY_ENGINE_OPTIONS still win.
+SQLALCHEMY_POOL_LIVENESS picks how dead connections are avoided:
+
+    pre_ping  every checkout pings first, one round trip each, and so
+              survives database restarts and idle-connection reapers
+              (default)
+    recycle   no ping; only connections older than
+              SQLALCHEMY_POOL_RECYCLE seconds are replaced at checkout.
+              Opt in where nothing drops connections under the app.
+
+Connections are recycled after SQLALCHEMY_POOL_RECYCLE seconds either way.
+
+Both pools record, per worker process, how long each checkout took
+(waiting for a free connection, or opening a new one), how many
+connections are checked out and in overflow, and checkout timeouts.
+pool_stats() returns the numbers, served at /api/v1/debug/pool, and
+``flask pool show`` prints the effective settings.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+LIVENESS = ("recycle", "pre_ping")
+WAIT_WINDOW = 1000
+# checkouts slower than this count as having waited
+WAITED_MS = 1.0
+
+
+class PoolStats:
+    """Checkout counters and the most recent checkout times of one pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.waited = 0
+            self.timeouts = 0
+            self.peak_checked_out = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+            self.recent = deque(maxlen=WAIT_WINDOW)
+
+    def checkout(self, ms, checked_out):
+        with self._lock:
+            self.checkouts += 1
+            self.waited += ms >= WAITED_MS
+            self.total_wait_ms += ms
+            self.max_wait_ms = max(self.max_wait_ms, ms)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            self.recent.append(ms)
+
+    def timeout(self, ms):
+        with self._lock:
+            self.timeouts += 1
+            self.recent.append(ms)
+
+    def snapshot(self, pool):
+        with self._lock:
+            recent = sorted(self.recent)
+            return {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "idle": pool.checkedin(),
+                "peak_checked_out": self.peak_checked_out,
+                "checkouts": self.checkouts,
+                "waited": self.waited,
+                "timeouts": self.timeouts,
+                "mean_wait_ms": (
+                    self.total_wait_ms / self.checkouts if self.checkouts else 0.0
+                ),
+                "p50_wait_ms": statistics.median(recent) if recent else 0.0,
+                "p95_wait_ms": recent[int(len(recent) * 0.95)] if recent else 0.0,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+
+class TimedPool:
+    """Mixin timing every checkout of a QueuePool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            ms = (time.perf_counter() - start) * 1000
+            self.stats.timeout(ms)
+            logger.warning(
+                f"Connection checkout timed out after {ms:.0f}ms, "
+                f"{self.checkedout()} checked out of {self.size()}+overflow"
+            )
+            raise
+        self.stats.checkout((time.perf_counter() - start) * 1000, self.checkedout())
+        return connection
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(config, poolclass=TimedQueuePool):
+    """Engine keyword arguments for the SQLALCHEMY_POOL_* settings"""
+    liveness = config.get("SQLALCHEMY_POOL_LIVENESS") or "pre_ping"
+    if liveness not in LIVENESS:
+        raise ValueError(
+            f"SQLALCHEMY_POOL_LIVENESS must be one of {', '.join(LIVENESS)}"
+        )
+    return {
+        "poolclass": poolclass,
+        "pool_size": config.get("SQLALCHEMY_POOL_SIZE", 10),
+        "max_overflow": config.get("SQLALCHEMY_MAX_OVERFLOW", 20),
+        "pool_timeout": config.get("SQLALCHEMY_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("SQLALCHEMY_POOL_RECYCLE", 1800),
+        "pool_pre_ping": liveness == "pre_ping",
+    }
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS with the pool settings folded in"""
+    uri = config.get("SQLALCHEMY_DATABASE_URI") or ""
+    # sqlite picks its own single-connection pools
+    options = {} if uri.startswith("sqlite") else pool_options(config)
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+_engines = {}
+
+
+def register(name, engine):
+    """Report an engine's pool under name in pool_stats()"""
+    _engines[name] = engine
+
+
+def reset_pool_stats():
+    """Zero the checkout counters of every registered pool"""
+    for engine in _engines.values():
+        if isinstance(engine.pool, TimedPool):
+            engine.pool.stats.reset()
+
+
+def pool_stats():
+    """{engine name: pool numbers} for this worker process"""
+    stats = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        if isinstance(pool, TimedPool):
+            stats[name] = {"pid": os.getpid(), **pool.stats.snapshot(pool)}
+        else:
+            stats[name] = {"pid": os.getpid(), "pool": type(pool).__name__}
+    return stats
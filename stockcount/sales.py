@@ -0,0 +1,136 @@
+"""
+sales.py is the one place that decides which sales source counts
+
+R365 (stockcount_sales) is the source of record and Toast
+(stockcount_sales_toast) fills in where R365 has nothing yet.  The choice
+is made per store, date and ingredient (or menu item), inside a single
+grouped query over the whole date range, so every page sees the same
+numbers whatever subset of items it asks for.
+
+Months compacted by the retention policy (see stockcount.partitions)
+keep their daily ingredient usage per source in stockcount_sales_compact,
+which is read in place of the dropped rows when a range reaches back
+that far.  Menu item level has no compacted rows.
+
+Rows come back with both raw values, the resolved sales and the source
+it came from:
+
+    store_id, <ingredient|menuitem>, date, r365_sales, toast_sales,
+    sales, source
+"""
+
+import pandas as pd
+from sqlalchemy import case, func, literal, union_all
+
+from stockcount.models import (
+    StockcountSales,
+    StockcountSalesCompact,
+    StockcountSalesToast,
+    db,
+)
+from stockcount.partitions import compacted_before
+
+# level -> source -> (name column, aggregated value)
+# Toast repeats a menu item's sales_count on each of its ingredient rows,
+# so at menu item level it is taken once, not summed.
+LEVELS = {
+    "ingredient": {
+        "r365": (StockcountSales.ingredient, func.sum(StockcountSales.count_usage)),
+        "toast": (
+            StockcountSalesToast.ingredient,
+            func.sum(StockcountSalesToast.count_usage),
+        ),
+    },
+    "menuitem": {
+        "r365": (StockcountSales.menuitem, func.sum(StockcountSales.sales_count)),
+        "toast": (
+            StockcountSalesToast.menuitem,
+            func.max(StockcountSalesToast.sales_count),
+        ),
+    },
+}
+MODELS = {"r365": StockcountSales, "toast": StockcountSalesToast}
+
+
+def sales_query(store_ids, start_date, end_date, level="ingredient", names=None):
+    """The resolver as a query, for callers that want to extend it"""
+    selects = []
+    for source, (name, value) in LEVELS[level].items():
+        model = MODELS[source]
+        select = (
+            db.select(
+                model.store_id.label("store_id"),
+                name.label("name"),
+                model.date.label("date"),
+                literal(source).label("source"),
+                value.label("sales"),
+            )
+            .where(
+                model.store_id.in_(store_ids),
+                model.date >= start_date,
+                model.date <= end_date,
+            )
+            .group_by(model.store_id, name, model.date)
+        )
+        if names is not None:
+            select = select.where(name.in_(names))
+        selects.append(select)
+    if level == "ingredient":
+        before = compacted_before()
+        if before is not None and start_date < before:
+            selects.append(compacted_query(store_ids, start_date, end_date, names))
+    tagged = union_all(*selects).subquery()
+
+    def by_source(source):
+        return func.sum(case((tagged.c.source == source, tagged.c.sales)))
+
+    r365, toast = by_source("r365"), by_source("toast")
+    return db.select(
+        tagged.c.store_id,
+        tagged.c.name.label(level),
+        tagged.c.date,
+        r365.label("r365_sales"),
+        toast.label("toast_sales"),
+        func.coalesce(r365, toast).label("sales"),
+        case((r365.isnot(None), "r365"), (toast.isnot(None), "toast")).label(
+            "source"
+        ),
+    ).group_by(tagged.c.store_id, tagged.c.name, tagged.c.date)
+
+
+def compacted_query(store_ids, start_date, end_date, names=None):
+    """Compacted ingredient usage, shaped like a sales_query branch"""
+    compact = StockcountSalesCompact
+    select = (
+        db.select(
+            compact.store_id.label("store_id"),
+            compact.ingredient.label("name"),
+            compact.date.label("date"),
+            compact.source.label("source"),
+            func.sum(compact.count_usage).label("sales"),
+        )
+        .where(
+            compact.store_id.in_(store_ids),
+            compact.date >= start_date,
+            compact.date <= end_date,
+        )
+        .group_by(compact.store_id, compact.ingredient, compact.date, compact.source)
+    )
+    if names is not None:
+        select = select.where(compact.ingredient.in_(names))
+    return select
+
+
+def resolved_sales(store_ids, start_date, end_date, level="ingredient", names=None):
+    """Preferred sales per store, name and date between start and end"""
+    query = sales_query(store_ids, start_date, end_date, level, names)
+    return sales_frame(db.session.execute(query).all(), level)
+
+
+def sales_frame(rows, level="ingredient"):
+    """DataFrame of sales_query rows"""
+    columns = ["store_id", level, "date", "r365_sales", "toast_sales"]
+    frame = pd.DataFrame(
+        [tuple(row) for row in rows], columns=columns + ["sales", "source"]
+    )
+    return frame.astype({"r365_sales": float, "toast_sales": float, "sales": float})
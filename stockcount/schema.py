@@ -0,0 +1,81 @@
+"""
+schema.py loads the few tables the app uses without declaring a model
+
+The app works from its declared models, so nothing is introspected at
+startup unless REFLECT_TABLES names tables to add.  Those are reflected
+once and pickled to SCHEMA_CACHE_FILE, keyed by the table names, the
+database and the newest migration, and later workers load the snapshot
+instead of asking the database.  ``flask schema snapshot`` rebuilds it
+after tables change outside the migrations.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+from sqlalchemy import MetaData
+
+from stockcount import migrations
+from stockcount.models import db
+
+logger = logging.getLogger(__name__)
+
+
+# tables added by reflect_tables, as opposed to declared ones
+_reflected = set()
+
+
+def snapshot_key(names):
+    head = max((version for version, _, _ in migrations.MIGRATIONS), default="")
+    url = db.engine.url.render_as_string(hide_password=True)
+    return hashlib.sha1(json.dumps([sorted(names), url, head]).encode()).hexdigest()
+
+
+def read_snapshot(path, key):
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return snapshot["metadata"] if snapshot.get("key") == key else None
+
+
+def write_snapshot(path, key, metadata):
+    # write then rename, so a starting worker never reads a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump({"key": key, "metadata": metadata}, f)
+    os.replace(tmp, path)
+
+
+def reflect_tables(app, refresh=False):
+    """
+    Add the REFLECT_TABLES that have no model to db.metadata, from the
+    snapshot when it is current.  Returns the names added.
+    """
+    names = [
+        name
+        for name in app.config.get("REFLECT_TABLES") or []
+        if name in _reflected or name not in db.metadata.tables
+    ]
+    if not names:
+        return []
+
+    path = app.config.get("SCHEMA_CACHE_FILE")
+    key = snapshot_key(names)
+    metadata = None if refresh or not path else read_snapshot(path, key)
+    if metadata is None:
+        metadata = MetaData()
+        metadata.reflect(bind=db.engine, only=names)
+        logger.info(f"Reflected {', '.join(names)}")
+        if path:
+            write_snapshot(path, key, metadata)
+    for name in names:
+        if name in db.metadata.tables:
+            db.metadata.remove(db.metadata.tables[name])
+        metadata.tables[name].to_metadata(db.metadata)
+        _reflected.add(name)
+    return names
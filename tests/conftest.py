@@ -0,0 +1,98 @@
+"""
+Shared fixtures: an app on an empty in-memory SQLite database, with the
+process-wide caches dropped around every test
+"""
+
+import json
+import os
+import tempfile
+from datetime import date
+
+import pytest
+
+# stockcount.config reads its file at import
+if "STOCKCOUNT_CONFIG" not in os.environ:
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".json", prefix="stockcount-test-", delete=False
+    ) as config_file:
+        json.dump({"SECRET_KEY": "test", "SECURITY_PASSWORD_SALT": "test"}, config_file)
+    os.environ["STOCKCOUNT_CONFIG"] = config_file.name
+
+from stockcount import create_app  # noqa: E402
+from stockcount.access import store_access  # noqa: E402
+from stockcount.config import Config  # noqa: E402
+from stockcount.fiscal import invalidate  # noqa: E402
+from stockcount.models import InvCount, InvItems, db  # noqa: E402
+
+# the generated calendar's first fiscal year
+YEAR_START = date(2024, 1, 1)
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    WTF_CSRF_ENABLED = False
+    REPORT_CACHE_ENABLED = False
+    FISCAL_YEAR_START = YEAR_START.isoformat()
+    FISCAL_YEARS = 3
+    ARCHIVE_AFTER_MONTHS = None
+
+
+@pytest.fixture
+def app(tmp_path):
+    class AppConfig(TestConfig):
+        ARCHIVE_DIR = str(tmp_path / "archive")
+
+    app = create_app(AppConfig)
+    with app.app_context():
+        db.create_all()
+        invalidate()
+        store_access.invalidate()
+        yield app
+        db.session.remove()
+    invalidate()
+    store_access.invalidate()
+
+
+@pytest.fixture
+def item(app):
+    """An inventory item of store 1, 10 to the case"""
+    unit = InvItems(item_name="BEEF Ribeye", case_pack=10, store_id=1)
+    db.session.add(unit)
+    db.session.commit()
+    return unit
+
+
+def add_count(item, day, total, count_time="PM"):
+    db.session.add(
+        InvCount(
+            trans_date=day,
+            count_time=count_time,
+            item_name=item.item_name,
+            case_count=0,
+            each_count=total,
+            count_total=total,
+            previous_total=0,
+            theory=0,
+            daily_variance=0,
+            item_id=item.id,
+            store_id=item.store_id,
+        )
+    )
+
+
+def counts(item):
+    """(trans_date, count_total, previous_total, theory, daily_variance)"""
+    rows = (
+        db.session.query(
+            InvCount.trans_date,
+            InvCount.count_total,
+            InvCount.previous_total,
+            InvCount.theory,
+            InvCount.daily_variance,
+        )
+        .filter(InvCount.item_id == item.id)
+        .order_by(InvCount.trans_date, InvCount.count_time)
+    )
+    return [tuple(row) for row in rows]
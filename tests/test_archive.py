@@ -0,0 +1,111 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+from conftest import add_count, counts
+from test_sales import add_sale
+
+from stockcount import archive
+from stockcount.counts.utils import recompute_counts
+from stockcount.models import (
+    InvCount,
+    StockcountArchive,
+    StockcountSales,
+    StockcountSalesToast,
+    StockcountVarianceDirty,
+    db,
+)
+from stockcount.partitions import MIN_COMPACT_MONTHS, add_months
+from stockcount.sales import resolved_sales
+
+JANUARY, FEBRUARY = date(2024, 1, 1), date(2024, 2, 1)
+DAYS = [date(2024, 1, 10), date(2024, 1, 20), date(2024, 2, 5)]
+
+
+@pytest.fixture
+def counted(item):
+    for day, total in zip(DAYS, (10, 12, 15)):
+        add_count(item, day, total)
+    db.session.commit()
+    recompute_counts(item.store_id)
+    db.session.commit()
+    return item
+
+
+def archive_january(app, model):
+    return archive.archive_month(db.engine, app.config["ARCHIVE_DIR"], model, JANUARY)
+
+
+def test_counts_round_trip(app, counted):
+    before = archive.history(InvCount, [1], JANUARY, DAYS[-1], archive.COUNT_COLUMNS)
+
+    assert archive_january(app, InvCount) == 2
+    assert db.session.query(InvCount).count() == 1
+    ((path,),) = db.session.query(StockcountArchive.path).all()
+    assert os.path.exists(os.path.join(app.config["ARCHIVE_DIR"], path))
+    assert "store_id=1/month=2024-01" in path
+
+    after = archive.history(InvCount, [1], JANUARY, DAYS[-1], archive.COUNT_COLUMNS)
+    pd.testing.assert_frame_equal(after, before, check_dtype=False)
+    # the range and where filters are pushed into the archive read
+    narrow = archive.history(
+        InvCount, [1], DAYS[1], DAYS[1], ["count_total"], {"item_id": [counted.id]}
+    )
+    assert narrow.values.tolist() == [[1, DAYS[1], 12]]
+
+
+def queued():
+    rows = db.session.query(StockcountVarianceDirty.date).order_by("date")
+    return [day for (day,) in rows]
+
+
+def test_archiving_drops_the_months_dirty_days(app, counted):
+    assert min(queued()) == DAYS[0]
+
+    archive_january(app, InvCount)
+    assert min(queued()) == DAYS[2]
+    assert archive.archived_until(1) == FEBRUARY
+    assert archive.archived_until(2) is None
+
+
+def test_recompute_anchors_on_the_archive(app, counted):
+    archive_january(app, InvCount)
+    assert archive.archived_counts(1) == {counted.id: 12}
+
+    assert recompute_counts(1) == 0
+    assert counts(counted) == [(DAYS[2], 15, 12, 12, 3)]
+
+
+def test_sales_round_trip(app):
+    add_sale(StockcountSales, DAYS[0], "Ribeye 12oz", "BEEF Ribeye", 4, 3.0)
+    add_sale(StockcountSalesToast, DAYS[1], "Ribeye 12oz", "BEEF Ribeye", 2, 1.5)
+    add_sale(StockcountSalesToast, DAYS[2], "Ribeye 12oz", "BEEF Ribeye", 1, 0.5)
+    db.session.commit()
+    columns = ["store_id", "ingredient", "date", "sales", "source"]
+    before = resolved_sales([1], JANUARY, DAYS[-1])[columns]
+
+    archive_january(app, StockcountSales)
+    archive_january(app, StockcountSalesToast)
+    assert resolved_sales([1], JANUARY, DAYS[-1])["date"].tolist() == [DAYS[2]]
+
+    after = archive.sales_history([1], JANUARY, DAYS[-1])[columns]
+    pd.testing.assert_frame_equal(after, before, check_dtype=False)
+
+
+def test_apply_archive_moves_whole_months_past_the_horizon(app, counted):
+    config = {**app.config, "ARCHIVE_AFTER_MONTHS": MIN_COMPACT_MONTHS}
+    today = add_months(FEBRUARY, MIN_COMPACT_MONTHS)
+
+    planned = archive.apply_archive(db.engine, config, today, dry_run=True)
+    assert planned["inv_count"] == [JANUARY]
+    assert db.session.query(InvCount).count() == 3
+
+    archive.apply_archive(db.engine, config, today)
+    assert db.session.query(InvCount.trans_date).all() == [(DAYS[2],)]
+
+
+def test_archive_needs_a_directory(app):
+    config = {"ARCHIVE_AFTER_MONTHS": MIN_COMPACT_MONTHS, "ARCHIVE_DIR": None}
+    with pytest.raises(ValueError):
+        archive.archived_before(config)
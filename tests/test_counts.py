@@ -0,0 +1,65 @@
+from datetime import date
+
+from conftest import add_count, counts
+
+from stockcount.counts.utils import recompute_counts
+from stockcount.models import InvCount, InvPurchases, InvSales, db
+
+DAY1, DAY2, DAY3 = date(2024, 3, 4), date(2024, 3, 5), date(2024, 3, 6)
+
+
+def add_movement(item, day, purchased=0, sold=0):
+    common = {
+        "trans_date": day,
+        "item_name": item.item_name,
+        "each_count": 0,
+        "item_id": item.id,
+        "store_id": item.store_id,
+    }
+    if purchased:
+        db.session.add(InvPurchases(case_count=0, purchase_total=purchased, **common))
+    if sold:
+        db.session.add(InvSales(waste=0, sales_total=sold, **common))
+
+
+def test_recompute_cascades_through_the_days(item):
+    add_count(item, DAY1, 20)
+    add_count(item, DAY2, 25)
+    add_count(item, DAY3, 18)
+    add_movement(item, DAY2, purchased=12, sold=6)
+    add_movement(item, DAY3, sold=5)
+    db.session.commit()
+
+    assert recompute_counts(item.store_id) == 3
+    assert counts(item) == [
+        (DAY1, 20, 0, 0, 20),
+        (DAY2, 25, 20, 26, -1),
+        (DAY3, 18, 25, 20, -2),
+    ]
+    # nothing moved, nothing written
+    assert recompute_counts(item.store_id) == 0
+
+
+def test_recompute_since_anchors_on_the_previous_count(item):
+    add_count(item, DAY1, 20)
+    add_count(item, DAY2, 25)
+    add_count(item, DAY3, 18)
+    db.session.commit()
+    recompute_counts(item.store_id)
+
+    db.session.query(InvCount).filter_by(trans_date=DAY2).update({"count_total": 30})
+    assert recompute_counts(item.store_id, DAY2, [item.id]) == 2
+    assert counts(item) == [
+        (DAY1, 20, 0, 0, 20),
+        (DAY2, 30, 20, 20, 10),
+        (DAY3, 18, 30, 30, -12),
+    ]
+
+
+def test_recompute_orders_counts_within_a_day(item):
+    add_count(item, DAY1, 20, "AM")
+    add_count(item, DAY1, 16, "PM")
+    db.session.commit()
+
+    recompute_counts(item.store_id)
+    assert counts(item) == [(DAY1, 20, 0, 0, 20), (DAY1, 16, 20, 20, -4)]
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+from conftest import YEAR_START
+
+from stockcount import fiscal
+from stockcount.models import Calendar, db
+
+
+@pytest.fixture
+def cal(app):
+    return fiscal.fiscal_calendar()
+
+
+def test_bounds(cal):
+    # period 2 is days 28-55 of the year, quarter 1 periods 1-3
+    def days(first, last):
+        return YEAR_START + timedelta(days=first), YEAR_START + timedelta(days=last)
+
+    day = YEAR_START + timedelta(days=40)
+    assert cal.week(day) == days(35, 41)
+    assert cal.period(day) == days(28, 55)
+    assert cal.quarter(day) == days(0, 83)
+    assert cal.year(day) == days(0, 363)
+    assert cal.to_date(day, "period") == (days(28, 0)[0], day)
+
+
+def test_day(cal):
+    fiscal_day = cal.day(YEAR_START + timedelta(days=40))
+    assert (fiscal_day.period, fiscal_day.week, fiscal_day.week_of_year) == (2, 2, 6)
+    assert fiscal_day.dow == 6
+    assert fiscal_day.year == 2024
+    # strings and datetimes are the same day
+    assert cal.day("2024-02-10") == fiscal_day
+
+
+def test_last_quarter_runs_to_year_end(cal):
+    year_end = YEAR_START + timedelta(days=363)
+    assert cal.quarter(year_end) == (YEAR_START + timedelta(days=252), year_end)
+    next_year = cal.year(year_end + timedelta(days=1))
+    assert next_year[0] == year_end + timedelta(days=1)
+
+
+def test_periods_and_weeks_back(cal):
+    day = YEAR_START + timedelta(days=40)
+    assert cal.periods_back(day, 1) == (YEAR_START, YEAR_START + timedelta(days=27))
+    assert cal.weeks_back(day, 2) == cal.week(day - timedelta(weeks=2))
+    with pytest.raises(KeyError):
+        cal.periods_back(day, 2)
+
+
+def test_outside_the_calendar(cal):
+    assert YEAR_START - timedelta(days=1) not in cal
+    with pytest.raises(KeyError):
+        cal.bounds(cal.last + timedelta(days=1), "week")
+
+
+def test_reloads_once_today_is_past_the_calendar(app, monkeypatch):
+    first, second = (
+        fiscal.generate(start, 1).to_dict("records")
+        for start in (YEAR_START, YEAR_START + timedelta(days=364))
+    )
+    db.session.execute(Calendar.__table__.insert(), first)
+    db.session.commit()
+    cal = fiscal.fiscal_calendar()
+    assert cal.last == YEAR_START + timedelta(days=363)
+
+    today = [cal.last + timedelta(days=1)]
+
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return today[0]
+
+    monkeypatch.setattr(fiscal, "date", Today)
+    # not extended yet: read again once, then kept for the day
+    stale = fiscal.fiscal_calendar()
+    assert stale is not cal
+    assert fiscal.fiscal_calendar() is stale
+
+    db.session.execute(Calendar.__table__.insert(), second)
+    db.session.commit()
+    today[0] += timedelta(days=1)
+    assert today[0] in fiscal.fiscal_calendar()
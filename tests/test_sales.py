@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+from stockcount.models import StockcountSales, StockcountSalesToast, db
+from stockcount.sales import resolved_sales
+
+DAY1, DAY2 = date(2024, 3, 4), date(2024, 3, 5)
+
+
+def add_sale(model, day, menuitem, ingredient, sold, usage, store_id=1):
+    db.session.add(
+        model(
+            date=day,
+            store_id=store_id,
+            store=f"Store {store_id}",
+            menuitem=menuitem,
+            ingredient=ingredient,
+            sales_count=sold,
+            count_usage=usage,
+        )
+    )
+
+
+@pytest.fixture
+def sales(app):
+    # R365 has DAY1, Toast has both days; DAY1 Toast numbers must lose
+    add_sale(StockcountSales, DAY1, "Ribeye 12oz", "BEEF Ribeye", 4, 3.0)
+    add_sale(StockcountSales, DAY1, "Steak Frites", "BEEF Ribeye", 2, 1.0)
+    add_sale(StockcountSalesToast, DAY1, "Ribeye 12oz", "BEEF Ribeye", 9, 9.0)
+    add_sale(StockcountSalesToast, DAY2, "Ribeye 12oz", "BEEF Ribeye", 5, 4.0)
+    add_sale(StockcountSalesToast, DAY2, "Ribeye 12oz", "BEEF Ribeye", 5, 0.5, 2)
+    db.session.commit()
+
+
+def rows(frame, level="ingredient"):
+    columns = ["store_id", level, "date", "sales", "source"]
+    return [tuple(row) for row in frame[columns].sort_values(columns[:3]).values]
+
+
+def test_r365_wins_and_toast_fills_in(sales):
+    frame = resolved_sales([1], DAY1, DAY2)
+    assert rows(frame) == [
+        (1, "BEEF Ribeye", DAY1, 4.0, "r365"),
+        (1, "BEEF Ribeye", DAY2, 4.0, "toast"),
+    ]
+    day1 = frame[frame["date"] == DAY1].iloc[0]
+    assert (day1["r365_sales"], day1["toast_sales"]) == (4.0, 9.0)
+
+
+def test_menu_item_level(sales):
+    frame = resolved_sales([1], DAY1, DAY2, level="menuitem")
+    assert rows(frame, "menuitem") == [
+        (1, "Ribeye 12oz", DAY1, 4.0, "r365"),
+        (1, "Ribeye 12oz", DAY2, 5.0, "toast"),
+        (1, "Steak Frites", DAY1, 2.0, "r365"),
+    ]
+
+
+def test_stores_range_and_names(sales):
+    assert rows(resolved_sales([2], DAY1, DAY2)) == [
+        (2, "BEEF Ribeye", DAY2, 0.5, "toast")
+    ]
+    assert resolved_sales([1], DAY2, DAY2, names=["PORK Chop"]).empty
+    assert rows(resolved_sales([1, 2], DAY2, DAY2)) == [
+        (1, "BEEF Ribeye", DAY2, 4.0, "toast"),
+        (2, "BEEF Ribeye", DAY2, 0.5, "toast"),
+    ]
@@ -0,0 +1,48 @@
+from datetime import date
+
+from conftest import add_count, counts
+
+from stockcount.counts.utils import recompute_counts, submit_counts
+from stockcount.models import StockcountVarianceDirty, db
+
+DAY1, DAY2 = date(2024, 3, 4), date(2024, 3, 5)
+
+
+def entry(item, cases, each):
+    return {
+        "item_id": str(item.id),
+        "itemname": item.item_name,
+        "casecount": cases,
+        "eachcount": each,
+    }
+
+
+def test_submit_twice_replaces_the_count(item):
+    assert submit_counts(item.store_id, DAY1, "PM", [entry(item, 1, 2)]) == 1
+    # a second tablet submitting the same count
+    submit_counts(item.store_id, DAY1, "PM", [entry(item, 2, 0)])
+
+    assert counts(item) == [(DAY1, 20, 0, 0, 20)]
+
+
+def test_submit_keeps_other_count_times(item):
+    submit_counts(item.store_id, DAY1, "AM", [entry(item, 1, 0)])
+    submit_counts(item.store_id, DAY1, "PM", [entry(item, 0, 8)])
+
+    assert counts(item) == [(DAY1, 10, 0, 0, 10), (DAY1, 8, 10, 10, -2)]
+
+
+def test_submit_cascades_to_later_counts(item):
+    add_count(item, DAY2, 12)
+    db.session.commit()
+    recompute_counts(item.store_id)
+
+    submit_counts(item.store_id, DAY1, "PM", [entry(item, 1, 5)])
+    assert counts(item) == [(DAY1, 15, 0, 0, 15), (DAY2, 12, 15, 15, -3)]
+
+
+def test_submit_queues_the_variance_days(item):
+    submit_counts(item.store_id, DAY1, "PM", [entry(item, 0, 1)])
+
+    queued = db.session.query(StockcountVarianceDirty.date).order_by("date").all()
+    assert [day for (day,) in queued] == [DAY1, DAY2]